@@ -0,0 +1,93 @@
+"""
+Round trip of the circulation desk scan endpoint (catalog/desk.py), cold and cached.
+
+    python benchmarks/desk_scan.py --books 20000 --scans 2000
+
+Answers scans of copy labels and ISBNs through the whole Django stack (middleware,
+session, permissions) for a signed-in librarian. `cold` drops the desk's cache entry
+before each scan: one query on the primary key or the ISBN index; `cached` repeats codes already
+scanned, as keyboard-wedge scanners do. Reports the median and 99th percentile.
+
+Uses a temporary SQLite database and plain static files storage.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+directory = tempfile.TemporaryDirectory()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+os.environ['DATABASE_URL'] = f'sqlite:///{directory.name}/bench.sqlite3'
+os.environ['METRICS_DIR'] = f'{directory.name}/metrics'
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import Permission, User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from catalog.caching import shared_cache  # noqa: E402
+from catalog.desk import copy_key, isbn_key, parse_scan  # noqa: E402
+from catalog.labels import barcode_value  # noqa: E402
+from catalog.models import Author, Book, BookInstance  # noqa: E402
+
+
+def populate(books):
+    call_command('migrate', verbosity=0)
+    authors = Author.objects.bulk_create(Author(first_name='First', last_name=f'Author {i}') for i in range(500))
+    Book.objects.bulk_create((Book(title=f'Title {i}', summary='Summary', isbn=f'978{i:010d}', author=authors[i % 500])
+                              for i in range(books)), batch_size=1000)
+    BookInstance.objects.bulk_create((BookInstance(book_id=book_id, imprint='Imprint', status='a')
+                                      for book_id in Book.objects.values_list('pk', flat=True) for _ in range(2)),
+                                     batch_size=1000)
+    librarian = User.objects.create_user(username='librarian', password='benchmark')
+    librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+    return librarian
+
+
+def timed_scans(client, codes, cold):
+    url = reverse('desk-scan')
+    timings = []
+    for code in codes:
+        if cold:
+            # Only the desk's entry: the cached permissions stay, as between the scans of a desk
+            kind, value = parse_scan(code)
+            shared_cache.delete(copy_key(value) if kind == 'copy' else isbn_key(value))
+        start = time.perf_counter()
+        response = client.get(url, {'q': code}, secure=True)
+        timings.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f'{code}: {response.status_code}')
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--books', type=int, default=20_000)
+    parser.add_argument('--scans', type=int, default=2_000)
+    args = parser.parse_args()
+    settings.ALLOWED_HOSTS = ['testserver']
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    rng = random.Random(0)
+
+    client = Client()
+    client.force_login(populate(args.books))
+    copy_ids = list(BookInstance.objects.values_list('pk', flat=True))
+    isbns = list(Book.objects.values_list('isbn', flat=True))
+    for kind, codes in (('label', [barcode_value(rng.choice(copy_ids)) for _ in range(args.scans)]),
+                        ('ISBN', [rng.choice(isbns) for _ in range(args.scans)])):
+        for mode, cold in (('cold', True), ('cached', False)):
+            median, p99 = timed_scans(client, codes, cold)
+            print(f'{kind:>5} {mode:>6}: median {median * 1000:.2f} ms, p99 {p99 * 1000:.2f} ms')
+    directory.cleanup()
@@ -0,0 +1,116 @@
+"""
+Mixed read / checkout workload against SQLite from several processes.
+
+Compares the stock django.db.backends.sqlite3 backend with the tuned
+locallibrary.sqlite3 profile (WAL + pragmas + BEGIN IMMEDIATE):
+
+    python benchmarks/sqlite_concurrency.py --processes 8 --seconds 10
+
+Each process loops over page-like reads (book list with authors, copy counts) and,
+for --write-ratio of its iterations, checks out then returns a random copy inside a
+transaction, the way the circulation views do. Reports throughput and the number of
+"database is locked" errors per profile.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+PROFILES = {
+    'stock': {'ENGINE': 'django.db.backends.sqlite3', 'OPTIONS': {}},
+    'tuned': {'ENGINE': 'locallibrary.sqlite3', 'OPTIONS': {'transaction_mode': 'IMMEDIATE'}},
+}
+
+
+def setup_django(profile, path):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default'].update(PROFILES[profile], NAME=path)
+    django.setup()
+
+
+def populate(books, copies_per_book):
+    from django.core.management import call_command
+    from catalog.models import Author, Book, BookInstance, Language
+
+    call_command('migrate', verbosity=0)
+    language = Language.objects.create(name='French')
+    authors = Author.objects.bulk_create(Author(first_name='First', last_name=f'Author {i}') for i in range(100))
+    Book.objects.bulk_create(
+        Book(title=f'Title {i}', summary='Summary', isbn=f'{i:013d}', author=authors[i % 100], language=language)
+        for i in range(books)
+    )
+    BookInstance.objects.bulk_create(
+        BookInstance(book=book, imprint='Imprint', status='a')
+        for book in Book.objects.all() for _ in range(copies_per_book)
+    )
+
+
+def _populate(profile, path, books, copies_per_book):
+    setup_django(profile, path)
+    populate(books, copies_per_book)
+
+
+def worker(profile, path, seconds, write_ratio):
+    setup_django(profile, path)
+    from django.db import OperationalError, transaction
+    from django.db.models import Count
+    from catalog.models import Book, BookInstance
+
+    book_ids = list(Book.objects.values_list('id', flat=True))
+    reads = writes = locked = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            if random.random() < write_ratio:
+                with transaction.atomic():
+                    copy = BookInstance.objects.filter(book_id=random.choice(book_ids), status='a').first()
+                    if copy is not None:
+                        copy.status = 'o'
+                        copy.save(update_fields=['status'])
+                        copy.status = 'a'
+                        copy.save(update_fields=['status'])
+                writes += 1
+            else:
+                offset = random.randrange(len(book_ids) - 30)
+                list(Book.objects.select_related('author').annotate(copies=Count('bookinstance'))[offset:offset + 30])
+                reads += 1
+        except OperationalError as error:
+            if 'locked' not in str(error):
+                raise
+            locked += 1
+    return reads, writes, locked
+
+
+def run(profile, processes, seconds, write_ratio, books, copies_per_book):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite3')
+        with ProcessPoolExecutor(1) as pool:
+            pool.submit(_populate, profile, path, books, copies_per_book).result()
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(worker, [profile] * processes, [path] * processes,
+                                    [seconds] * processes, [write_ratio] * processes))
+    reads, writes, locked = (sum(column) for column in zip(*results))
+    print(f'{profile:>6}: {reads / seconds:9.0f} reads/s {writes / seconds:8.0f} checkouts/s '
+          f'{locked:6d} "database is locked" errors')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--copies-per-book', type=int, default=3)
+    args = parser.parse_args()
+    for name in PROFILES:
+        run(name, args.processes, args.seconds, args.write_ratio, args.books, args.copies_per_book)
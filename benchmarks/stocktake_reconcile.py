@@ -0,0 +1,75 @@
+"""
+Time and memory of the set operations of a stocktake reconciliation (catalog/stocktake.py).
+
+Compares generated copy ids, without a database:
+
+    python benchmarks/stocktake_reconcile.py --copies 1000000 --missing 0.02
+
+The branch holds `copies` uuid7 ids; the scans find all but `missing` of them, each scanned
+once or twice, plus a few ids of other branches. Reports the time and peak memory of
+loading the ids and finding the missing and unexpected copies, against Python sets of
+UUIDs doing the same (tracemalloc slows both down, the sets the most).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+
+django.setup()
+
+from catalog.stocktake import isin, sort_order, unique, uuid_array  # noqa: E402
+from catalog.uuids import uuid7  # noqa: E402
+
+
+def measure(label, function):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    print(f'{label:>25}: {elapsed:.2f}s, peak {peak:.0f} MB ({result[0]} missing, {result[1]} unexpected)')
+
+
+def with_arrays(expected, scans):
+    ids = uuid_array(expected)
+    ids = ids[sort_order(ids)]
+    scanned = unique(uuid_array(scans))
+    missing = ids[~isin(ids, scanned)]
+    unexpected = scanned[~isin(scanned, ids)]
+    return len(missing), len(unexpected)
+
+
+def with_sets(expected, scans):
+    ids = {uuid.UUID(bytes=expected[start:start + 16]) for start in range(0, len(expected), 16)}
+    scanned = {uuid.UUID(bytes=scans[start:start + 16]) for start in range(0, len(scans), 16)}
+    return len(ids - scanned), len(scanned - ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--copies', type=int, default=1_000_000)
+    parser.add_argument('--missing', type=float, default=0.02)
+    parser.add_argument('--elsewhere', type=int, default=500)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    copies = [uuid7().bytes for _ in range(args.copies)]
+    found = [copy_id for copy_id in copies if rng.random() >= args.missing]
+    # Some copies scanned twice, in no particular order
+    scans = found + rng.sample(found, len(found) // 10) + [uuid.uuid4().bytes for _ in range(args.elsewhere)]
+    rng.shuffle(scans)
+    expected, scans = b''.join(copies), b''.join(scans)
+    print(f'{args.copies} copies, {len(scans) // 16} scans')
+    measure('sorted uint64 pair arrays', lambda: with_arrays(expected, scans))
+    measure('Python sets of UUIDs', lambda: with_sets(expected, scans))
@@ -0,0 +1,79 @@
+"""
+Lookup time and memory of the typeahead prefix index (catalog/suggest.py).
+
+Fills the index with generated titles and author names, without a database:
+
+    python benchmarks/suggest_lookup.py --books 100000 --authors 20000
+
+Reports the build time, the approximate memory of the index, and the median and 99th
+percentile lookup time for prefixes of 1 to 6 characters.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from array import array
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+
+django.setup()
+
+from catalog.suggest import PrefixIndex, encode, index_keys  # noqa: E402
+
+SYLLABLES = ['la', 'ri', 'mé', 'ter', 'noi', 'ro', 'gé', 'mi', 'sa', 'bles', 'ca', 'pi', 'tal', 'ven', 'dre', 'é']
+
+
+def word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4)))
+
+
+def build(books, authors, rng):
+    """PrefixIndex.build() on generated names instead of the database."""
+    index = PrefixIndex()
+    names = [('book', pk, ' '.join(word(rng) for _ in range(rng.randint(1, 6))).capitalize()) for pk in range(books)]
+    names += [('author', pk, f'{word(rng).capitalize()} {word(rng).capitalize()}') for pk in range(authors)]
+    entries = []
+    for kind, pk, label in names:
+        ref = encode(kind, pk)
+        index.labels[ref] = label
+        entries.extend((key, ref) for key in index_keys(label))
+    del names
+    entries.sort()
+    index.keys = [key for key, _ref in entries]
+    index.refs = array('q', (ref for _key, ref in entries))
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--books', type=int, default=100_000)
+    parser.add_argument('--authors', type=int, default=20_000)
+    parser.add_argument('--lookups', type=int, default=20_000)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = build(args.books, args.authors, rng)
+    build_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    print(f'{len(index.keys)} keys built in {build_time:.2f}s, about {memory:.0f} MB')
+
+    timings = []
+    for _ in range(args.lookups):
+        prefix = word(rng)[:rng.randint(1, 6)]
+        start = time.perf_counter()
+        index.lookup(prefix)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f'lookup: median {statistics.median(timings) * 1e6:.0f} µs, '
+          f'p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f} µs')
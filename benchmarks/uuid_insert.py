@@ -0,0 +1,70 @@
+"""
+Insert throughput and primary key index size of uuid4 vs time-ordered uuid7 keys.
+
+Loads the same number of rows into a copy of the catalog_bookinstance table (as Django
+creates it on SQLite: the UUID as char(32) primary key) once per key generator:
+
+    python benchmarks/uuid_insert.py --rows 5000000
+
+Reports rows per second for the whole load and for its last batch (random keys slow
+down as the index outgrows the page cache), and the size of the primary key index.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from catalog.uuids import uuid7  # noqa: E402
+
+TABLE = '''CREATE TABLE "catalog_bookinstance" (
+    "id" char(32) NOT NULL PRIMARY KEY, "imprint" varchar(200) NOT NULL, "due_back" date NULL,
+    "status" varchar(1) NOT NULL, "book_id" bigint NULL, "borrower_id" integer NULL)'''
+
+
+def load(generator, rows, batch_size, cache_mb):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite3')
+        connection = sqlite3.connect(path, isolation_level=None)
+        connection.execute(f'PRAGMA cache_size = -{cache_mb * 1024}')
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.execute(TABLE)
+        start = time.monotonic()
+        for first in range(0, rows, batch_size):
+            batch_start = time.monotonic()
+            connection.execute('BEGIN')
+            connection.executemany(
+                'INSERT INTO catalog_bookinstance VALUES (?, ?, NULL, ?, ?, NULL)',
+                ((generator().hex, 'Imprint', 'a', (first + i) % 100000) for i in range(min(batch_size, rows - first))))
+            connection.execute('COMMIT')
+            last_batch = min(batch_size, rows - first) / (time.monotonic() - batch_start)
+        elapsed = time.monotonic() - start
+        connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        try:
+            index_pages = connection.execute(
+                "SELECT count(*) FROM dbstat WHERE name = 'sqlite_autoindex_catalog_bookinstance_1'").fetchone()[0]
+            page_size = connection.execute('PRAGMA page_size').fetchone()[0]
+            index_size = f'{index_pages * page_size / 2 ** 20:8.1f} MB index'
+        except sqlite3.OperationalError:
+            # SQLite built without the dbstat table
+            index_size = 'index size unavailable'
+        file_size = os.path.getsize(path) / 2 ** 20
+        connection.close()
+    return rows / elapsed, last_batch, index_size, file_size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--batch-size', type=int, default=50_000)
+    parser.add_argument('--cache-mb', type=int, default=20, help='SQLite page cache, as in the tuned backend.')
+    args = parser.parse_args()
+    for name, generator in (('uuid4', uuid.uuid4), ('uuid7', uuid7)):
+        throughput, last_batch, index_size, file_size = load(generator, args.rows, args.batch_size, args.cache_mb)
+        print(f'{name}: {throughput:9.0f} rows/s overall, {last_batch:9.0f} rows/s last batch, '
+              f'{index_size}, {file_size:8.1f} MB file')
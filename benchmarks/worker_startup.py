@@ -0,0 +1,94 @@
+"""
+Time from a fresh worker process to its first responses, with and without warm-up.
+
+    python benchmarks/worker_startup.py --runs 5
+
+Each run starts a new interpreter, which loads the WSGI application the way a gunicorn
+worker does, then answers one request to each of a few pages. `cold` is a worker of the
+old profile; `warm` first runs locallibrary/warmup.py, as the gunicorn master does once
+before forking (preload_app), so its first requests find everything ready. The time of
+the warm-up itself is reported apart: with preload, workers don't pay it.
+
+Uses a temporary SQLite database with a small catalog, and plain static files storage.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PATHS = ['/', '/books/', '/authors/', '/book/1', '/accounts/login/']
+
+
+def child(mode):
+    start = time.perf_counter()
+    sys.path.insert(0, str(ROOT))
+    from django.conf import settings
+
+    settings.ALLOWED_HOSTS = ['localhost']
+    # No collectstatic here: plain storage instead of the manifest
+    settings.STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+    from locallibrary.wsgi import application
+
+    timings = {'load': time.perf_counter() - start}
+    if mode == 'warm':
+        from locallibrary.warmup import warm_up
+
+        start = time.perf_counter()
+        warm_up(log=lambda message: None)
+        timings['warm-up'] = time.perf_counter() - start
+    from wsgiref.util import setup_testing_defaults
+
+    start = time.perf_counter()
+    for path in PATHS:
+        environ = {'PATH_INFO': path, 'HTTP_HOST': 'localhost', 'wsgi.url_scheme': 'https'}
+        setup_testing_defaults(environ)
+        statuses = []
+        b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+        if not statuses[0].startswith(('200', '302')):
+            raise RuntimeError(f'{path}: {statuses[0]}')
+    timings['first requests'] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+
+def populate(environment):
+    script = (
+        'import django; django.setup()\n'
+        'from django.core.management import call_command\n'
+        'from catalog.models import Author, Book, BookInstance, Language\n'
+        'call_command("migrate", verbosity=0)\n'
+        'language = Language.objects.create(name="French")\n'
+        'authors = Author.objects.bulk_create(Author(first_name="First", last_name=f"Author {i}") for i in range(200))\n'
+        'Book.objects.bulk_create(Book(title=f"Title {i}", summary="Summary", isbn=f"{i:013d}", '
+        'author=authors[i % 200], language=language) for i in range(5000))\n'
+        'BookInstance.objects.bulk_create(BookInstance(book=book, imprint="Imprint", status="a") '
+        'for book in Book.objects.all()[:500])\n'
+    )
+    subprocess.run([sys.executable, '-c', script], env=environment, cwd=ROOT, check=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', choices=['cold', 'warm'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child)
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as directory:
+        environment = dict(os.environ, SECRET_KEY='benchmark', DJANGO_DEBUG='False',
+                           DJANGO_SETTINGS_MODULE='locallibrary.settings',
+                           DATABASE_URL=f'sqlite:///{directory}/bench.sqlite3', METRICS_DIR=f'{directory}/metrics')
+        populate(environment)
+        for mode in ('cold', 'warm'):
+            runs = [json.loads(subprocess.run([sys.executable, __file__, '--child', mode], env=environment, cwd=ROOT,
+                                              check=True, capture_output=True, text=True).stdout)
+                    for _ in range(args.runs)]
+            print(f'{mode:>4}: ' + ', '.join(f'{step} {statistics.median(run[step] for run in runs) * 1000:.0f} ms'
+                                             for step in runs[0]))
@@ -1,8 +1,9 @@
 from django.contrib import admin
+from mptt.admin import MPTTModelAdmin
 
 # Register your models here.
 
-from .models import Author, Genre, Book, BookInstance, Language
+from .models import Author, Branch, Genre, Book, BookInstance, Language
 
 
 class BooksInstanceInline(admin.TabularInline):
@@ -20,6 +21,9 @@ class BookAdmin(admin.ModelAdmin):
     list_display = ('title', 'author', 'display_genre')
     inlines = [BooksInstanceInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('genre')
+
 
 # admin.site.register(Author)
 # Define the admin class
@@ -32,18 +36,18 @@ class AuthorAdmin(admin.ModelAdmin):
 # Register the admin class with the associated model
 admin.site.register(Author, AuthorAdmin)
 
-admin.site.register(Genre)
+admin.site.register(Genre, MPTTModelAdmin)
 
 
 # admin.site.register(BookInstance)
 # Register the Admin classes for BookInstance using the decorator
 @admin.register(BookInstance)
 class BookInstanceAdmin(admin.ModelAdmin):
-    list_display = ('book', 'status', 'borrower',  'due_back', 'id')
-    list_filter = ('status', 'due_back')
+    list_display = ('book', 'status', 'borrower',  'due_back', 'branch', 'id')
+    list_filter = ('branch', 'status', 'due_back')
     fieldsets = (
         ('Book info', {
-            'fields': ('book', 'imprint', 'id')
+            'fields': ('book', 'imprint', 'branch', 'id')
         }),
         ('Availability', {
             'fields': ('status', 'borrower', 'due_back')
@@ -52,3 +56,9 @@ class BookInstanceAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Language)
+
+
+@admin.register(Branch)
+class BranchAdmin(admin.ModelAdmin):
+    list_display = ('name', 'code')
+    prepopulated_fields = {'code': ('name',)}
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'catalog'
+
+    def ready(self):
+        # Signal receivers keeping the pre-rendered pages, similar books, genre counts, facets,
+        # cached permissions, typeahead index, shared snapshot and A-Z counts up to date
+        from catalog import browse, facets, genres, permissions, prerender, recommendations, snapshot, suggest  # noqa: F401
@@ -0,0 +1,178 @@
+"""
+Live availability of the copies of a book, as Server-Sent Events.
+
+`stream_app` is a plain ASGI application, mounted by locallibrary/asgi.py in front of
+Django on STREAM_PATH: each connection costs one queue and one coroutine, so a worker
+holds thousands of idle patrons. The stream starts with the state of every copy of the
+book, then sends one event per copy whose status or due date changes.
+
+Changes reach the streams through the Broker of the process:
+ - copies saved by this process are published when the transaction commits;
+ - copies saved by other processes are found by a poller, which reads the copies of
+   all the watched books with one query every POLL_SECONDS, while anyone is watching.
+
+Book pages only open the stream when settings.AVAILABILITY_STREAM says the ASGI
+application is deployed, e.g. (with uvicorn installed)
+    gunicorn locallibrary.asgi -k uvicorn.workers.UvicornWorker
+Under WSGI, the `book-availability` view answers the same URL with the current state
+and asks the browser to reconnect later, for the pages still open from before a switch.
+"""
+import asyncio
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from catalog.models import BookInstance
+
+# Path of the `book-availability` URL
+STREAM_PATH = re.compile(r'^/book/(?P<pk>\d+)/availability/$')
+POLL_SECONDS = 5
+# Comment line sent on idle streams, so that proxies don't close them
+KEEPALIVE_SECONDS = 25
+# Reconnection delay asked of the browser, in milliseconds
+RETRY_MS = 10000
+
+STATUS_DISPLAY = dict(BookInstance.LOAN_STATUS)
+
+
+def copy_state(copy):
+    """Event data of one copy, from a BookInstance values() dict."""
+    return {
+        'id': str(copy['id']),
+        'book': copy['book_id'],
+        'status': copy['status'],
+        'status_display': STATUS_DISPLAY.get(copy['status'], ''),
+        'due_back': copy['due_back'].isoformat() if copy['due_back'] else None,
+    }
+
+
+def read_copies(book_ids):
+    copies = BookInstance.objects.filter(book__in=book_ids).order_by().values('id', 'book_id', 'status', 'due_back')
+    return [copy_state(copy) for copy in copies]
+
+
+def sse_event(data, event=None):
+    lines = [f'event: {event}'] if event else []
+    lines.append(f'data: {json.dumps(data)}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class Broker:
+    """Subscriptions of the streams of this process, by book. Used from the event loop only."""
+
+    def __init__(self):
+        self.loop = None
+        self.queues = {}
+        # Last known state of the watched copies, by copy id
+        self.states = {}
+        self.poller = None
+
+    def subscribe(self, book_id, copies):
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        for copy in copies:
+            # The snapshot may be newer than what the other streams of the book have seen
+            self.publish(copy)
+        self.queues.setdefault(book_id, set()).add(queue)
+        self.states.update((copy['id'], copy) for copy in copies)
+        if self.poller is None or self.poller.done():
+            self.poller = self.loop.create_task(self.poll())
+        return queue
+
+    def unsubscribe(self, book_id, queue):
+        queues = self.queues.get(book_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.queues.pop(book_id, None)
+            self.states = {copy_id: copy for copy_id, copy in self.states.items() if copy['book'] != book_id}
+
+    def publish(self, copy):
+        """Send `copy` to the streams of its book, unless they already have this state."""
+        if copy['book'] not in self.queues or self.states.get(copy['id']) == copy:
+            return
+        self.states[copy['id']] = copy
+        for queue in self.queues[copy['book']]:
+            queue.put_nowait(copy)
+
+    def publish_threadsafe(self, copies):
+        """Publish from a thread of a sync view."""
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            for copy in copies:
+                loop.call_soon_threadsafe(self.publish, copy)
+
+    async def poll(self):
+        while self.queues:
+            await asyncio.sleep(POLL_SECONDS)
+            if not self.queues:
+                break
+            try:
+                copies = await sync_to_async(self.read, thread_sensitive=False)(list(self.queues))
+            except Exception:
+                # The database may be briefly unreachable: keep the streams open, try again later
+                continue
+            for copy in copies:
+                self.publish(copy)
+
+    @staticmethod
+    def read(book_ids):
+        close_old_connections()
+        try:
+            return read_copies(book_ids)
+        finally:
+            close_old_connections()
+
+
+broker = Broker()
+
+
+@receiver([post_save, post_delete], sender=BookInstance)
+def copy_changed(sender, instance, **kwargs):
+    if not broker.queues or not instance.book_id:
+        return
+    book_id = instance.book_id
+    # The status of this process's watched books is read again once the change is visible
+    transaction.on_commit(lambda: broker.publish_threadsafe(read_copies([book_id])))
+
+
+async def stream_app(scope, receive, send):
+    """ASGI application of STREAM_PATH."""
+    book_id = int(STREAM_PATH.match(scope['path'])['pk'])
+    copies = await sync_to_async(broker.read, thread_sensitive=False)([book_id])
+    # Subscribed before sending the snapshot: no change can fall in between
+    queue = broker.subscribe(book_id, copies)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # Tell nginx not to buffer the stream
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'more_body': True,
+                    'body': f'retry: {RETRY_MS}\n\n'.encode() + sse_event(copies, 'snapshot')})
+        while not disconnected.done():
+            change = asyncio.ensure_future(queue.get())
+            done, _pending = await asyncio.wait({change, disconnected}, timeout=KEEPALIVE_SECONDS,
+                                                return_when=asyncio.FIRST_COMPLETED)
+            if change in done:
+                await send({'type': 'http.response.body', 'body': sse_event(change.result()), 'more_body': True})
+            else:
+                change.cancel()
+                if not done:
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+    except OSError:
+        # Client gone while writing
+        pass
+    finally:
+        disconnected.cancel()
+        broker.unsubscribe(book_id, queue)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
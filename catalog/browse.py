@@ -0,0 +1,73 @@
+"""
+A-Z index of the authors and book titles.
+
+Authors and books carry a folded copy of their name (Author.name_key, Book.title_key,
+see catalog/text.py): "Émile", "emile" and "Emile" all sort under E, and a letter is
+a range of that indexed column, read in order from the index. Anything not starting
+with a letter of the Latin alphabet (digits, other scripts) goes under '#'.
+
+The number of names under each letter comes from one grouped query per list, kept in
+the shared cache until an author or a book changes, at most TIMEOUT.
+"""
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Substr
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from catalog.caching import shared_cache
+from catalog.models import Author, Book
+
+TIMEOUT = 60 * 60
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ#'
+# Kind: (model, folded name field)
+BROWSE = {
+    'author': (Author, 'name_key'),
+    'book': (Book, 'title_key'),
+}
+
+
+def cache_key(kind):
+    return f'catalog:browse:{kind}'
+
+
+def letter_filter(field, letter):
+    """Condition on the folded `field` for the names under `letter`."""
+    if letter == '#':
+        # Below 'a' or after 'z' ('{' follows it)
+        return Q(**{f'{field}__lt': 'a'}) | Q(**{f'{field}__gte': '{'})
+    low = letter.lower()
+    return Q(**{f'{field}__gte': low, f'{field}__lt': chr(ord(low) + 1)})
+
+
+def letter_counts(kind):
+    """{letter: number of names under it} for the authors or the books."""
+    counts = shared_cache.get(cache_key(kind))
+    if counts is None:
+        model, field = BROWSE[kind]
+        initials = model.objects.order_by().values(initial=Substr(field, 1, 1)).annotate(count=Count('pk'))
+        counts = dict.fromkeys(LETTERS, 0)
+        for row in initials:
+            # Empty for names without a letter or digit ('???')
+            initial = row['initial'].upper()
+            counts[initial if len(initial) == 1 and initial in LETTERS else '#'] += row['count']
+        shared_cache.set(cache_key(kind), counts, TIMEOUT)
+    return counts
+
+
+def letter_index(kind, current=None):
+    """(letter, count, is current) of each letter, for catalog/letter_index.html."""
+    return [(letter, count, letter == current) for letter, count in letter_counts(kind).items()]
+
+
+@receiver([post_save, post_delete], sender=Author)
+@receiver([post_save, post_delete], sender=Book)
+def name_changed(sender, **kwargs):
+    # The copy counters of Book change on every loan: skip them
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not set(update_fields) & set(sender.browse_key_sources):
+        return
+    key = cache_key('author' if sender is Author else 'book')
+    shared_cache.delete(key)
+    # Counts computed by other requests before the commit are stale too
+    transaction.on_commit(lambda: shared_cache.delete(key))
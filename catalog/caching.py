@@ -0,0 +1,12 @@
+"""
+The cache shared by the worker processes: CACHES['shared'] in the settings.
+
+What one worker deletes or bumps there is gone for all of them, so it holds the
+entries invalidated by signal receivers (permissions, counts, versions). The 'default'
+cache lives in the memory of each process: only for entries that may be stale until
+they expire.
+"""
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+shared_cache = ConnectionProxy(caches, 'shared')
@@ -0,0 +1,94 @@
+"""
+Loan history.
+
+The circulation views describe what happened to a copy with `loan_events()` and hand
+the events to `record_loan_events()`. Events are appended to LoanEvent with one bulk
+insert, and the per-book, per-genre and per-month counters are incremented in the
+same transaction, so that statistics read a few pre-aggregated rows instead of
+scanning the history.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from catalog.models import Book, BookLoanStats, GenreLoanStats, LoanEvent, MonthlyLoanStats
+
+COUNTER_FIELDS = {
+    LoanEvent.CHECKOUT: 'checkouts',
+    LoanEvent.RETURN: 'returns',
+    LoanEvent.RENEW: 'renewals',
+}
+
+
+def loan_events(book_instance, previous_status, previous_due_back):
+    """Return the events (unsaved LoanEvent) turning the previous state of a copy into its current one."""
+    if book_instance.status == 'o' and previous_status != 'o':
+        kind = LoanEvent.CHECKOUT
+    elif book_instance.status != 'o' and previous_status == 'o':
+        kind = LoanEvent.RETURN
+    elif book_instance.status == 'o' and book_instance.due_back != previous_due_back:
+        kind = LoanEvent.RENEW
+    else:
+        return []
+    return [LoanEvent(
+        book_instance_id=book_instance.pk,
+        book_id=book_instance.book_id,
+        borrower_id=book_instance.borrower_id,
+        kind=kind,
+        due_back=book_instance.due_back,
+        created_at=timezone.now(),
+    )]
+
+
+def month_of(moment):
+    return timezone.localtime(moment).date().replace(day=1)
+
+
+def increment(model, counts, **keys):
+    """Add `counts` ({field: n}) to the row of `model` identified by `keys`, creating it if needed."""
+    updates = {field: F(field) + n for field, n in counts.items()}
+    if model.objects.filter(**keys).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **counts)
+    except IntegrityError:
+        # Created meanwhile by another request
+        model.objects.filter(**keys).update(**updates)
+
+
+def record_loan_events(events):
+    """Append `events` to the log and update the rollups."""
+    events = list(events)
+    if not events:
+        return
+    genres = {}
+    for book_id, genre_id in Book.genre.through.objects.filter(
+            book__in={event.book_id for event in events}).values_list('book_id', 'genre_id'):
+        genres.setdefault(book_id, []).append(genre_id)
+
+    by_book, by_genre, by_month = Counter(), Counter(), Counter()
+    for event in events:
+        field, month = COUNTER_FIELDS[event.kind], month_of(event.created_at)
+        by_month[month, field] += 1
+        if event.book_id:
+            by_book[event.book_id, month, field] += 1
+        for genre_id in genres.get(event.book_id, []):
+            by_genre[genre_id, month, field] += 1
+
+    with transaction.atomic():
+        LoanEvent.objects.bulk_create(events, batch_size=1000)
+        for (book_id, month, field), n in by_book.items():
+            increment(BookLoanStats, {field: n}, book_id=book_id, month=month)
+        for (genre_id, month, field), n in by_genre.items():
+            increment(GenreLoanStats, {field: n}, genre_id=genre_id, month=month)
+        for (month, field), n in by_month.items():
+            increment(MonthlyLoanStats, {field: n}, month=month)
+
+
+def most_borrowed_books(month, limit=5):
+    """Books with the most checkouts in `month`, from the rollup table."""
+    return BookLoanStats.objects.filter(month=month, checkouts__gt=0).select_related('book').order_by(
+        '-checkouts')[:limit]
@@ -0,0 +1,188 @@
+"""
+Duplicate authors and books.
+
+Candidates come from two passes, both linear in the number of rows:
+ - exact match keys: accent- and case-folded names, and ISBNs in their ISBN-13 form;
+ - MinHash of the character trigrams of the names, bucketed by LSH bands: only rows
+   sharing a band are compared, and a pair is kept when the Jaccard similarity of
+   their trigrams reaches SIMILARITY.
+
+`find_duplicates()` stores the pairs in DuplicateCandidate, for review by the staff
+on the `duplicates` page. `merge_authors()` and `merge_books()` move everything
+pointing to the duplicates onto the kept row, in one transaction.
+"""
+import re
+import zlib
+from collections import defaultdict
+from itertools import combinations
+
+import numpy as np
+from django.db import transaction
+
+from catalog import prerender
+from catalog.circulation import COUNTER_FIELDS, increment
+from catalog.models import (Author, Book, BookInstance, BookLoanStats, DuplicateCandidate, LoanEvent,
+                            LoanEventArchive, SimilarBook)
+from catalog.text import normalize
+
+SIMILARITY = 0.6
+NUM_HASHES = 32
+# 8 bands of 4 hashes: pairs from a Jaccard similarity of about (1/8) ** (1/4) = 0.6 share a band
+BANDS = 8
+ROWS = NUM_HASHES // BANDS
+# Buckets bigger than this (very common names) are not compared, to stay sub-quadratic
+MAX_BUCKET = 50
+
+PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20221019)
+HASH_A = _rng.integers(1, PRIME, NUM_HASHES, dtype=np.uint64)
+HASH_B = _rng.integers(0, PRIME, NUM_HASHES, dtype=np.uint64)
+
+ISBN_CHARACTERS_RE = re.compile(r'[^0-9X]')
+
+
+def isbn13(isbn):
+    """The ISBN-13 form of an ISBN-10 or ISBN-13, or the cleaned value if it is neither."""
+    isbn = ISBN_CHARACTERS_RE.sub('', isbn.upper())
+    if len(isbn) == 10 and isbn[:9].isdigit():
+        isbn = '978' + isbn[:9]
+        check = sum(int(digit) * (1 if position % 2 == 0 else 3) for position, digit in enumerate(isbn))
+        isbn += str((10 - check % 10) % 10)
+    return isbn
+
+
+def author_key(first_name, last_name):
+    return ' '.join(sorted(normalize(f'{first_name} {last_name}').split()))
+
+
+def trigrams(text):
+    text = f'  {text} '
+    return {text[start:start + 3] for start in range(len(text) - 2)}
+
+
+def minhash(grams):
+    values = np.array([zlib.crc32(gram.encode('utf-8')) % PRIME for gram in grams], dtype=np.uint64)
+    return ((HASH_A[:, None] * values[None, :] + HASH_B[:, None]) % PRIME).min(axis=1)
+
+
+def exact_pairs(keys):
+    """Pairs of ids sharing a key, from {id: key}."""
+    groups = defaultdict(list)
+    for row_id, key in keys.items():
+        if key:
+            groups[key].append(row_id)
+    for ids in groups.values():
+        # Each duplicate paired with the first row: merging them one by one merges the group
+        for other in ids[1:]:
+            yield ids[0], other
+
+
+def similar_pairs(texts, similarity=SIMILARITY):
+    """(id, id, Jaccard similarity) of the texts, from {id: normalised text}, that look alike."""
+    grams = {row_id: trigrams(text) for row_id, text in texts.items() if text}
+    buckets = defaultdict(list)
+    for row_id, row_grams in grams.items():
+        signature = minhash(row_grams)
+        for band in range(BANDS):
+            buckets[band, signature[band * ROWS:(band + 1) * ROWS].tobytes()].append(row_id)
+    seen = set()
+    for ids in buckets.values():
+        if len(ids) > MAX_BUCKET:
+            continue
+        for pair in combinations(sorted(ids), 2):
+            if pair in seen:
+                continue
+            seen.add(pair)
+            first, second = grams[pair[0]], grams[pair[1]]
+            score = len(first & second) / len(first | second)
+            if score >= similarity:
+                yield pair[0], pair[1], score
+
+
+def author_candidates():
+    authors = {pk: author_key(first_name, last_name)
+               for pk, first_name, last_name in Author.objects.values_list('pk', 'first_name', 'last_name')}
+    for first, second in exact_pairs(authors):
+        yield first, second, 1.0, 'same name'
+    for first, second, score in similar_pairs(authors):
+        if authors[first] != authors[second]:
+            yield first, second, score, 'similar name'
+
+
+def book_candidates():
+    books = list(Book.objects.values_list('pk', 'isbn', 'title', 'author_id'))
+    for first, second in exact_pairs({pk: isbn13(isbn) for pk, isbn, _title, _author in books}):
+        yield first, second, 1.0, 'same ISBN'
+    # Same title by the same author, written differently
+    titles = {pk: f'{normalize(title)} {author_id or ""}' for pk, _isbn, title, author_id in books}
+    for first, second, score in similar_pairs(titles):
+        yield first, second, score, 'similar title'
+
+
+def find_duplicates():
+    """Replace the pending candidates with the pairs found now. Dismissed pairs stay dismissed."""
+    candidates = {}
+    passes = ((DuplicateCandidate.AUTHOR, author_candidates()), (DuplicateCandidate.BOOK, book_candidates()))
+    for kind, pairs in passes:
+        for first, second, score, reason in pairs:
+            first, second = sorted((first, second))
+            # The exact match comes first and wins over the similar one
+            candidates.setdefault((kind, first, second), (score, reason))
+    with transaction.atomic():
+        dismissed = set(DuplicateCandidate.objects.filter(dismissed=True).values_list(
+            'kind', 'first_id', 'second_id'))
+        pending = candidates.keys() - dismissed
+        DuplicateCandidate.objects.filter(dismissed=False).delete()
+        DuplicateCandidate.objects.bulk_create([
+            DuplicateCandidate(kind=kind, first_id=first, second_id=second, score=candidates[kind, first, second][0],
+                               reason=candidates[kind, first, second][1])
+            for kind, first, second in pending
+        ], batch_size=1000)
+    return len(pending)
+
+
+def forget_candidates(kind, ids):
+    DuplicateCandidate.objects.filter(kind=kind).filter(first_id__in=ids).delete()
+    DuplicateCandidate.objects.filter(kind=kind).filter(second_id__in=ids).delete()
+
+
+def forget_desk_entries(copy_ids, book_ids):
+    # The desk imports this module
+    from catalog.desk import forget_changed
+
+    forget_changed(copy_ids, book_ids)
+
+
+@transaction.atomic
+def merge_authors(keep, duplicates):
+    """Move the books of the `duplicates` authors to `keep`, then delete the duplicates."""
+    ids = [author.pk for author in duplicates if author.pk != keep.pk]
+    book_ids = list(Book.objects.filter(author__in=ids).values_list('pk', flat=True))
+    Book.objects.filter(pk__in=book_ids).update(author=keep)
+    forget_candidates(DuplicateCandidate.AUTHOR, ids)
+    Author.objects.filter(pk__in=ids).delete()
+    prerender.refresh(book_ids=book_ids, author_ids=[keep.pk])
+    # The desk shows the author of the books and of their copies
+    forget_desk_entries(BookInstance.objects.filter(book__in=book_ids).values_list('pk', flat=True), book_ids)
+
+
+@transaction.atomic
+def merge_books(keep, duplicates):
+    """Move the copies, genres, loan history and statistics of the `duplicates` books to `keep`,
+    then delete the duplicates."""
+    ids = [book.pk for book in duplicates if book.pk != keep.pk]
+    copy_ids = list(BookInstance.objects.filter(book__in=ids).values_list('pk', flat=True))
+    # Also updates the copy counters of the books
+    BookInstance.objects.filter(book__in=ids).update(book=keep)
+    keep.genre.add(*Book.genre.through.objects.filter(book__in=ids).values_list('genre', flat=True))
+    LoanEvent.objects.filter(book_id__in=ids).update(book_id=keep.pk)
+    LoanEventArchive.objects.filter(book_id__in=ids).update(book_id=keep.pk)
+    for stats in BookLoanStats.objects.filter(book__in=ids):
+        increment(BookLoanStats, {field: getattr(stats, field) for field in COUNTER_FIELDS.values()},
+                  book_id=keep.pk, month=stats.month)
+    SimilarBook.objects.filter(similar__in=ids).delete()
+    forget_candidates(DuplicateCandidate.BOOK, ids)
+    # Cascades to their statistics and similar books
+    Book.objects.filter(pk__in=ids).delete()
+    prerender.refresh(book_ids=[keep.pk])
+    forget_desk_entries(copy_ids, ids + [keep.pk])
@@ -0,0 +1,215 @@
+"""
+Circulation desk: look up what was scanned, and check out, return or renew it.
+
+A scan is a copy id (its UUID, or the 40-digit barcode of its label, see
+catalog/labels.py) or the ISBN-10 or ISBN-13 of a book, with or without hyphens.
+`scan()` answers with the copy or the book and the state of its copies, read with one
+query on the primary key or the ISBN index, and keeps the answer in the shared cache
+for CACHE_SECONDS: scanners repeat the same codes, and an action re-reads the copy it
+acts on. Saving a copy or a book drops its entries for every worker, and so do the bulk
+updates of stocktake fixes and merges (`forget_changed()`); other changes (renamed
+authors) show within CACHE_SECONDS.
+
+The actions lock the copy row, check its status and record the loan event in the same
+transaction: two desks scanning the same copy don't both check it out.
+"""
+import datetime
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from catalog.caching import shared_cache
+from catalog.circulation import loan_events, record_loan_events
+from catalog.dedupe import ISBN_CHARACTERS_RE, isbn13
+from catalog.labels import parse_copy_id
+from catalog.models import Book, BookInstance
+
+CACHE_SECONDS = 60
+LOAN_WEEKS = 3
+# Copies listed with a book
+MAX_COPIES = 50
+
+STATUS_DISPLAY = dict(BookInstance.LOAN_STATUS)
+COPY_FIELDS = ('id', 'status', 'due_back', 'imprint', 'borrower__username', 'branch__code')
+BOOK_FIELDS = ('id', 'title', 'isbn', 'copies_total', 'copies_available', 'author__last_name', 'author__first_name')
+
+
+class DeskError(Exception):
+    """An action that doesn't apply to the copy in its current state."""
+
+
+def parse_scan(text):
+    """('copy', UUID) or ('isbn', ISBN-13) of a scanned code, or None if it is neither."""
+    copy_id = parse_copy_id(text)
+    if copy_id is not None:
+        return 'copy', copy_id
+    isbn = ISBN_CHARACTERS_RE.sub('', text.upper())
+    if (len(isbn) == 13 and isbn.isdigit()) or (len(isbn) == 10 and isbn[:9].isdigit()):
+        return 'isbn', isbn13(isbn)
+    return None
+
+
+def isbn10(isbn):
+    """The ISBN-10 form of an ISBN-13 starting with 978, or None."""
+    if not isbn.startswith('978'):
+        return None
+    body = isbn[3:12]
+    check = (11 - sum((10 - position) * int(digit) for position, digit in enumerate(body)) % 11) % 11
+    return body + ('X' if check == 10 else str(check))
+
+
+def author_name(last_name, first_name):
+    return ', '.join(filter(None, [last_name, first_name]))
+
+
+def copy_state(row, prefix=''):
+    """State of a copy, from a values() dict whose copy fields start with `prefix`."""
+    due_back = row[f'{prefix}due_back']
+    return {
+        'id': str(row[f'{prefix}id']),
+        'status': row[f'{prefix}status'],
+        'status_display': STATUS_DISPLAY.get(row[f'{prefix}status'], ''),
+        'due_back': due_back.isoformat() if due_back else None,
+        'overdue': bool(due_back and due_back < datetime.date.today()),
+        'borrower': row[f'{prefix}borrower__username'],
+        'branch': row[f'{prefix}branch__code'],
+    }
+
+
+def book_state(row, prefix=''):
+    return {
+        'id': row[f'{prefix}id'],
+        'title': row[f'{prefix}title'],
+        'author': author_name(row[f'{prefix}author__last_name'], row[f'{prefix}author__first_name']),
+        'isbn': row[f'{prefix}isbn'],
+    }
+
+
+def copy_key(copy_id):
+    return f'catalog:desk:copy:{copy_id}'
+
+
+def book_key(book_id):
+    return f'catalog:desk:book:{book_id}'
+
+
+def isbn_key(isbn):
+    return f'catalog:desk:isbn:{isbn}'
+
+
+def read_copy(copy_id):
+    fields = COPY_FIELDS + ('book__id', 'book__title', 'book__isbn', 'book__author__last_name',
+                            'book__author__first_name')
+    row = BookInstance.objects.filter(pk=copy_id).values(*fields).first()
+    if row is None:
+        return None
+    return {'kind': 'copy', **copy_state(row), 'book': book_state(row, 'book__') if row['book__id'] else None}
+
+
+def read_book(isbn):
+    # The ISBN as it may have been typed in: both forms hit the unique index
+    fields = BOOK_FIELDS + tuple(f'bookinstance__{field}' for field in COPY_FIELDS)
+    rows = list(Book.objects.filter(isbn__in={isbn, isbn10(isbn)} - {None}).order_by(
+        'pk', 'bookinstance__status', 'bookinstance__due_back').values(*fields)[:MAX_COPIES])
+    if not rows:
+        return None
+    first = [row for row in rows if row['id'] == rows[0]['id']]
+    return {
+        'kind': 'book',
+        **book_state(first[0]),
+        'copies_total': first[0]['copies_total'],
+        'copies_available': first[0]['copies_available'],
+        'copies': [copy_state(row, 'bookinstance__') for row in first if row['bookinstance__id']],
+    }
+
+
+def scan(text):
+    """What `text` identifies (see parse_scan), as a dict for the desk page, or None."""
+    parsed = parse_scan(text)
+    if parsed is None:
+        return None
+    kind, value = parsed
+    if kind == 'copy':
+        state = shared_cache.get(copy_key(value))
+        if state is None:
+            state = read_copy(value)
+            if state is not None:
+                shared_cache.set(copy_key(value), state, CACHE_SECONDS)
+        return state
+    book_id = shared_cache.get(isbn_key(value))
+    state = shared_cache.get(book_key(book_id)) if book_id is not None else None
+    # The book's ISBN may have changed since it was cached under this one
+    if state is None or isbn13(state['isbn']) != value:
+        state = read_book(value)
+        if state is not None:
+            shared_cache.set_many({isbn_key(value): state['id'], book_key(state['id']): state}, CACHE_SECONDS)
+    return state
+
+
+def find_borrower(text):
+    """The user with this username or email, or None."""
+    text = text.strip()
+    if not text:
+        return None
+    return User.objects.filter(Q(username=text) | Q(email__iexact=text), is_active=True).first()
+
+
+@transaction.atomic
+def act(copy_id, action, borrower=None, due_back=None):
+    """Check out (to `borrower`), return or renew a copy. Raises DeskError when it doesn't apply."""
+    copy = BookInstance.objects.select_for_update().filter(pk=copy_id).first()
+    if copy is None:
+        raise DeskError('Unknown copy.')
+    previous_status, previous_due_back = copy.status, copy.due_back
+    if action == 'checkout':
+        if copy.status != 'a':
+            raise DeskError(f'This copy is not available ({copy.get_status_display().lower()}).')
+        if borrower is None:
+            raise DeskError('Unknown borrower.')
+        copy.status, copy.borrower = 'o', borrower
+        copy.due_back = due_back or datetime.date.today() + datetime.timedelta(weeks=LOAN_WEEKS)
+    elif action == 'return':
+        if copy.status != 'o':
+            raise DeskError('This copy is not on loan.')
+        copy.status, copy.due_back = 'a', None
+    elif action == 'renew':
+        if copy.status != 'o':
+            raise DeskError('This copy is not on loan.')
+        copy.due_back = due_back or datetime.date.today() + datetime.timedelta(weeks=LOAN_WEEKS)
+    else:
+        raise DeskError('Unknown action.')
+    events = loan_events(copy, previous_status, previous_due_back)
+    if action == 'return':
+        # After the event, which names the borrower
+        copy.borrower = None
+    copy.save()
+    record_loan_events(events)
+    return copy
+
+
+def forget(keys):
+    shared_cache.delete_many(keys)
+    # Answers read by other requests before the commit are stale too
+    transaction.on_commit(lambda: shared_cache.delete_many(keys))
+
+
+def forget_changed(copy_ids=(), book_ids=()):
+    """Drop the entries of copies and books changed by bulk updates, which send no signal."""
+    forget([copy_key(pk) for pk in copy_ids] + [book_key(pk) for pk in book_ids])
+
+
+@receiver([post_save, post_delete], sender=BookInstance)
+def copy_changed(sender, instance, **kwargs):
+    forget([copy_key(instance.pk), book_key(instance.book_id)])
+
+
+@receiver([post_save, post_delete], sender=Book)
+def book_changed(sender, instance, **kwargs):
+    # Copy counters change with the copies, which drop the book already
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= {'copies_total', 'copies_available'}:
+        return
+    forget([book_key(instance.pk)])
@@ -0,0 +1,84 @@
+"""
+Facet counts of the book list.
+
+For the books matching the current filters, count how many there are per author, per
+language and per genre (a genre counting the books of its sub-genres, each book once).
+The database does the counting: one query groups the books by author and language, one
+counts the distinct books of the subtree of each genre, as in catalog/genres.py. Results are
+kept in the shared cache per filter combination, until the catalog changes; not those
+of the availability filter, which follow the copy counters of Book.
+"""
+import hashlib
+import time
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from catalog.caching import shared_cache
+from catalog.models import Author, Book, Genre, Language
+
+VERSION_KEY = 'catalog:facets:version'
+TIMEOUT = 60 * 60
+
+
+def cache_version():
+    # Starts from the clock, not from 1: if the key is evicted, the entries of an old version must not come back
+    return shared_cache.get_or_set(VERSION_KEY, time.time_ns(), None)
+
+
+def compute_facets(books):
+    """Count the books of the `books` queryset per author, language and genre, in two queries."""
+    # The ids only: whatever the joins, ordering or select_related of `books`
+    matching = books.order_by().values('pk')
+    authors, languages = Counter(), Counter()
+    # One row per (author, language) pair: about as many as authors
+    for author_id, language_id, count in Book.objects.filter(pk__in=matching).order_by().values_list(
+            'author', 'language').annotate(Count('pk')):
+        authors[author_id] += count
+        languages[language_id] += count
+    subtree_books = Book.genre.through.objects.filter(
+        book__in=matching,
+        genre__tree_id=OuterRef('tree_id'), genre__lft__gte=OuterRef('lft'), genre__lft__lte=OuterRef('rght'),
+    ).order_by().values('genre__tree_id').annotate(books=Count('book', distinct=True)).values('books')
+    genres = Genre.objects.order_by().annotate(books=Subquery(subtree_books)).values_list('id', 'books')
+    return {
+        'author': dict(authors),
+        'language': dict(languages),
+        'genre': {genre_id: books for genre_id, books in genres if books},
+    }
+
+
+def book_facets(books, filters):
+    """Facets of the `books` queryset, cached under the `filters` it was built from."""
+    if filters.get('available'):
+        # The copy counters change on every loan, without a Book signal to invalidate them
+        return compute_facets(books)
+    digest = hashlib.md5(repr(sorted(filters.items())).encode('utf-8')).hexdigest()
+    key = f'catalog:facets:{cache_version()}:{digest}'
+    facets = shared_cache.get(key)
+    if facets is None:
+        facets = compute_facets(books)
+        shared_cache.set(key, facets, TIMEOUT)
+    return facets
+
+
+def invalidate():
+    try:
+        shared_cache.incr(VERSION_KEY)
+    except ValueError:
+        # Not in the cache: nothing cached under the current version either
+        pass
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Genre)
+@receiver([post_save, post_delete], sender=Author)
+@receiver([post_save, post_delete], sender=Language)
+def catalog_changed(sender, **kwargs):
+    invalidate()
+    # Facets computed by other requests before the commit are stale too
+    transaction.on_commit(invalidate)
@@ -1,4 +1,5 @@
 import re
+from collections import defaultdict
 
 from django import forms
 import datetime
@@ -6,8 +7,15 @@ import datetime
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from .browse import LETTERS
+from .desk import find_borrower
+from .genres import genre_book_counts
+from .labels import parse_copy_id
 from .models import Book, BookInstance, Author, Genre, Language
+from .snapshot import get_snapshot
+from .uuids import uuid7_floor
 
 
 class RenewBookForm(forms.Form):
@@ -28,6 +36,28 @@ class RenewBookForm(forms.Form):
         return data
 
 
+class DeskActionForm(RenewBookForm):
+    """Action on a copy scanned at the circulation desk (see catalog/desk.py)."""
+    action = forms.ChoiceField(choices=[('checkout', 'Check out'), ('return', 'Return'), ('renew', 'Renew')])
+    borrower = forms.CharField(required=False, help_text='Username or email, to check out')
+    renewal_date = forms.DateField(required=False, label='Due back', help_text='3 weeks from today by default')
+
+    def clean_renewal_date(self):
+        if self.cleaned_data['renewal_date'] is None:
+            return None
+        return super().clean_renewal_date()
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('action') == 'checkout':
+            cleaned_data['borrower'] = find_borrower(cleaned_data.get('borrower', ''))
+            if cleaned_data['borrower'] is None:
+                self.add_error('borrower', 'No active user with this username or email.')
+        else:
+            cleaned_data['borrower'] = None
+        return cleaned_data
+
+
 class BookCreateForm(forms.ModelForm):
 
     class Meta:
@@ -43,7 +73,7 @@ class BookInstanceUpdateForm(forms.ModelForm):
 
     class Meta:
         model = BookInstance
-        fields = ['book', 'imprint', 'due_back', 'borrower', 'status']
+        fields = ['book', 'imprint', 'branch', 'due_back', 'borrower', 'status']
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -51,17 +81,127 @@ class BookInstanceUpdateForm(forms.ModelForm):
                                                      filter(id=self.instance.book.id), disabled=True)
 
 
+class GenreTreeWidget(forms.CheckboxSelectMultiple):
+    """Genre checkboxes as a collapsible tree, with the number of books of each genre and its sub-genres."""
+    template_name = 'catalog/widgets/genre_tree.html'
+    # {genre id: count} to show instead of the whole catalog's counts (see BookFilterForm.set_facets)
+    counts = None
+    # {genre id: level} when the choices are plain ids rather than model instances (see catalog/snapshot.py)
+    levels = None
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        counts = self.counts if self.counts is not None else genre_book_counts()
+        tree, parents = [], []
+        # Options come in tree order (tree_id, lft), so the parent of a node is the last node of a lower level
+        for _group, options, _index in context['widget']['optgroups']:
+            for option in options:
+                if self.levels is None:
+                    pk, level = option['value'].instance.pk, option['value'].instance.level
+                else:
+                    pk, level = option['value'], self.levels[option['value']]
+                node = {'option': option, 'count': counts.get(pk, 0), 'children': []}
+                while parents and parents[-1][0] >= level:
+                    parents.pop()
+                (parents[-1][1]['children'] if parents else tree).append(node)
+                parents.append((level, node))
+        for node in tree:
+            self.open_selected(node)
+        context['widget']['tree'] = tree
+        return context
+
+    def open_selected(self, node):
+        """Unfold the branches leading to a checked genre."""
+        node['open'] = any([self.open_selected(child) for child in node['children']])
+        return node['open'] or node['option']['selected']
+
+
 class BookFilterForm(forms.ModelForm):
     title = forms.CharField(required=False)
     author = forms.ModelChoiceField(queryset=Author.objects.all(), required=False)
-    genre = forms.ModelMultipleChoiceField(queryset=Genre.objects.all(), widget=forms.CheckboxSelectMultiple,
-                                           required=False)
+    # Selecting a genre also selects its sub-genres (see BookListView)
+    genre = forms.ModelMultipleChoiceField(queryset=Genre.objects.all(), widget=GenreTreeWidget, required=False)
     language = forms.ModelChoiceField(queryset=Language.objects.all(), required=False)
+    available = forms.BooleanField(label='Available only', required=False)
+    order = forms.ChoiceField(choices=[('', 'Title'), ('available', 'Most available')], required=False)
+    # Set by the A-Z index (see catalog/browse.py), kept by the search
+    letter = forms.ChoiceField(choices=[(letter, letter) for letter in LETTERS], required=False,
+                               widget=forms.HiddenInput)
 
     class Meta:
         model = Book
         fields = ['title', 'author', 'language', 'genre']
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Options read from the snapshot shared by the workers rather than queried (see catalog/snapshot.py)
+        self.snapshot = get_snapshot()
+        if self.snapshot is not None:
+            self.set_snapshot_choices({'author': {}, 'language': {}})
+            genres = self.snapshot['genre']
+            self.fields['genre'].choices = genres.choices()
+            self.fields['genre'].widget.levels = {pk: int(level) for pk, level in zip(genres.ids, genres.numbers)}
+
+    def set_snapshot_choices(self, facets):
+        for name in ('author', 'language'):
+            counts = facets[name]
+            labels = ((pk, f'{label} ({counts[pk]})' if counts else label) for pk, label in self.snapshot[name].choices())
+            self.fields[name].choices = [('', self.fields[name].empty_label), *labels]
+
+    def set_facets(self, facets):
+        """Show the number of matching books next to each author, language and genre (see catalog/facets.py)."""
+        if self.snapshot is not None:
+            self.set_snapshot_choices({name: defaultdict(int, facets[name]) for name in ('author', 'language')})
+        else:
+            for name in ('author', 'language'):
+                counts = facets[name]
+                self.fields[name].label_from_instance = lambda obj, counts=counts: f'{obj} ({counts.get(obj.pk, 0)})'
+        self.fields['genre'].widget.counts = facets['genre']
+
+
+class LabelSheetForm(forms.Form):
+    """Copies to print labels for: the copies of a book, created between two dates, or listed."""
+    book = forms.ModelChoiceField(queryset=Book.objects.all(), required=False, widget=forms.NumberInput,
+                                  help_text='Book id')
+    created_from = forms.DateField(required=False)
+    created_to = forms.DateField(required=False)
+    copies = forms.CharField(widget=forms.Textarea(attrs={'rows': 6}), required=False,
+                             help_text='Copy ids or scanned labels, one per line')
+    format = forms.ChoiceField(choices=[('pdf', 'PDF'), ('svg', 'SVG')], required=False)
+
+    def clean_copies(self):
+        ids = []
+        for line in self.cleaned_data['copies'].split():
+            copy_id = parse_copy_id(line)
+            if copy_id is None:
+                raise ValidationError(_('Invalid copy id: %(id)s'), params={'id': line})
+            ids.append(copy_id)
+        return ids
+
+    def clean(self):
+        data = super().clean()
+        if not self.errors and not any(data[name] for name in ('book', 'created_from', 'created_to', 'copies')):
+            raise ValidationError(_('Choose a book, creation dates or copies'))
+        return data
+
+    def copies_queryset(self):
+        data = self.cleaned_data
+        copies = BookInstance.objects.all()
+        if data['book']:
+            copies = copies.filter(book=data['book'])
+        # Copy ids are time ordered (catalog/uuids.py): a creation date range is a primary key range
+        if data['created_from']:
+            copies = copies.filter(pk__gte=uuid7_floor(self.start_of(data['created_from'])))
+        if data['created_to']:
+            copies = copies.filter(pk__lt=uuid7_floor(self.start_of(data['created_to'] + datetime.timedelta(days=1))))
+        if data['copies']:
+            copies = copies.filter(pk__in=data['copies'])
+        return copies
+
+    @staticmethod
+    def start_of(day):
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
 
 class SignUpForm(UserCreationForm):
     first_name = forms.CharField(max_length=100)
@@ -0,0 +1,41 @@
+"""
+Book counts of the genre tree.
+
+The count of a genre includes the books of all its sub-genres, each book counted once.
+All the counts are computed by one query and kept in the shared cache until a book's
+genres, a book or the tree itself changes, at most TIMEOUT.
+"""
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from catalog.caching import shared_cache
+from catalog.models import Book, Genre
+
+CACHE_KEY = 'catalog:genre_book_counts'
+TIMEOUT = 60 * 60
+
+
+def genre_book_counts():
+    """Return {genre id: number of books in the genre or its sub-genres}."""
+    counts = shared_cache.get(CACHE_KEY)
+    if counts is None:
+        subtree_books = Book.genre.through.objects.filter(
+            genre__tree_id=OuterRef('tree_id'), genre__lft__gte=OuterRef('lft'), genre__lft__lte=OuterRef('rght'),
+        ).order_by().values('genre__tree_id').annotate(books=Count('book', distinct=True)).values('books')
+        counts = {
+            genre_id: books or 0
+            for genre_id, books in Genre.objects.annotate(books=Subquery(subtree_books)).values_list('id', 'books')
+        }
+        shared_cache.set(CACHE_KEY, counts, TIMEOUT)
+    return counts
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+@receiver(post_delete, sender=Book)
+@receiver([post_save, post_delete], sender=Genre)
+def invalidate_genre_book_counts(sender, **kwargs):
+    shared_cache.delete(CACHE_KEY)
+    # Again after commit: counts computed by another request before then are already stale
+    transaction.on_commit(lambda: shared_cache.delete(CACHE_KEY))
@@ -0,0 +1,66 @@
+"""
+Work queued by catalog changes, done by 'manage.py run_catalog_jobs' rather than in the request.
+
+`queue()` adds a CatalogJob row per object, in the transaction of the change: a rolled
+back change queues nothing, and an object touched many times before the job runs (a
+form's genre set() removes then adds) is queued once. The worker takes the jobs
+BATCH_SIZE at a time, oldest first, and hands the ids of each kind to the function
+registered for it with `@handler(kind)`: similar books (catalog/recommendations.py),
+pre-rendered pages (catalog/prerender.py).
+
+Jobs are deleted when taken: a change committed while its job runs queues it again.
+"""
+from django.db import transaction
+
+from catalog.models import CatalogJob
+from catalog.routers import primary
+
+BATCH_SIZE = 500
+
+# Kind: function of a list of ids
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register the decorated function as the one doing the jobs of `kind`."""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+def queue(kind, ids):
+    ids = set(ids) - {None}
+    if ids:
+        CatalogJob.objects.bulk_create([CatalogJob(kind=kind, object_id=pk) for pk in ids], batch_size=500,
+                                       ignore_conflicts=True)
+
+
+def take(batch_size=BATCH_SIZE):
+    """Remove the oldest jobs from the queue. Returns {kind: [ids]}."""
+    with transaction.atomic():
+        jobs = list(CatalogJob.objects.values_list('pk', 'kind', 'object_id')[:batch_size])
+        CatalogJob.objects.filter(pk__in=[pk for pk, _kind, _object_id in jobs]).delete()
+    taken = {}
+    for _pk, kind, object_id in jobs:
+        taken.setdefault(kind, []).append(object_id)
+    return taken
+
+
+def run(batch_size=BATCH_SIZE):
+    """Do the queued jobs until there are none left. Returns their number."""
+    done = 0
+    # The changes that queued them may not have reached the replicas yet
+    with primary():
+        while taken := take(batch_size):
+            try:
+                for kind, ids in list(taken.items()):
+                    HANDLERS[kind](ids)
+                    done += len(ids)
+                    del taken[kind]
+            except Exception:
+                # Back in the queue for the next run
+                for kind, ids in taken.items():
+                    queue(kind, ids)
+                raise
+    return done
@@ -0,0 +1,255 @@
+"""
+Printable sheets of copy labels: a Code 128 barcode of the copy id, the title, the
+author and the branch code, 3 x 8 labels of 70 x 37 mm on A4 sheets.
+
+The barcode holds the copy's UUID as its 40-digit decimal value, in Code 128 set C
+(two digits per symbol): 255 modules, half the width of the hexadecimal form, so the
+bars stay wide enough for desk scanners. `copy_id_from_barcode()` reads it back, and
+`parse_copy_id()` reads either form.
+
+Pages are rendered by a pool of processes and written out in order as they come, with
+at most a few pages in flight: a sheet of 10,000 labels is never held in memory. Each
+web worker starts one pool, on its first sheet, and keeps it: its processes are spawned,
+not forked, so they don't inherit the worker's threads and memory, and they only import
+this module, which doesn't import Django.
+
+Two formats, both without dependencies:
+ - PDF, written object by object; the page tree and the cross-reference table, which
+   only need the offsets of what was written, come last;
+ - SVG, one <svg> per page in an HTML document, printed with a page break after each.
+"""
+import atexit
+import multiprocessing
+import threading
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from html import escape
+from itertools import islice
+
+MM = 72 / 25.4
+PAGE_WIDTH, PAGE_HEIGHT = 210 * MM, 297 * MM
+COLUMNS, ROWS = 3, 8
+LABEL_WIDTH, LABEL_HEIGHT = 70 * MM, 37 * MM
+LABELS_PER_PAGE = COLUMNS * ROWS
+# Top margin centering the rows on the page
+TOP = (PAGE_HEIGHT - ROWS * LABEL_HEIGHT) / 2
+PADDING = 4 * MM
+BAR_HEIGHT = 14 * MM
+TITLE_LENGTH = 38
+
+# Bar and space widths of the Code 128 symbols, by value (103-105: start A, B, C)
+CODE128 = (
+    '212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 221312 231212 112232 122132 122231 '
+    '113222 123122 123221 223211 221132 221231 213212 223112 312131 311222 321122 321221 312212 322112 322211 '
+    '212123 212321 232121 111323 131123 131321 112313 132113 132311 211313 231113 231311 112133 112331 132131 '
+    '113123 113321 133121 313121 211331 231131 213113 213311 213131 311123 311321 331121 312113 312311 332111 '
+    '314111 221411 431111 111224 111422 121124 121421 141122 141221 112214 112412 122114 122411 142112 142211 '
+    '241211 221114 413111 241112 134111 111242 121142 121241 114212 124112 124211 411212 421112 421211 212141 '
+    '214121 412121 111143 111341 131141 114113 114311 411113 411311 113141 114131 311141 411131 211412 211214 '
+    '211232'
+).split()
+START_C = 105
+STOP = '2331112'
+# Modules of a set C barcode of 40 digits: start, 20 symbols, check symbol, stop
+BARCODE_MODULES = 22 * 11 + 13
+QUIET_ZONE = 10
+
+
+def barcode_value(copy_id):
+    return f'{uuid.UUID(str(copy_id)).int:040d}'
+
+
+def copy_id_from_barcode(text):
+    """The copy UUID of a scanned label, or None if `text` isn't one."""
+    text = text.strip()
+    if len(text) != 40 or not text.isdigit() or int(text) >> 128:
+        return None
+    return uuid.UUID(int=int(text))
+
+
+def parse_copy_id(text):
+    """The copy UUID of a scanned label or of a typed id, or None if `text` is neither."""
+    copy_id = copy_id_from_barcode(text)
+    if copy_id is None:
+        try:
+            copy_id = uuid.UUID(text.strip())
+        except ValueError:
+            pass
+    return copy_id
+
+
+def code128c(digits):
+    """Bars of `digits` (an even number of them) in Code 128 set C, as (start, width) in modules."""
+    values = [int(digits[position:position + 2]) for position in range(0, len(digits), 2)]
+    check = (START_C + sum(weight * value for weight, value in enumerate(values, start=1))) % 103
+    widths = ''.join(CODE128[value] for value in [START_C, *values, check]) + STOP
+    bars, position = [], 0
+    for index, width in enumerate(widths):
+        width = int(width)
+        # Symbols start with a bar and alternate bars and spaces
+        if index % 2 == 0:
+            bars.append((position, width))
+        position += width
+    return bars
+
+
+def label_lines(label):
+    title = label['title'] if len(label['title']) <= TITLE_LENGTH else label['title'][:TITLE_LENGTH - 1] + '…'
+    return [title, ' · '.join(filter(None, [label['author'], label['branch']])), str(label['id'])]
+
+
+def label_origins():
+    """Top left corner of each label of a page, in points from the top left of the page."""
+    left = (PAGE_WIDTH - COLUMNS * LABEL_WIDTH) / 2
+    for row in range(ROWS):
+        for column in range(COLUMNS):
+            yield left + column * LABEL_WIDTH, TOP + row * LABEL_HEIGHT
+
+
+def pdf_text(text):
+    text = text.encode('cp1252', 'replace')
+    return b'(' + text.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def render_pdf_page(labels):
+    """Compressed content stream of a page of `labels` (dicts of id, title, author, branch)."""
+    module = (LABEL_WIDTH - 2 * PADDING) / (BARCODE_MODULES + 2 * QUIET_ZONE)
+    commands = []
+    for label, (left, top) in zip(labels, label_origins()):
+        # PDF coordinates start from the bottom of the page
+        bar_left = left + PADDING + QUIET_ZONE * module
+        bar_bottom = PAGE_HEIGHT - top - PADDING - BAR_HEIGHT
+        commands.extend(f'{bar_left + start * module:.2f} {bar_bottom:.2f} {width * module:.2f} {BAR_HEIGHT:.2f} re'
+                        for start, width in code128c(barcode_value(label['id'])))
+        commands.append('f')
+        text_top = bar_bottom - 4 * MM
+        for line, (size, text) in enumerate(zip((9, 7, 6), label_lines(label))):
+            commands.append(f'BT /F1 {size} Tf {left + PADDING:.2f} {text_top - line * 3.6 * MM:.2f} Td')
+            commands.append(pdf_text(text).decode('latin-1') + ' Tj ET')
+    return zlib.compress('\n'.join(commands).encode('latin-1'))
+
+
+def render_svg_page(labels):
+    module = (LABEL_WIDTH - 2 * PADDING) / (BARCODE_MODULES + 2 * QUIET_ZONE)
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="210mm" height="297mm" '
+             f'viewBox="0 0 {PAGE_WIDTH:.2f} {PAGE_HEIGHT:.2f}" font-family="Helvetica, Arial, sans-serif">']
+    for label, (left, top) in zip(labels, label_origins()):
+        bar_left = left + PADDING + QUIET_ZONE * module
+        bar_top = top + PADDING
+        path = ''.join(f'M{bar_left + start * module:.2f} {bar_top:.2f}h{width * module:.2f}v{BAR_HEIGHT:.2f}h'
+                       f'{-width * module:.2f}z' for start, width in code128c(barcode_value(label['id'])))
+        parts.append(f'<path d="{path}"/>')
+        text_top = bar_top + BAR_HEIGHT + 4 * MM
+        for line, (size, text) in enumerate(zip((9, 7, 6), label_lines(label))):
+            parts.append(f'<text x="{left + PADDING:.2f}" y="{text_top + line * 3.6 * MM:.2f}" '
+                         f'font-size="{size}">{escape(text)}</text>')
+    parts.append('</svg>\n')
+    return ''.join(parts).encode('utf-8')
+
+
+class PdfWriter:
+    """A PDF written a page at a time. Objects 1 to 3 (catalog, page tree, font) come last."""
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+        self.pages = []
+        self.next_number = 4
+
+    def write(self, data):
+        self.position += len(data)
+        return data
+
+    def object(self, number, body):
+        self.offsets[number] = self.position
+        return self.write(b'%d 0 obj\n%s\nendobj\n' % (number, body))
+
+    def header(self):
+        return self.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def page(self, content):
+        contents, page = self.next_number, self.next_number + 1
+        self.next_number += 2
+        self.pages.append(page)
+        return self.object(contents, b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream'
+                           % (len(content), content)) + self.object(
+            page, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Resources << /Font << /F1 3 0 R >> >> '
+                  b'/Contents %d 0 R >>' % (PAGE_WIDTH, PAGE_HEIGHT, contents))
+
+    def trailer(self):
+        kids = b' '.join(b'%d 0 R' % page for page in self.pages)
+        data = self.object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        data += self.object(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self.pages)))
+        data += self.object(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+        xref = self.position
+        data += b'xref\n0 %d\n0000000000 65535 f \n' % self.next_number
+        data += b''.join(b'%010d 00000 n \n' % self.offsets[number] for number in range(1, self.next_number))
+        data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (self.next_number, xref)
+        return data
+
+
+def paginate(labels):
+    labels = iter(labels)
+    while page := list(islice(labels, LABELS_PER_PAGE)):
+        yield page
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(workers):
+    """The pool of processes of this process, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def render_pages(render, labels, workers):
+    """Rendered pages of `labels`, in order, from `workers` processes (in this process if 0)."""
+    if not workers:
+        yield from map(render, paginate(labels))
+        return
+    pool = get_pool(workers)
+    pending = deque()
+    try:
+        for page in paginate(labels):
+            pending.append(pool.submit(render, page))
+            # Enough pages in flight to keep the pool busy, not the whole sheet
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # The download was interrupted: the pool is shared with the next sheets
+        for future in pending:
+            future.cancel()
+
+
+def pdf_sheet(labels, workers=0):
+    """The bytes of a PDF of `labels`, in chunks."""
+    writer = PdfWriter()
+    yield writer.header()
+    for content in render_pages(render_pdf_page, labels, workers):
+        yield writer.page(content)
+    yield writer.trailer()
+
+
+def svg_sheet(labels, workers=0):
+    yield (b'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Labels</title>'
+           b'<style>@page { size: A4; margin: 0 } body { margin: 0 } svg { display: block; break-after: page }</style>'
+           b'</head><body>\n')
+    yield from render_pages(render_svg_page, labels, workers)
+    yield b'</body></html>\n'
+
+
+# Format: (writer, content type, file extension)
+SHEETS = {
+    'pdf': (pdf_sheet, 'application/pdf', 'pdf'),
+    'svg': (svg_sheet, 'text/html; charset=utf-8', 'html'),
+}
@@ -0,0 +1,38 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from catalog.models import LoanEvent, LoanEventArchive
+
+ARCHIVED_FIELDS = ['book_instance_id', 'book_id', 'borrower_id', 'kind', 'due_back', 'created_at']
+ARCHIVE_DAYS = 365
+
+
+class Command(BaseCommand):
+    help = 'Move old loan events to the archive table, one chunk per transaction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ARCHIVE_DAYS, help='Archive the events older than this many days.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+        start = time.monotonic()
+        archived = 0
+        while True:
+            # Short transactions: the log stays writable by the circulation views while we run
+            with transaction.atomic():
+                events = list(LoanEvent.objects.filter(created_at__lt=cutoff).order_by('id')
+                              .values('id', *ARCHIVED_FIELDS)[:options['chunk_size']])
+                if not events:
+                    break
+                LoanEventArchive.objects.bulk_create(
+                    LoanEventArchive(**{field: event[field] for field in ARCHIVED_FIELDS}) for event in events)
+                LoanEvent.objects.filter(id__in=[event['id'] for event in events]).delete()
+            archived += len(events)
+            self.stdout.write(f'{archived} events archived', ending='\r')
+        self.stdout.write(self.style.SUCCESS(
+            f'{archived} events older than {cutoff:%Y-%m-%d} archived in {time.monotonic() - start:.1f}s'))
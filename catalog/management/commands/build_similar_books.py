@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.recommendations import TOP_K, build_similar_books
+
+
+class Command(BaseCommand):
+    help = 'Compute the "more like this" books of every book of the catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', type=int, default=TOP_K, help='Number of similar books kept per book.')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+
+        def progress(done, total):
+            self.stdout.write(f'{done}/{total} books', ending='\r')
+
+        build_similar_books(options['k'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Similar books built in {time.monotonic() - start:.1f}s'))
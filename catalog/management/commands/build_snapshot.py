@@ -0,0 +1,15 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.snapshot import build
+
+
+class Command(BaseCommand):
+    help = 'Write the snapshot of the catalog names shared by the worker processes, and enable it.'
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        path = build()
+        self.stdout.write(self.style.SUCCESS(
+            f'{path.name} ({path.stat().st_size / 2 ** 20:.1f} MB) written in {time.monotonic() - start:.1f}s'))
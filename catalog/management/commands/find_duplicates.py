@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.dedupe import find_duplicates
+
+
+class Command(BaseCommand):
+    help = 'Look for duplicate authors and books, and list them for review on the duplicates page.'
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        found = find_duplicates()
+        self.stdout.write(self.style.SUCCESS(f'{found} candidate pairs found in {time.monotonic() - start:.1f}s'))
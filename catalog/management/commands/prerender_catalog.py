@@ -0,0 +1,38 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from catalog.models import Author, Book
+from catalog.prerender import write_pages
+
+
+class Command(BaseCommand):
+    help = 'Render the book and author detail pages to files in settings.PRERENDER_ROOT.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='Number of rendering processes (default: one per core).')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Pages rendered per task.')
+
+    def handle(self, *args, **options):
+        os.makedirs(settings.PRERENDER_ROOT, exist_ok=True)
+        pages = [('book-detail', pk) for pk in Book.objects.values_list('pk', flat=True)]
+        pages += [('author-detail', pk) for pk in Author.objects.values_list('pk', flat=True)]
+        chunks = [pages[start:start + options['chunk_size']] for start in range(0, len(pages), options['chunk_size'])]
+
+        start = time.monotonic()
+        # Worker processes must open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(options['processes'], initializer=django.setup) as pool:
+            done = 0
+            for rendered in pool.map(write_pages, chunks):
+                done += rendered
+                self.stdout.write(f'{done}/{len(pages)} pages', ending='\r')
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(pages)} pages rendered in {elapsed:.1f}s to {settings.PRERENDER_ROOT}'))
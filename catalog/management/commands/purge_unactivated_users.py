@@ -0,0 +1,48 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ('Delete the accounts whose activation link expired unused, with their profiles, '
+            'one batch per transaction. Meant to run daily (e.g. Heroku Scheduler).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.1,
+                            help='Seconds to wait between batches, leaving the database to the site.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the accounts to delete.')
+
+    def expired_signups(self):
+        # The activation token is valid for PASSWORD_RESET_TIMEOUT (see catalog/tokens)
+        cutoff = timezone.now() - datetime.timedelta(seconds=settings.PASSWORD_RESET_TIMEOUT)
+        # Staff and accounts that ever logged in were not left by the sign-up form, even if deactivated since
+        return User.objects.filter(is_active=False, profile__signup_confirmation=False, last_login__isnull=True,
+                                   is_staff=False, is_superuser=False, date_joined__lt=cutoff)
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            self.stdout.write(f'{self.expired_signups().count()} expired sign-ups to delete')
+            return
+        start = time.monotonic()
+        deleted, last_pk = 0, 0
+        while True:
+            # Walk the primary key so that each batch starts where the previous one stopped
+            with transaction.atomic():
+                ids = list(self.expired_signups().filter(pk__gt=last_pk).order_by('pk')
+                           .values_list('pk', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                # Cascades to Profile, group and permission links; borrowed copies are set to no borrower
+                User.objects.filter(pk__in=ids).delete()
+            deleted, last_pk = deleted + len(ids), ids[-1]
+            self.stdout.write(f'{deleted} accounts deleted, {deleted / (time.monotonic() - start):.0f}/s',
+                              ending='\r')
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{deleted} expired sign-ups deleted in {time.monotonic() - start:.1f}s'))
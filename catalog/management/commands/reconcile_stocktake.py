@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.models import Stocktake, StocktakeDiscrepancy
+from catalog.stocktake import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Compare the scans of a stocktake with the catalog, as its Reconcile button does, without a request timeout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('stocktake', type=int, help='Id of the stocktake')
+
+    def handle(self, *args, **options):
+        try:
+            stocktake = Stocktake.objects.get(pk=options['stocktake'])
+        except Stocktake.DoesNotExist:
+            raise CommandError(f'No stocktake {options["stocktake"]}')
+        start = time.monotonic()
+        counts = reconcile(stocktake)
+        summary = ', '.join(f'{counts[kind]} {label.lower()}' for kind, label in StocktakeDiscrepancy.KINDS)
+        self.stdout.write(self.style.SUCCESS(f'{summary} in {time.monotonic() - start:.1f}s'))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from catalog.models import Book, BookInstance, recount_copies
+
+
+class Command(BaseCommand):
+    help = 'Compare the copy counters of Book with the copies, and fix the books that drifted, one chunk at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        copies = BookInstance.objects.filter(book=OuterRef('pk')).order_by().values('book')
+        start = time.monotonic()
+        checked, repaired, last_pk = 0, 0, 0
+        while True:
+            with transaction.atomic():
+                chunk = Book.objects.filter(pk__gt=last_pk).order_by('pk')[:options['chunk_size']]
+                book_ids = list(chunk.values_list('pk', flat=True))
+                if not book_ids:
+                    break
+                drifted = list(Book.objects.filter(pk__in=book_ids).annotate(
+                    real_total=Coalesce(Subquery(copies.annotate(n=Count('pk')).values('n')), 0),
+                    real_available=Coalesce(Subquery(
+                        copies.filter(status='a').annotate(n=Count('pk')).values('n')), 0),
+                ).filter(~Q(copies_total=F('real_total')) | ~Q(copies_available=F('real_available')))
+                    .values_list('pk', flat=True))
+                recount_copies(drifted)
+            checked, repaired, last_pk = checked + len(book_ids), repaired + len(drifted), book_ids[-1]
+            self.stdout.write(f'{checked} books checked, {repaired} repaired', ending='\r')
+        self.stdout.write(self.style.SUCCESS(
+            f'{checked} books checked, {repaired} repaired in {time.monotonic() - start:.1f}s'))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from catalog.jobs import BATCH_SIZE, run
+
+
+class Command(BaseCommand):
+    help = 'Do the work queued by catalog changes: similar books, pre-rendered pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Jobs taken at once.')
+        parser.add_argument('--every', type=float, default=0,
+                            help='Keep running, looking for jobs every this many seconds (default: run once).')
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.monotonic()
+            done = run(options['batch_size'])
+            if done or not options['every']:
+                self.stdout.write(self.style.SUCCESS(f'{done} jobs done in {time.monotonic() - start:.1f}s'))
+            if not options['every']:
+                break
+            # Connections dropped by the database meanwhile are opened again
+            close_old_connections()
+            time.sleep(options['every'])
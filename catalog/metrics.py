@@ -0,0 +1,287 @@
+"""
+Prometheus metrics of the application, served by the `metrics` view.
+
+Each process counts its requests (latency histogram by URL name), database queries and
+cache lookups in memory, and writes the counts to its own file of settings.METRICS_DIR
+at most every FLUSH_SECONDS. A scrape adds up the files of all the processes, so
+whichever gunicorn worker answers reports the whole server. The files of processes
+that are gone are folded into one archive file: counters keep growing across worker
+restarts.
+
+The library gauges (copies, loans, overdue copies, work waiting for a job or for a
+librarian) come from the copy counters of Book and from counts kept in the shared cache
+for GAUGE_SECONDS: whichever worker answers, the counts run once in that time. Reading
+them isn't counted as a cache lookup.
+"""
+import datetime
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.db import connections
+from django.db.models import Sum
+from django.utils import timezone
+
+from catalog.caching import shared_cache
+
+FLUSH_SECONDS = 1
+GAUGE_SECONDS = 60
+GAUGES_KEY = 'catalog:metrics:gauges'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+# Name: (type, help)
+FAMILIES = {
+    'catalog_http_request_duration_seconds': ('histogram', 'Time to answer a request, by URL name.'),
+    'catalog_http_responses_total': ('counter', 'Responses, by URL name and status class.'),
+    'catalog_db_queries_total': ('counter', 'Database queries, by URL name.'),
+    'catalog_db_query_duration_seconds_total': ('counter', 'Time spent in database queries, by URL name.'),
+    'catalog_cache_lookups_total': ('counter', 'Cache lookups, by result.'),
+    'catalog_copies': ('gauge', 'Copies in the catalog.'),
+    'catalog_copies_available': ('gauge', 'Copies available for loan.'),
+    'catalog_copies_on_loan': ('gauge', 'Copies on loan.'),
+    'catalog_copies_overdue': ('gauge', 'Copies on loan past their due date.'),
+    'catalog_loan_events_to_archive': ('gauge', 'Loan events waiting for archive_loan_events.'),
+    'catalog_duplicates_to_review': ('gauge', 'Possible duplicates waiting for a librarian.'),
+    'catalog_jobs_queued': ('gauge', 'Catalog jobs waiting for run_catalog_jobs.'),
+}
+
+
+def sample(name, **labels):
+    """The exposition name of a sample, e.g. name{view="books"}."""
+    if not labels:
+        return name
+    values = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+    return name + '{' + ','.join(f'{label}="{value}"' for label, value in zip(labels, values)) + '}'
+
+
+class Store:
+    """Counters of this process, and the files of all of them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Forked processes (gunicorn --preload) start from zero, in their own file
+        self.values = defaultdict(float)
+        self.flushed_at = 0
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            self.values[sample(name, **labels)] += amount
+
+    def observe(self, name, value, **labels):
+        """Add `value` to the histogram `name`."""
+        with self.lock:
+            for bound in BUCKETS:
+                if value <= bound:
+                    self.values[sample(f'{name}_bucket', **labels, le=bound)] += 1
+                else:
+                    # Zero buckets are written too: the first observation creates them in order
+                    self.values.setdefault(sample(f'{name}_bucket', **labels, le=bound), 0)
+            self.values[sample(f'{name}_bucket', **labels, le='+Inf')] += 1
+            self.values[sample(f'{name}_sum', **labels)] += value
+            self.values[sample(f'{name}_count', **labels)] += 1
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.flushed_at < FLUSH_SECONDS:
+            return
+        with self.lock:
+            data = json.dumps(self.values)
+            self.flushed_at = now
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as file:
+            file.write(data)
+        # Readers see the previous file or this one, never a partial one
+        os.replace(file.name, directory / f'{os.getpid()}.json')
+
+    def collect(self):
+        """Sums of the counters of every process, this one's included."""
+        self.flush(force=True)
+        directory = Path(settings.METRICS_DIR)
+        totals = defaultdict(float)
+        gone = defaultdict(float)
+        with open(directory / 'lock', 'a') as lock:
+            # One scrape at a time folds the files of dead processes
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = directory / 'archive.json'
+            dead = []
+            for path in sorted(directory.glob('*.json')):
+                try:
+                    values = json.loads(path.read_text())
+                except (OSError, ValueError):
+                    continue
+                is_dead = path.stem.isdigit() and not is_alive(int(path.stem))
+                if is_dead:
+                    dead.append(path)
+                for name, value in values.items():
+                    totals[name] += value
+                    if is_dead or path == archive:
+                        gone[name] += value
+            if dead:
+                archive.write_text(json.dumps(gone))
+                for path in dead:
+                    path.unlink()
+        return totals
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+store = Store()
+os.register_at_fork(after_in_child=store.reset)
+
+
+class QueryCounter:
+    """Database execute wrapper counting the queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """Times each request and counts its queries, labelled with the name of its URL."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+        # URL names only: a bounded set of labels, whatever the clients ask for
+        view = request.resolver_match.view_name if request.resolver_match else 'other'
+        method = request.method if request.method in METHODS else 'other'
+        store.observe('catalog_http_request_duration_seconds', duration, view=view, method=method)
+        store.inc('catalog_http_responses_total', view=view, status=f'{response.status_code // 100}xx')
+        store.inc('catalog_db_queries_total', queries.count, view=view)
+        store.inc('catalog_db_query_duration_seconds_total', queries.seconds, view=view)
+        store.flush()
+        return response
+
+
+MISSING = object()
+_lookups = threading.local()
+
+
+@contextmanager
+def uncounted():
+    """Cache lookups made inside aren't counted."""
+    counting = getattr(_lookups, 'counting', False)
+    _lookups.counting = True
+    try:
+        yield
+    finally:
+        _lookups.counting = counting
+
+
+class MeteredCacheMixin:
+    """Counts the hits and misses of a cache backend.
+
+    Only the outer call is counted: backends implement get() with get_many() (DatabaseCache), or
+    get_many() with get() (BaseCache).
+    """
+
+    def get(self, key, default=None, version=None):
+        if getattr(_lookups, 'counting', False):
+            return super().get(key, default, version)
+        with uncounted():
+            value = super().get(key, MISSING, version)
+        store.inc('catalog_cache_lookups_total', result='miss' if value is MISSING else 'hit')
+        return default if value is MISSING else value
+
+    def get_many(self, keys, version=None):
+        if getattr(_lookups, 'counting', False):
+            return super().get_many(keys, version)
+        keys = list(keys)
+        with uncounted():
+            values = super().get_many(keys, version)
+        store.inc('catalog_cache_lookups_total', len(values), result='hit')
+        store.inc('catalog_cache_lookups_total', len(keys) - len(values), result='miss')
+        return values
+
+
+class MeteredLocMemCache(MeteredCacheMixin, LocMemCache):
+    pass
+
+
+class MeteredRedisCache(MeteredCacheMixin, RedisCache):
+    pass
+
+
+class MeteredDatabaseCache(MeteredCacheMixin, DatabaseCache):
+    pass
+
+
+def library_gauges():
+    from catalog.management.commands.archive_loan_events import ARCHIVE_DAYS
+    from catalog.models import Book, BookInstance, CatalogJob, DuplicateCandidate, LoanEvent
+
+    # The scrapes would count their own lookups
+    with uncounted():
+        gauges = shared_cache.get(GAUGES_KEY)
+    if gauges is None:
+        copies = Book.objects.aggregate(total=Sum('copies_total'), available=Sum('copies_available'))
+        on_loan = BookInstance.objects.filter(status='o')
+        archive_before = timezone.now() - datetime.timedelta(days=ARCHIVE_DAYS)
+        gauges = {
+            'catalog_copies': copies['total'] or 0,
+            'catalog_copies_available': copies['available'] or 0,
+            'catalog_copies_on_loan': on_loan.count(),
+            'catalog_copies_overdue': on_loan.filter(due_back__lt=timezone.localdate()).count(),
+            'catalog_loan_events_to_archive': LoanEvent.objects.filter(created_at__lt=archive_before).count(),
+            'catalog_duplicates_to_review': DuplicateCandidate.objects.filter(dismissed=False).count(),
+            'catalog_jobs_queued': CatalogJob.objects.count(),
+        }
+        shared_cache.set(GAUGES_KEY, gauges, GAUGE_SECONDS)
+    return gauges
+
+
+def exposition():
+    """All the metrics, in the Prometheus text format."""
+    samples = store.collect()
+    samples.update(library_gauges())
+    families = defaultdict(list)
+    for name, value in samples.items():
+        base = name.split('{', 1)[0]
+        for suffix in ('_bucket', '_sum', '_count'):
+            if base.endswith(suffix) and base[:-len(suffix)] in FAMILIES:
+                base = base[:-len(suffix)]
+        families[base].append(f'{name} {int(value) if float(value).is_integer() else value}')
+    lines = []
+    for name, (kind, help_text) in FAMILIES.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', *families[name]]
+    return '\n'.join(lines) + '\n'
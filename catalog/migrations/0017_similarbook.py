@@ -0,0 +1,36 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0016_alter_book_book_cover'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='book_cover',
+            field=models.ImageField(blank=True, default='images/defaultimage.jpg', upload_to='images/'),
+        ),
+        migrations.CreateModel(
+            name='SimilarBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_books', to='catalog.book')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.book')),
+            ],
+            options={
+                'ordering': ['book', 'rank'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='similarbook',
+            constraint=models.UniqueConstraint(fields=('book', 'rank'), name='unique_similar_book_rank'),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0017_similarbook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book_instance_id', models.UUIDField(db_index=True)),
+                ('book_id', models.BigIntegerField(null=True)),
+                ('borrower_id', models.IntegerField(null=True)),
+                ('kind', models.CharField(choices=[('c', 'Checkout'), ('r', 'Return'), ('n', 'Renew')], max_length=1)),
+                ('due_back', models.DateField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanEventArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('book_instance_id', models.UUIDField(db_index=True)),
+                ('book_id', models.BigIntegerField(null=True)),
+                ('borrower_id', models.IntegerField(null=True)),
+                ('kind', models.CharField(choices=[('c', 'Checkout'), ('r', 'Return'), ('n', 'Renew')], max_length=1)),
+                ('due_back', models.DateField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyLoanStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('month', models.DateField(help_text='First day of the month', unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='GenreLoanStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('genre', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalog.genre')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BookLoanStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalog.book')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='genreloanstats',
+            constraint=models.UniqueConstraint(fields=('genre', 'month'), name='unique_genre_loan_stats'),
+        ),
+        migrations.AddIndex(
+            model_name='bookloanstats',
+            index=models.Index(fields=['month', '-checkouts'], name='catalog_boo_month_e4faac_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookloanstats',
+            constraint=models.UniqueConstraint(fields=('book', 'month'), name='unique_book_loan_stats'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:12
+
+import catalog.uuids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0018_loan_events'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookinstance',
+            name='id',
+            field=models.UUIDField(default=catalog.uuids.uuid7, help_text='Un identifiant unique pour ce livre au sein de la librairie', primary_key=True, serialize=False),
+        ),
+    ]
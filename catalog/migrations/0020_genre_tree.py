@@ -0,0 +1,54 @@
+from django.db import migrations, models
+import django.db.models.deletion
+import mptt.fields
+
+
+def existing_genres_as_roots(apps, schema_editor):
+    """Every existing genre becomes the root of its own tree, trees ordered by name."""
+    Genre = apps.get_model('catalog', 'Genre')
+    for tree_id, genre in enumerate(Genre.objects.order_by('name'), start=1):
+        Genre.objects.filter(pk=genre.pk).update(tree_id=tree_id, lft=1, rght=2, level=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0019_bookinstance_uuid7'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genre',
+            name='parent',
+            field=mptt.fields.TreeForeignKey(blank=True, help_text='Genre parent (vide pour un genre principal)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='catalog.genre'),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='level',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='lft',
+            field=models.PositiveIntegerField(default=1, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='rght',
+            field=models.PositiveIntegerField(default=2, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='tree_id',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(existing_genres_as_roots, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='genre',
+            index=models.Index(fields=['tree_id', 'lft'], name='catalog_genre_tree_lft_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0020_genre_tree'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Branch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('code', models.SlugField(help_text='Code court de la bibliothèque, ex. "centre"', max_length=20, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='bookinstance',
+            name='branch',
+            field=models.ForeignKey(blank=True, null=True, db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='copies', to='catalog.branch'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='branch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='staff', to='catalog.branch'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['branch', 'status', 'due_back'], name='catalog_copy_branch_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['branch', 'book'], name='catalog_copy_branch_book_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_copies(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    copies = BookInstance.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    Book.objects.update(
+        copies_total=Coalesce(Subquery(copies.annotate(n=Count('pk')).values('n')), 0),
+        copies_available=Coalesce(Subquery(copies.filter(status='a').annotate(n=Count('pk')).values('n')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0021_branches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='copies_available',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-copies_available', 'title'], name='catalog_book_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('copies_available__gt', 0)), fields=['title'], name='catalog_book_in_stock_idx'),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
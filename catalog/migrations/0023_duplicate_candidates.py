@@ -0,0 +1,32 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0022_book_copy_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('a', 'Author'), ('b', 'Book')], max_length=1)),
+                ('first_id', models.BigIntegerField()),
+                ('second_id', models.BigIntegerField()),
+                ('score', models.FloatField(help_text='Similarité des noms, de 0 à 1')),
+                ('reason', models.CharField(max_length=50)),
+                ('dismissed', models.BooleanField(default=False)),
+            ],
+            options={
+                'ordering': ['kind', '-score', 'first_id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='duplicatecandidate',
+            constraint=models.UniqueConstraint(fields=('kind', 'first_id', 'second_id'), name='unique_duplicate_candidate'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:48
+
+from django.db import migrations, models
+
+from catalog.text import normalize
+
+
+def fill_browse_keys(apps, schema_editor):
+    Author = apps.get_model('catalog', 'Author')
+    Book = apps.get_model('catalog', 'Book')
+    authors = list(Author.objects.only('first_name', 'last_name'))
+    for author in authors:
+        author.name_key = normalize(f'{author.last_name} {author.first_name}')[:201]
+    Author.objects.bulk_update(authors, ['name_key'], batch_size=1000)
+    books = list(Book.objects.only('title'))
+    for book in books:
+        book.title_key = normalize(book.title)[:200]
+    Book.objects.bulk_update(books, ['title_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0023_duplicate_candidates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='name_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=201),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='title_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_browse_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.1.2 on 2026-10-19 10:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0024_browse_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Stocktake',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_at', models.DateTimeField(blank=True, null=True)),
+                ('scans', models.PositiveIntegerField(default=0, editable=False)),
+                ('reconciled_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('branch', models.ForeignKey(blank=True, help_text='Toute la bibliothèque si vide', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='stocktakes', to='catalog.branch')),
+                ('started_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='bookinstance',
+            name='status',
+            field=models.CharField(blank=True, choices=[('m', 'Maintenance'), ('o', 'On loan'), ('a', 'Available'), ('r', 'Reserved'), ('l', 'Lost')], default='m', help_text='Disponibilité du livre', max_length=1),
+        ),
+        migrations.CreateModel(
+            name='StocktakeDiscrepancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('m', 'Missing'), ('u', 'Unexpected'), ('s', 'Wrong status')], max_length=1)),
+                ('copy_id', models.UUIDField()),
+                ('status', models.CharField(blank=True, choices=[('m', 'Maintenance'), ('o', 'On loan'), ('a', 'Available'), ('r', 'Reserved'), ('l', 'Lost')], max_length=1)),
+                ('fixed', models.BooleanField(default=False)),
+                ('stocktake', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='discrepancies', to='catalog.stocktake')),
+            ],
+            options={
+                'ordering': ['kind', 'copy_id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StocktakeBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('copies', models.BinaryField()),
+                ('stocktake', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='catalog.stocktake')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='stocktakediscrepancy',
+            index=models.Index(fields=['stocktake', 'kind', 'fixed'], name='catalog_stocktake_kind_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.2 on 2026-10-19 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0025_stocktakes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('similar-books', 'Similar books'), ('book-detail', 'Book page'), ('author-detail', 'Author page')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='catalogjob',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_catalog_job'),
+        ),
+    ]
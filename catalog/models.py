@@ -1,18 +1,36 @@
-from django.db import models
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
 from django.urls import reverse  # Used to generate URLs by reversing the URL patterns
-import uuid  # Required for unique book instances
 from datetime import date
 
 from django.contrib.auth.models import User  # Required to assign User as a borrower
+from mptt.models import MPTTModel, TreeForeignKey
+
+from catalog.text import normalize
+from catalog.uuids import uuid7  # Required for unique book instances
 
 
 # Create your models here.
 
-class Genre(models.Model):
-    """Model representing a book genre."""
+class Genre(MPTTModel):
+    """Model representing a book genre, in a tree of genres and sub-genres (nested sets)."""
     name = models.CharField(max_length=200, help_text='Entrez un genre pour e livre (ex: Science Fiction)')
+    parent = TreeForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children',
+                            help_text='Genre parent (vide pour un genre principal)')
+
+    class MPTTMeta:
+        order_insertion_by = ['name']
+
+    class Meta:
+        # Subtree queries are a range on lft within a tree
+        indexes = [models.Index(fields=['tree_id', 'lft'], name='catalog_genre_tree_lft_idx')]
+
+    def subtree_filter(self, prefix='genre__'):
+        """Q object matching this genre and all its sub-genres with one range condition."""
+        return Q(**{f'{prefix}tree_id': self.tree_id, f'{prefix}lft__gte': self.lft, f'{prefix}lft__lte': self.rght})
 
     def __str__(self):
         """String for representing the Model object."""
@@ -28,9 +46,37 @@ class Language(models.Model):
         return self.name
 
 
-class Book(models.Model):
+class BrowseKeyQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # save() isn't called: set the browse keys here
+        objs = list(objs)
+        for obj in objs:
+            obj.set_browse_key()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class BrowseKeyMixin:
+    """Keeps `browse_key_field` equal to the folded `browse_name()`, for the A-Z index (see catalog/browse.py)."""
+    browse_key_field = None
+    browse_key_sources = ()
+
+    def set_browse_key(self):
+        max_length = self._meta.get_field(self.browse_key_field).max_length
+        setattr(self, self.browse_key_field, normalize(self.browse_name())[:max_length])
+
+    def save(self, *args, **kwargs):
+        self.set_browse_key()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(self.browse_key_sources):
+            kwargs['update_fields'] = {*update_fields, self.browse_key_field}
+        super().save(*args, **kwargs)
+
+
+class Book(BrowseKeyMixin, models.Model):
     """Model representing a book (but not a specific copy of a book)."""
     title = models.CharField(max_length=200)
+    # Folded title, for the A-Z index
+    title_key = models.CharField(max_length=200, db_index=True, editable=False, default='')
 
     # Foreign Key used because book can only have one author, but authors can have multiple books
     # Author is a string rather than an object because it hasn't been declared yet in the file
@@ -46,19 +92,38 @@ class Book(models.Model):
     genre = models.ManyToManyField(Genre, help_text='Sélectionnez un genre pour le livre')
     language = models.ForeignKey('Language', on_delete=models.SET_NULL, null=True)
     book_cover = models.ImageField(upload_to='images/', default='images/defaultimage.jpg', blank=True)
+    # Counts of the copies, kept up to date by BookInstance (see count_copy_changes).
+    # 'manage.py repair_copy_counts' fixes any drift.
+    copies_total = models.PositiveIntegerField(default=0, editable=False)
+    copies_available = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = BrowseKeyQuerySet.as_manager()
+
+    browse_key_field = 'title_key'
+    browse_key_sources = ('title',)
 
     class Meta:
         ordering = ['title', 'author']
+        indexes = [
+            # "Most available" ordering
+            models.Index(fields=['-copies_available', 'title'], name='catalog_book_available_idx'),
+            # "Available only" filter in title order
+            models.Index(fields=['title'], condition=Q(copies_available__gt=0), name='catalog_book_in_stock_idx'),
+        ]
 
     def get_available_count(self):
-        return self.bookinstance_set.filter(status__exact='a').count()
+        return self.copies_available
 
     def display_genre(self):
         """Creates a string for the Genre. This is required to display genre in Admin."""
-        return ', '.join([genre.name for genre in self.genre.all()[:3]])
+        # Slice the list, not the queryset, so that prefetched genres are used
+        return ', '.join([genre.name for genre in self.genre.all()][:3])
 
     display_genre.short_description = 'Genre'
 
+    def browse_name(self):
+        return self.title
+
     def __str__(self):
         """String for representing the Model object."""
         return self.title
@@ -68,14 +133,128 @@ class Book(models.Model):
         return reverse('book-detail', args=[str(self.id)])
 
 
+class SimilarBook(models.Model):
+    """Model representing one of the top-K most similar books of a book (built by catalog/recommendations.py)."""
+    book = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='similar_books')
+    similar = models.ForeignKey('Book', on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['book', 'rank']
+        constraints = [models.UniqueConstraint(fields=['book', 'rank'], name='unique_similar_book_rank')]
+
+    def __str__(self):
+        """String for representing the Model object."""
+        return f'{self.book_id} -> {self.similar_id} ({self.score:.2f})'
+
+
+class DuplicateCandidate(models.Model):
+    """Model representing two authors or two books that may be the same (found by catalog/dedupe.py)."""
+    AUTHOR = 'a'
+    BOOK = 'b'
+    KINDS = ((AUTHOR, 'Author'), (BOOK, 'Book'))
+
+    kind = models.CharField(max_length=1, choices=KINDS)
+    # Plain ids, first_id < second_id: the pair is removed when either side is merged
+    first_id = models.BigIntegerField()
+    second_id = models.BigIntegerField()
+    score = models.FloatField(help_text='Similarité des noms, de 0 à 1')
+    reason = models.CharField(max_length=50)
+    # Reviewed and kept apart: not proposed again
+    dismissed = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['kind', '-score', 'first_id']
+        constraints = [models.UniqueConstraint(fields=['kind', 'first_id', 'second_id'],
+                                               name='unique_duplicate_candidate')]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.first_id} ~ {self.second_id} ({self.reason})'
+
+
+class Branch(models.Model):
+    """Model representing a branch of the library, where copies are kept and staff work."""
+    name = models.CharField(max_length=200, unique=True)
+    code = models.SlugField(max_length=20, unique=True, help_text='Code court de la bibliothèque, ex. "centre"')
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
+def recount_copies(book_ids):
+    """Set the copy counts of the given books from their copies, in one UPDATE."""
+    copies = BookInstance.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    Book.objects.filter(pk__in=book_ids).update(
+        copies_total=Coalesce(Subquery(copies.annotate(n=models.Count('pk')).values('n')), 0),
+        copies_available=Coalesce(Subquery(
+            copies.filter(status='a').annotate(n=models.Count('pk')).values('n')), 0),
+    )
+
+
+# Sent with the ids of the books whose copies a bulk update or creation changed: they send no post_save
+copies_changed = Signal()
+
+
+class BookInstanceQuerySet(models.QuerySet):
+    # Bulk operations send no signal: they count the copies of the books they touched again
+
+    def update(self, **kwargs):
+        book = kwargs.get('book', kwargs.get('book_id'))
+        with transaction.atomic(using=self.db):
+            book_ids = set(self.exclude(book=None).values_list('book', flat=True).distinct())
+            if hasattr(book, 'resolve_expression'):
+                # e.g. the Case() of bulk_update(): find the new books from the updated rows
+                pks = list(self.values_list('pk', flat=True))
+                rows = super().update(**kwargs)
+                book_ids.update(self.model.objects.filter(pk__in=pks).exclude(book=None)
+                                .values_list('book', flat=True).distinct())
+            else:
+                rows = super().update(**kwargs)
+                if book is not None:
+                    book_ids.add(getattr(book, 'pk', book))
+            if {'book', 'book_id', 'status'} & set(kwargs):
+                recount_copies(book_ids)
+            copies_changed.send(sender=self.model, book_ids=book_ids)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            book_ids = {obj.book_id for obj in objs if obj.book_id}
+            recount_copies(book_ids)
+            copies_changed.send(sender=self.model, book_ids=book_ids)
+        return objs
+
+    # bulk_update() goes through update()
+
+    def for_branch(self, branch):
+        """Copies kept at `branch`; every copy if `branch` is None."""
+        return self if branch is None else self.filter(branch=branch)
+
+    def availability(self):
+        """Number of copies and of available copies per book and branch, in one grouped query."""
+        return self.order_by('book', 'branch__name').values('book', 'branch', 'branch__name').annotate(
+            copies=models.Count('pk'), available=models.Count('pk', filter=Q(status='a')))
+
+
 class BookInstance(models.Model):
     """Model representing a specific copy of a book (i.e. that can be borrowed from the library)."""
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+    # Time ordered so that new copies are appended to the primary key index
+    id = models.UUIDField(primary_key=True, default=uuid7,
                           help_text='Un identifiant unique pour ce livre au sein de la librairie')
     book = models.ForeignKey('Book', on_delete=models.RESTRICT, null=True)
     imprint = models.CharField(max_length=200)
     due_back = models.DateField(null=True, blank=True)
     borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # No index of its own: the indexes of Meta start with branch
+    branch = models.ForeignKey(Branch, on_delete=models.PROTECT, null=True, blank=True, related_name='copies',
+                               db_index=False)
+
+    objects = BookInstanceQuerySet.as_manager()
 
     @property
     def is_overdue(self):
@@ -87,6 +266,7 @@ class BookInstance(models.Model):
         ('o', 'On loan'),
         ('a', 'Available'),
         ('r', 'Reserved'),
+        ('l', 'Lost'),
     )
 
     status = models.CharField(
@@ -100,18 +280,76 @@ class BookInstance(models.Model):
     class Meta:
         ordering = ['due_back']
         permissions = (("can_mark_returned", "Set book as returned"),)
+        # Led by branch: the staff lists only read their branch's part of the table
+        indexes = [
+            models.Index(fields=['branch', 'status', 'due_back'], name='catalog_copy_branch_status_idx'),
+            models.Index(fields=['branch', 'book'], name='catalog_copy_branch_book_idx'),
+        ]
 
     def __str__(self):
         """String for representing the Model object."""
         return f'{self.id} ({self.book.title})'
 
-
-class Author(models.Model):
+    def counted_state(self, using=None):
+        """(book id, status) counted in the book counters, read with the row locked: not the state this
+        instance was loaded with, which another save may have changed since. None if not saved yet."""
+        return BookInstance.objects.db_manager(using).select_for_update().filter(pk=self.pk).values_list(
+            'book_id', 'status').first()
+
+    # In a transaction with the update of the book counters (see count_copy_changes)
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            if not self._state.adding:
+                self._counted = self.counted_state(kwargs.get('using'))
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            self._counted = self.counted_state(kwargs.get('using'))
+            return super().delete(*args, **kwargs)
+
+
+def move_copy(before, after):
+    """Update the book counters for a copy going from `before` to `after`, (book id, status) or None."""
+    deltas = {}
+    for state, sign in ((before, -1), (after, 1)):
+        if state is not None and state[0] is not None:
+            total, available = deltas.get(state[0], (0, 0))
+            deltas[state[0]] = (total + sign, available + sign * (state[1] == 'a'))
+    for book_id, (total, available) in deltas.items():
+        if total or available:
+            Book.objects.filter(pk=book_id).update(copies_total=F('copies_total') + total,
+                                                   copies_available=F('copies_available') + available)
+
+
+@receiver(post_save, sender=BookInstance)
+def count_copy_changes(sender, instance, created, raw, **kwargs):
+    if raw:
+        # Fixtures: repair_copy_counts sets the counters
+        return
+    after = (instance.book_id, instance.status)
+    move_copy(None if created else instance._counted, after)
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_copy_deletion(sender, instance, **kwargs):
+    # Deleted by a queryset: loaded by the deletion itself
+    move_copy(getattr(instance, '_counted', (instance.book_id, instance.status)), None)
+
+
+class Author(BrowseKeyMixin, models.Model):
     """Model representing an author."""
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField('died', null=True, blank=True)
+    # Folded last and first names, for the A-Z index
+    name_key = models.CharField(max_length=201, db_index=True, editable=False, default='')
+
+    objects = BrowseKeyQuerySet.as_manager()
+
+    browse_key_field = 'name_key'
+    browse_key_sources = ('last_name', 'first_name')
 
     class Meta:
         ordering = ['last_name', 'first_name']
@@ -121,6 +359,9 @@ class Author(models.Model):
         """Returns the URL to access a particular author instance."""
         return reverse('author-detail', args=[str(self.id)])
 
+    def browse_name(self):
+        return f'{self.last_name} {self.first_name}'
+
     def __str__(self):
         """String for representing the Model object."""
         return f'{self.last_name}, {self.first_name}'
@@ -132,6 +373,8 @@ class Profile(models.Model):
     last_name = models.CharField(max_length=100, blank=True)
     email = models.EmailField(max_length=150, unique=True)
     signup_confirmation = models.BooleanField(default=False)
+    # Branch of a staff member; None for readers and for staff working across branches
+    branch = models.ForeignKey(Branch, on_delete=models.SET_NULL, null=True, blank=True, related_name='staff')
 
     def __str__(self):
         return self.user.username
@@ -142,3 +385,140 @@ def update_profile_signal(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
     instance.profile.save()
+
+
+class BaseLoanEvent(models.Model):
+    """Fields of a circulation event. Events are only ever appended, never updated."""
+    CHECKOUT = 'c'
+    RETURN = 'r'
+    RENEW = 'n'
+    KINDS = (
+        (CHECKOUT, 'Checkout'),
+        (RETURN, 'Return'),
+        (RENEW, 'Renew'),
+    )
+
+    # Not foreign keys: the history outlives the copies, books and users
+    book_instance_id = models.UUIDField(db_index=True)
+    book_id = models.BigIntegerField(null=True)
+    borrower_id = models.IntegerField(null=True)
+    kind = models.CharField(max_length=1, choices=KINDS)
+    due_back = models.DateField(null=True, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        abstract = True
+        ordering = ['created_at']
+
+    def __str__(self):
+        """String for representing the Model object."""
+        return f'{self.get_kind_display()} {self.book_instance_id} ({self.created_at:%Y-%m-%d})'
+
+
+class LoanEvent(BaseLoanEvent):
+    """Model representing a checkout, return or renewal of a copy (see catalog/circulation.py)."""
+
+
+class LoanEventArchive(BaseLoanEvent):
+    """Cold storage for old loan events, filled by 'manage.py archive_loan_events'."""
+
+
+class BaseLoanStats(models.Model):
+    """Counters of loan events for one month, kept up to date as events are recorded."""
+    month = models.DateField(help_text='First day of the month')
+    checkouts = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class BookLoanStats(BaseLoanStats):
+    book = models.ForeignKey('Book', on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['book', 'month'], name='unique_book_loan_stats')]
+        indexes = [models.Index(fields=['month', '-checkouts'])]
+
+
+class GenreLoanStats(BaseLoanStats):
+    genre = models.ForeignKey('Genre', on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['genre', 'month'], name='unique_genre_loan_stats')]
+
+
+class MonthlyLoanStats(BaseLoanStats):
+    month = models.DateField(unique=True, help_text='First day of the month')
+
+
+class Stocktake(models.Model):
+    """Model representing an inventory of the copies of a branch, or of the whole library (see catalog/stocktake.py)."""
+    branch = models.ForeignKey(Branch, on_delete=models.PROTECT, null=True, blank=True, related_name='stocktakes',
+                               help_text='Toute la bibliothèque si vide')
+    started_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    started_at = models.DateTimeField(auto_now_add=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+    # Scans received, repeated ones included
+    scans = models.PositiveIntegerField(default=0, editable=False)
+    reconciled_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f'{self.branch or "All branches"}, {self.started_at:%Y-%m-%d}'
+
+    def get_absolute_url(self):
+        return reverse('stocktake-detail', args=[str(self.id)])
+
+
+class StocktakeBatch(models.Model):
+    """Copies scanned together, as their 16-byte UUIDs one after the other."""
+    stocktake = models.ForeignKey(Stocktake, on_delete=models.CASCADE, related_name='batches')
+    created_at = models.DateTimeField(auto_now_add=True)
+    copies = models.BinaryField()
+
+
+class StocktakeDiscrepancy(models.Model):
+    """Model representing a difference between the scans of a stocktake and the catalog."""
+    MISSING = 'm'
+    UNEXPECTED = 'u'
+    WRONG_STATUS = 's'
+    KINDS = ((MISSING, 'Missing'), (UNEXPECTED, 'Unexpected'), (WRONG_STATUS, 'Wrong status'))
+
+    stocktake = models.ForeignKey(Stocktake, on_delete=models.CASCADE, related_name='discrepancies')
+    kind = models.CharField(max_length=1, choices=KINDS)
+    # Not a foreign key: unexpected ids may be of no copy at all
+    copy_id = models.UUIDField()
+    # Status of the copy when reconciled, empty for unknown ids
+    status = models.CharField(max_length=1, choices=BookInstance.LOAN_STATUS, blank=True)
+    fixed = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['kind', 'copy_id']
+        indexes = [models.Index(fields=['stocktake', 'kind', 'fixed'], name='catalog_stocktake_kind_idx')]
+
+    def __str__(self):
+        return f'{self.get_kind_display()}: {self.copy_id}'
+
+
+class CatalogJob(models.Model):
+    """Model representing work queued by a catalog change, done by 'manage.py run_catalog_jobs' (see catalog/jobs.py)."""
+    SIMILAR_BOOKS = 'similar-books'
+    BOOK_PAGE = 'book-detail'
+    AUTHOR_PAGE = 'author-detail'
+    KINDS = ((SIMILAR_BOOKS, 'Similar books'), (BOOK_PAGE, 'Book page'), (AUTHOR_PAGE, 'Author page'))
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    # Not a foreign key: the job of a deleted object removes what was built for it
+    object_id = models.BigIntegerField()
+
+    class Meta:
+        ordering = ['id']
+        # Queued once however many changes touch the object before the job runs
+        constraints = [models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_catalog_job')]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.object_id}'
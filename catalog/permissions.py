@@ -0,0 +1,107 @@
+"""
+Permission cache.
+
+CachedPermissionBackend keeps the permission set of each user on the user instance for
+the rest of the request, filled once per request from the cache shared by the workers
+(see catalog/caching.py): the permission checks of a request (PermissionRequiredMixin,
+permission_required, templates) cost one cache lookup together, rather than the queries
+of the user and group permission tables. A user's entry is dropped when the user or
+their permissions or groups change; a change of a group or of a permission itself moves
+to a new version, which the entries are checked against. Entries expire after TIMEOUT
+all the same.
+
+The `catalog_permissions` context processor gives templates the flags they test, read
+from the same cached set.
+"""
+import time
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group, Permission, User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from catalog.caching import shared_cache
+
+VERSION_KEY = 'catalog:perms:version'
+TIMEOUT = 5 * 60
+
+# Context flag: permission
+TEMPLATE_PERMISSIONS = {
+    'can_change_author': 'catalog.can_change_author',
+    'can_mark_returned': 'catalog.can_mark_returned',
+}
+
+
+def cache_key(user_id):
+    return f'catalog:perms:{user_id}'
+
+
+def cached_permissions(user_id):
+    """(current version, permission set cached at that version or None), in one cache lookup."""
+    key = cache_key(user_id)
+    entries = shared_cache.get_many([VERSION_KEY, key])
+    version = entries.get(VERSION_KEY)
+    if version is None:
+        # Starts from the clock: if the version is evicted, old entries must not come back
+        version = shared_cache.get_or_set(VERSION_KEY, time.time_ns(), None)
+    cached_version, permissions = entries.get(key, (None, None))
+    return version, permissions if cached_version == version else None
+
+
+class CachedPermissionBackend(ModelBackend):
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        # Kept on the user for the rest of the request, as ModelBackend does: read once per request
+        if not hasattr(user_obj, '_perm_cache'):
+            version, permissions = cached_permissions(user_obj.pk)
+            if permissions is None:
+                permissions = super().get_all_permissions(user_obj)
+                shared_cache.set(cache_key(user_obj.pk), (version, permissions), TIMEOUT)
+            user_obj._perm_cache = permissions
+        return user_obj._perm_cache
+
+
+def catalog_permissions(request):
+    """Template flags of the permissions of the current user, e.g. {% if can_change_author %}."""
+    user = getattr(request, 'user', None)
+    permissions = user.get_all_permissions() if user is not None and user.is_authenticated else set()
+    return {flag: permission in permissions for flag, permission in TEMPLATE_PERMISSIONS.items()}
+
+
+def forget_user(user_id):
+    shared_cache.delete(cache_key(user_id))
+    # Again after commit: another request may have cached the old permissions meanwhile
+    transaction.on_commit(lambda: shared_cache.delete(cache_key(user_id)))
+
+
+def forget_all():
+    def bump():
+        try:
+            shared_cache.incr(VERSION_KEY)
+        except ValueError:
+            pass
+    bump()
+    transaction.on_commit(bump)
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def user_links_changed(sender, instance, action, reverse, **kwargs):
+    if action.startswith('post_'):
+        # Reverse: the users of a group or permission changed, there may be many
+        forget_all() if reverse else forget_user(instance.pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver([post_save, post_delete], sender=Group)
+@receiver([post_save, post_delete], sender=Permission)
+def groups_changed(sender, **kwargs):
+    if kwargs.get('action', 'post_').startswith('post_'):
+        forget_all()
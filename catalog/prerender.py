@@ -0,0 +1,163 @@
+"""
+Pre-rendered book and author detail pages.
+
+`manage.py prerender_catalog` writes the anonymous rendering of every BookDetailView and
+AuthorDetailView page to settings.PRERENDER_ROOT, as <url name>/<pk>.html. Once that
+directory exists, a change of the catalog queues its pages (see catalog/jobs.py), with
+those of the books whose copies bulk updates changed: `manage.py run_catalog_jobs`
+renders them again, outside the request. PrerenderedPageMiddleware (or the front proxy)
+serves the files.
+
+The per-user parts of these pages (sidebar login state, staff links) are not in the
+files: base_generic.html fetches them from the `user-fragment` view. Requests with
+pending messages (e.g. redirected to the page by AuthorUpdate) go to the view, which
+shows them.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.http import FileResponse
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve, reverse
+
+from catalog import jobs
+from catalog.models import Author, Book, BookInstance, Branch, CatalogJob, Genre, Language, copies_changed
+
+PRERENDERED_URL_NAMES = ('book-detail', 'author-detail')
+
+
+def page_path(url_name, pk):
+    return Path(settings.PRERENDER_ROOT) / url_name / f'{pk}.html'
+
+
+def is_enabled():
+    return Path(settings.PRERENDER_ROOT).is_dir()
+
+
+def render_page(url_name, pk):
+    """Return the page as rendered for an anonymous user, or None if the object doesn't exist."""
+    from catalog.views import AuthorDetailView, BookDetailView
+
+    view = {'book-detail': BookDetailView, 'author-detail': AuthorDetailView}[url_name]
+    request = RequestFactory().get(reverse(url_name, args=[pk]))
+    request.user = AnonymousUser()
+    request.session = {}
+    request.prerendering = True
+    if not view.model.objects.filter(pk=pk).exists():
+        return None
+    response = view.as_view()(request, pk=pk)
+    return response.render().content
+
+
+def write_page(url_name, pk):
+    """Render one page to its file, or remove the file if the object is gone."""
+    path = page_path(url_name, pk)
+    content = render_page(url_name, pk)
+    if content is None:
+        path.unlink(missing_ok=True)
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so that the page is never served half written
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as file:
+        file.write(content)
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, path)
+
+
+def write_pages(pages):
+    """Render a chunk of (url_name, pk) pages. Run in the process pool of prerender_catalog."""
+    for url_name, pk in pages:
+        write_page(url_name, pk)
+    return len(pages)
+
+
+def refresh(book_ids=(), author_ids=()):
+    """Queue the given pages, and those of the authors of the books, to be rendered again."""
+    if not is_enabled():
+        return
+    jobs.queue(CatalogJob.BOOK_PAGE, book_ids)
+    jobs.queue(CatalogJob.AUTHOR_PAGE, author_ids)
+
+
+@jobs.handler(CatalogJob.BOOK_PAGE)
+def render_books(book_ids):
+    if is_enabled():
+        # Their authors list them with their copy counts
+        author_ids = Book.objects.filter(pk__in=book_ids, author__isnull=False).values_list('author', flat=True)
+        write_pages([('book-detail', pk) for pk in book_ids] +
+                    [('author-detail', pk) for pk in set(author_ids)])
+
+
+@jobs.handler(CatalogJob.AUTHOR_PAGE)
+def render_authors(author_ids):
+    if is_enabled():
+        write_pages([('author-detail', pk) for pk in author_ids])
+
+
+@receiver([post_save, post_delete], sender=Book)
+def book_changed(sender, instance, **kwargs):
+    refresh(book_ids=[instance.pk], author_ids=[instance.author_id] if instance.author_id else [])
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genre_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith('post_'):
+        refresh(book_ids=(pk_set or []) if reverse else [instance.pk])
+
+
+@receiver([post_save, post_delete], sender=BookInstance)
+def book_instance_changed(sender, instance, **kwargs):
+    if instance.book_id:
+        refresh(book_ids=[instance.book_id])
+
+
+@receiver(copies_changed)
+def copies_changed_in_bulk(sender, book_ids, **kwargs):
+    refresh(book_ids=book_ids)
+
+
+# pre_delete: once the author is deleted its books no longer point to it
+@receiver([post_save, pre_delete], sender=Author)
+def author_changed(sender, instance, **kwargs):
+    if is_enabled():
+        refresh(book_ids=Book.objects.filter(author=instance.pk).values_list('pk', flat=True),
+                author_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Language)
+@receiver(post_save, sender=Branch)
+def reference_changed(sender, instance, **kwargs):
+    if is_enabled():
+        lookup = {Genre: 'genre', Language: 'language', Branch: 'bookinstance__branch'}[sender]
+        refresh(book_ids=Book.objects.filter(**{lookup: instance}).values_list('pk', flat=True))
+
+
+class PrerenderedPageMiddleware:
+    """Answer GET requests for pre-rendered pages from their file, without touching the database.
+
+    Not when the request has pending messages: the default message storage keeps them in
+    a cookie (with a marker there when the rest went to the session).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and not request.GET and CookieStorage.cookie_name not in request.COOKIES:
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                match = None
+            if match is not None and match.url_name in PRERENDERED_URL_NAMES:
+                path = page_path(match.url_name, match.kwargs['pk'])
+                if path.is_file():
+                    return FileResponse(path.open('rb'), content_type='text/html; charset=utf-8')
+        return self.get_response(request)
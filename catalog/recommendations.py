@@ -0,0 +1,173 @@
+"""
+"More like this" recommendations.
+
+Each book is a sparse feature vector: its genres, author and language, and the words
+of its summary, hashed into one feature space. Rows are normalised so that the dot
+product of two books is their cosine similarity. `build_similar_books` computes the
+top-K neighbours of every book block by block (memory stays bounded by the block,
+not by the size of the catalog) and stores them in SimilarBook, which the detail
+page reads with one indexed query.
+
+A change of the genres of a book queues a job (see catalog/jobs.py) rather than
+recomputing in the request. The job recomputes the neighbours of the book, of the
+books listing it (it may leave their list) and of the books it is now closer to than
+the last of their neighbours (it joins their list).
+"""
+import re
+import zlib
+
+import numpy as np
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+from scipy import sparse
+
+from catalog import jobs, prerender
+from catalog.models import Book, CatalogJob, SimilarBook
+
+TOP_K = 10
+FEATURE_SPACE = 2 ** 20
+# Cells of the similarity block computed at once (float32: 16M cells = 64 MB dense)
+BLOCK_CELLS = 2 ** 24
+
+# Weight of each kind of feature in the similarity
+WEIGHTS = {'genre': 3.0, 'author': 2.0, 'language': 0.5, 'summary': 1.0}
+
+WORD_RE = re.compile(r'\w{4,}')
+STOP_WORDS = {
+    'with', 'that', 'this', 'from', 'have', 'they', 'their', 'which', 'when', 'into', 'about', 'after', 'there',
+    'dans', 'pour', 'avec', 'mais', 'elle', 'sont', 'plus', 'leur', 'cette', 'comme', 'tout', 'nous', 'vous',
+}
+
+
+def feature_index(key):
+    # crc32 rather than hash(): the index must be the same in every process
+    return zlib.crc32(key.encode('utf-8')) % FEATURE_SPACE
+
+
+def book_features(author_id, language_id, genre_ids, summary):
+    """Return {feature index: weight} for one book, each kind of feature normalised to its weight."""
+    features = {}
+    groups = {
+        'genre': [f'genre:{genre_id}' for genre_id in genre_ids],
+        'author': [f'author:{author_id}'] if author_id else [],
+        'language': [f'language:{language_id}'] if language_id else [],
+        'summary': ['word:' + word for word in set(WORD_RE.findall(summary.lower())) - STOP_WORDS],
+    }
+    for group, keys in groups.items():
+        for key in keys:
+            index = feature_index(key)
+            features[index] = features.get(index, 0.0) + WEIGHTS[group] / np.sqrt(len(keys))
+    return features
+
+
+def feature_matrix(books):
+    """Build the L2-normalised CSR matrix of `books`, an iterable of Book values() dicts with genre_ids."""
+    book_ids, rows, columns, values = [], [], [], []
+    for row, book in enumerate(books):
+        book_ids.append(book['id'])
+        features = book_features(book['author_id'], book['language_id'], book['genre_ids'], book['summary'])
+        rows.extend([row] * len(features))
+        columns.extend(features.keys())
+        values.extend(features.values())
+    matrix = sparse.csr_matrix((np.array(values, dtype=np.float32), (rows, columns)),
+                               shape=(len(book_ids), FEATURE_SPACE))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    matrix = sparse.diags(1 / norms).dot(matrix).tocsr()
+    return np.array(book_ids, dtype=np.int64), matrix
+
+
+def catalog_books(queryset=None):
+    """Book values with their genre ids, read in two queries."""
+    queryset = (queryset if queryset is not None else Book.objects.all()).order_by('id')
+    books = list(queryset.values('id', 'author_id', 'language_id', 'summary'))
+    genres = {}
+    for book_id, genre_id in Book.genre.through.objects.filter(book__in=queryset).values_list('book_id', 'genre_id'):
+        genres.setdefault(book_id, []).append(genre_id)
+    for book in books:
+        book['genre_ids'] = genres.get(book['id'], [])
+    return books
+
+
+def top_neighbours(block, block_ids, matrix, book_ids, k):
+    """Yield (book id, [(similar id, score), ...]) for each row of `block`."""
+    scores = (block @ matrix.T).toarray()
+    # A book is not similar to itself
+    scores[book_ids[None, :] == block_ids[:, None]] = 0
+    k = min(k, scores.shape[1] - 1)
+    if k <= 0:
+        return
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    for row, columns in enumerate(best):
+        columns = columns[np.argsort(-scores[row, columns])]
+        yield block_ids[row], [(int(book_ids[column]), float(scores[row, column]))
+                               for column in columns if scores[row, column] > 0]
+
+
+def store(neighbours):
+    """Replace the similar books of the given books."""
+    neighbours = list(neighbours)
+    with transaction.atomic():
+        SimilarBook.objects.filter(book__in=[book_id for book_id, _ in neighbours]).delete()
+        SimilarBook.objects.bulk_create([
+            SimilarBook(book_id=book_id, similar_id=similar_id, rank=rank, score=score)
+            for book_id, similar in neighbours for rank, (similar_id, score) in enumerate(similar)
+        ], batch_size=1000)
+
+
+def block_size(book_ids):
+    return max(1, BLOCK_CELLS // max(1, len(book_ids)))
+
+
+def store_rows(rows, book_ids, matrix, k, progress=None):
+    """Compute and store the top-k similar books of the books at `rows` of the matrix, block by block."""
+    size = block_size(book_ids)
+    for start in range(0, len(rows), size):
+        block = rows[start:start + size]
+        store(top_neighbours(matrix[block], book_ids[block], matrix, book_ids, k))
+        if progress:
+            progress(min(start + size, len(rows)), len(rows))
+
+
+def build_similar_books(k=TOP_K, progress=None):
+    """Compute and store the top-k similar books of every book of the catalog."""
+    book_ids, matrix = feature_matrix(catalog_books())
+    store_rows(np.arange(len(book_ids)), book_ids, matrix, k, progress)
+
+
+@jobs.handler(CatalogJob.SIMILAR_BOOKS)
+def update_similar_books(changed_ids, k=TOP_K):
+    """Recompute the similar books of the changed books and of the books whose similar books they join or leave."""
+    book_ids, matrix = feature_matrix(catalog_books())
+    changed = np.flatnonzero(np.isin(book_ids, list(changed_ids)))
+    # Deleted books left the lists already, with their rows
+    affected = set(SimilarBook.objects.filter(similar__in=changed_ids).values_list('book', flat=True))
+    affected.update(book_ids[changed].tolist())
+    if len(changed):
+        best = np.zeros(len(book_ids), dtype=np.float32)
+        size = block_size(book_ids)
+        for start in range(0, len(changed), size):
+            rows = changed[start:start + size]
+            scores = (matrix[rows] @ matrix.T).toarray()
+            scores[np.arange(len(rows)), rows] = 0
+            best = np.maximum(best, scores.max(axis=0))
+        # Lists not full yet take any similar book
+        last = dict(SimilarBook.objects.filter(rank=k - 1).values_list('book', 'score'))
+        thresholds = np.array([last.get(pk, 0.0) for pk in book_ids.tolist()], dtype=np.float32)
+        affected.update(book_ids[best > thresholds].tolist())
+    store_rows(np.flatnonzero(np.isin(book_ids, list(affected))), book_ids, matrix, k)
+    # The book pages list their similar books
+    prerender.refresh(book_ids=affected)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genre_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            jobs.queue(CatalogJob.SIMILAR_BOOKS, [instance.pk])
+    elif action == 'pre_clear':
+        # No pk_set for clear(): the books of the genre, while they still have it
+        jobs.queue(CatalogJob.SIMILAR_BOOKS, instance.book_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        jobs.queue(CatalogJob.SIMILAR_BOOKS, pk_set)
@@ -0,0 +1,91 @@
+"""
+Database routing between the primary ('default') and read replicas.
+
+Reads of the public catalog models go to one of the replicas listed in
+settings.DATABASE_REPLICAS. Every write goes to the primary, and after a browser
+writes to one of those models its reads stay on the primary for
+settings.REPLICA_STICKY_SECONDS so that it sees its own changes despite replication lag.
+Other writes (profiles saved on every login, loan events, copies) don't pin: their
+models are always read from the primary.
+
+The deadline is kept in a cookie of its own rather than in the session: reading the
+session on every request would make every response vary on the cookies.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+# Models whose reads can be served by a replica
+REPLICATED_MODELS = {'catalog.book', 'catalog.author', 'catalog.genre', 'catalog.language'}
+
+STICKY_COOKIE = 'db_primary_until'
+
+# Set by ReplicaStickinessMiddleware for the duration of a request
+_use_primary = ContextVar('use_primary', default=False)
+_has_written = ContextVar('has_written', default=False)
+
+
+@contextmanager
+def primary():
+    """Reads of the block go to the primary, e.g. for work on changes just committed."""
+    use_primary = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(use_primary)
+
+
+def is_replicated(model):
+    # Not _meta.label_lower: the cache entries of DatabaseCache have a minimal _meta
+    return f'{model._meta.app_label}.{model._meta.model_name}' in REPLICATED_MODELS
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or _use_primary.get() or not is_replicated(model):
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        if is_replicated(model):
+            _has_written.set(True)
+            # Reads for the rest of this request must see the write too
+            _use_primary.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReplicaStickinessMiddleware:
+    """Keep a browser on the primary for a while after it wrote to the replicated models."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        use_primary = _use_primary.set(pinned_until > time.time())
+        has_written = _has_written.set(False)
+        try:
+            response = self.get_response(request)
+            if _has_written.get():
+                # Expires by itself: nothing to clear afterwards
+                seconds = settings.REPLICA_STICKY_SECONDS
+                response.set_cookie(STICKY_COOKIE, str(time.time() + seconds), max_age=seconds,
+                                    secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax')
+        finally:
+            _use_primary.reset(use_primary)
+            _has_written.reset(has_written)
+        return response
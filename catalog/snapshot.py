@@ -0,0 +1,263 @@
+"""
+Snapshot of the hot reference columns of the catalog, shared by the worker processes.
+
+Author names, language names, genre names and depths, and book titles are written by
+one process to a file of settings.SNAPSHOT_DIR, which every worker maps read-only: the
+pages of the file are shared by all the workers, whatever their number, and lookups
+read the arrays in place, without copying them or querying the database.
+
+Each table of the file holds, in display order, the ids (int64), the end offset of each
+name in the UTF-8 text (uint32) and a small integer (int16: the depth of a genre); then
+the ids sorted (int64) with their rows (int32), for lookups by id; then the text.
+
+`manage.py build_snapshot` writes the first version and creates the directory; until
+then, the forms read the database. Catalog changes mark the snapshot stale when they
+commit. The first worker to notice it, at most every CHECK_SECONDS, starts a thread
+that takes the leader lock and writes the next version beside the current one, then
+points `current` to it with an atomic rename; meanwhile the requests keep reading the
+current version, and every worker maps the new one on its next check. Replaced files
+are deleted: a worker still mapping one keeps reading its pages until it switches.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from catalog.models import Author, Book, Genre, Language
+
+CHECK_SECONDS = 2
+MAGIC = b'CATSNAP1'
+TABLES = ('author', 'language', 'genre', 'book')
+# Magic, version, then (offset, count) of each table
+HEADER = struct.Struct('<8sQ' + 'QQ' * len(TABLES))
+
+
+def table_rows():
+    """{table: [(id, name, number)]} in the order of the model's choices."""
+    return {
+        'author': [(pk, f'{last_name}, {first_name}', 0)
+                   for pk, last_name, first_name in Author.objects.values_list('pk', 'last_name', 'first_name')],
+        'language': [(pk, name, 0) for pk, name in Language.objects.values_list('pk', 'name')],
+        'genre': list(Genre.objects.values_list('pk', 'name', 'level')),
+        'book': [(pk, title, 0) for pk, title in Book.objects.values_list('pk', 'title')],
+    }
+
+
+def pack_table(rows):
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    texts = [row[1].encode('utf-8') for row in rows]
+    ends = np.cumsum([len(text) for text in texts], dtype=np.uint64).astype(np.uint32)
+    numbers = np.array([row[2] for row in rows], dtype=np.int16)
+    order = np.argsort(ids, kind='stable').astype(np.int32)
+    data = ids.tobytes() + ends.tobytes() + numbers.tobytes() + ids[order].tobytes() + order.tobytes()
+    data += b''.join(texts)
+    # Next table aligned on 8 bytes for its int64 arrays
+    return data + b'\0' * (-len(data) % 8)
+
+
+class Table:
+    """Zero-copy view of a table of a mapped snapshot."""
+
+    def __init__(self, buffer, offset, count):
+        self.count = count
+
+        def array(dtype):
+            nonlocal offset
+            values = np.frombuffer(buffer, dtype, count, offset)
+            offset += values.nbytes
+            return values
+
+        self.ids = array(np.int64)
+        self.ends = array(np.uint32)
+        self.numbers = array(np.int16)
+        self.sorted_ids = array(np.int64)
+        self.rows = array(np.int32)
+        self.text = memoryview(buffer)[offset:offset + (int(self.ends[-1]) if count else 0)]
+
+    def __len__(self):
+        return self.count
+
+    def row(self, pk):
+        index = int(np.searchsorted(self.sorted_ids, pk))
+        if index < self.count and self.sorted_ids[index] == pk:
+            return int(self.rows[index])
+        return None
+
+    def name_at(self, row):
+        start = int(self.ends[row - 1]) if row else 0
+        return str(self.text[start:int(self.ends[row])], 'utf-8')
+
+    def name(self, pk, default=None):
+        row = self.row(pk)
+        return default if row is None else self.name_at(row)
+
+    def number(self, pk):
+        row = self.row(pk)
+        return None if row is None else int(self.numbers[row])
+
+    def choices(self):
+        """(id, name) of every row, in display order."""
+        return [(int(pk), self.name_at(row)) for row, pk in enumerate(self.ids)]
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, *sections = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a catalog snapshot')
+        self.tables = {name: Table(self.buffer, offset, count)
+                       for name, offset, count in zip(TABLES, sections[::2], sections[1::2])}
+
+    def __getitem__(self, table):
+        return self.tables[table]
+
+
+def file_prefix():
+    # One snapshot per database: the test databases don't read the development one
+    database = str(settings.DATABASES['default']['NAME'])
+    return Path(settings.SNAPSHOT_DIR) / hashlib.sha1(database.encode()).hexdigest()[:12]
+
+
+def write_atomically(path, data):
+    with tempfile.NamedTemporaryFile('wb', dir=path.parent, suffix='.tmp', delete=False) as file:
+        file.write(data)
+    os.replace(file.name, path)
+
+
+def build():
+    """Write a new version from the database and make it current. Returns its path."""
+    prefix = file_prefix()
+    prefix.parent.mkdir(parents=True, exist_ok=True)
+    # Taken before reading: changes committed meanwhile leave the new version stale
+    version = time.time_ns()
+    rows = table_rows()
+    sections, tables, offset = [], [], HEADER.size
+    for name in TABLES:
+        data = pack_table(rows[name])
+        sections += [offset, len(rows[name])]
+        tables.append(data)
+        offset += len(data)
+    path = prefix.with_name(f'{prefix.name}-{version}.bin')
+    write_atomically(path, HEADER.pack(MAGIC, version, *sections) + b''.join(tables))
+    write_atomically(prefix.with_suffix('.current'), path.name.encode())
+    for old in prefix.parent.glob(f'{prefix.name}-*.bin'):
+        if old != path:
+            old.unlink(missing_ok=True)
+    return path
+
+
+def is_stale(prefix, version):
+    try:
+        return int(prefix.with_suffix('.stale').read_text() or 0) > version
+    except (FileNotFoundError, ValueError):
+        return False
+
+
+def rebuild_if_leader(prefix):
+    """Rebuild unless another process is already doing it."""
+    with open(prefix.with_suffix('.lock'), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        current = read_current(prefix)
+        # Check again under the lock: the previous leader may have rebuilt already
+        if current is not None and is_stale(prefix, Snapshot(current).version):
+            build()
+
+
+def read_current(prefix):
+    try:
+        return prefix.parent / prefix.with_suffix('.current').read_text()
+    except FileNotFoundError:
+        return None
+
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0
+_rebuilding = None
+
+
+def rebuild_in_background(prefix):
+    """Rebuild in a thread of this process, unless one is running: not in the request that noticed."""
+    global _rebuilding
+    if _rebuilding is not None and _rebuilding.is_alive():
+        return
+
+    def rebuild():
+        try:
+            rebuild_if_leader(prefix)
+        finally:
+            # The connections of this thread
+            connections.close_all()
+
+    _rebuilding = threading.Thread(target=rebuild, name='snapshot-rebuild', daemon=True)
+    _rebuilding.start()
+
+
+def get_snapshot():
+    """The current snapshot, mapped by this process, or None if there is none."""
+    global _snapshot, _checked_at
+    if time.monotonic() - _checked_at < CHECK_SECONDS:
+        return _snapshot
+    with _lock:
+        _checked_at = time.monotonic()
+        prefix = file_prefix()
+        if not prefix.parent.is_dir():
+            _snapshot = None
+            return None
+        current = read_current(prefix)
+        if current is None:
+            _snapshot = None
+        elif _snapshot is None or _snapshot.path != current:
+            try:
+                _snapshot = Snapshot(current)
+            except FileNotFoundError:
+                # Replaced between reading `current` and opening it: next check
+                pass
+        # Meanwhile, the requests read the version mapped
+        if _snapshot is not None and is_stale(prefix, _snapshot.version):
+            rebuild_in_background(prefix)
+        return _snapshot
+
+
+@receiver(setting_changed)
+def forget_snapshot(setting, **kwargs):
+    global _snapshot, _checked_at
+    if setting in ('SNAPSHOT_DIR', 'DATABASES'):
+        with _lock:
+            _snapshot, _checked_at = None, 0
+
+
+def mark_stale():
+    prefix = file_prefix()
+    if prefix.parent.is_dir():
+        prefix.with_suffix('.stale').write_text(str(time.time_ns()))
+
+
+@receiver([post_save, post_delete], sender=Author)
+@receiver([post_save, post_delete], sender=Language)
+@receiver([post_save, post_delete], sender=Genre)
+@receiver([post_save, post_delete], sender=Book)
+def reference_changed(sender, **kwargs):
+    # Copy counters and other Book columns that aren't in the snapshot change often: skip them
+    update_fields = kwargs.get('update_fields')
+    if sender is Book and update_fields and 'title' not in update_fields:
+        return
+    transaction.on_commit(mark_stale)
@@ -0,0 +1,203 @@
+"""
+Stocktake: the copies scanned on the shelves against the catalog.
+
+Scans arrive in batches (`add_scans()`), each stored as one row holding the 16-byte
+UUIDs of its copies: a session of a million scans is a few thousand rows and 16 MB,
+however many times a copy is scanned.
+
+`reconcile()` loads the scanned ids and the ids and statuses of the copies of the
+branch into numpy arrays of two uint64 columns (the halves of the UUIDs), sorted, and
+compares them with set operations:
+ - missing: copies of the branch expected on the shelves (available or reserved) that
+   weren't scanned;
+ - wrong status: scanned copies of the branch recorded as on loan, in maintenance or
+   lost;
+ - unexpected: scanned copies of another branch, and ids of no copy.
+The copies of the branch are read in chunks of CHUNK_SIZE rows, about 17 bytes each
+once loaded; only the scanned copies found outside the branch are looked up by id.
+
+The discrepancies are stored, then fixed in bulk, by kind: missing copies are marked
+lost, copies with the wrong status available (their loans returned), unexpected copies
+moved to the branch. Fixes are UPDATEs of ID_CHUNK copies at a time, of the copies still
+in the status the reconciliation found; the others changed since (checked out again,
+scanned at the desk) and their discrepancies stay open.
+"""
+import operator
+import uuid
+from collections import Counter
+from functools import reduce
+from itertools import islice
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from catalog import desk
+from catalog.circulation import loan_events, record_loan_events
+from catalog.models import BookInstance, Stocktake, StocktakeBatch, StocktakeDiscrepancy
+
+CHUNK_SIZE = 10000
+# Ids per query: SQLite allows 999 parameters
+ID_CHUNK = 500
+ON_SHELF = ('a', 'r')
+UUIDS = np.dtype([('high', '<u8'), ('low', '<u8')])
+
+
+def chunked(items, size):
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def uuid_array(data):
+    """Array of UUIDS from `data`, UUIDs of 16 bytes one after the other."""
+    halves = np.frombuffer(data, dtype='>u8').reshape(-1, 2)
+    ids = np.empty(len(halves), dtype=UUIDS)
+    ids['high'], ids['low'] = halves[:, 0], halves[:, 1]
+    return ids
+
+
+def to_uuids(ids):
+    return [uuid.UUID(int=(high << 64) | low) for high, low in ids.tolist()]
+
+
+def sort_order(ids):
+    return np.lexsort((ids['low'], ids['high']))
+
+
+def unique(ids):
+    """The sorted ids without repeats."""
+    ids = ids[sort_order(ids)]
+    first = np.ones(len(ids), dtype=bool)
+    first[1:] = (ids['high'][1:] != ids['high'][:-1]) | (ids['low'][1:] != ids['low'][:-1])
+    return ids[first]
+
+
+def isin(ids, others):
+    """Mask of the `ids` that are in `others`, both without repeats."""
+    # Sorted together, an id in both arrays is next to itself
+    both = np.concatenate([ids, others])
+    order = sort_order(both)
+    both = both[order]
+    equal = (both['high'][1:] == both['high'][:-1]) & (both['low'][1:] == both['low'][:-1])
+    found = np.zeros(len(both), dtype=bool)
+    found[order[:-1][equal]] = True
+    found[order[1:][equal]] = True
+    return found[:len(ids)]
+
+
+def add_scans(stocktake, copy_ids):
+    """Append a batch of scanned copy ids (UUIDs) to the stocktake."""
+    copy_ids = list(copy_ids)
+    if not copy_ids:
+        return
+    with transaction.atomic():
+        StocktakeBatch.objects.create(stocktake=stocktake, copies=b''.join(copy_id.bytes for copy_id in copy_ids))
+        Stocktake.objects.filter(pk=stocktake.pk).update(scans=F('scans') + len(copy_ids))
+
+
+def scanned_ids(stocktake):
+    batches = stocktake.batches.order_by().values_list('copies', flat=True)
+    return unique(uuid_array(b''.join(bytes(copies) for copies in batches.iterator(chunk_size=100))))
+
+
+def branch_copies(stocktake):
+    """Sorted ids of the copies of the stocktake's branch (all of them without a branch), and their statuses."""
+    copies = BookInstance.objects.order_by()
+    if stocktake.branch_id is not None:
+        copies = copies.filter(branch=stocktake.branch_id)
+    ids, statuses = [], []
+    for chunk in chunked(copies.values_list('id', 'status').iterator(chunk_size=CHUNK_SIZE), CHUNK_SIZE):
+        ids.append(uuid_array(b''.join(copy_id.bytes for copy_id, _status in chunk)))
+        statuses.append(np.array([status for _copy_id, status in chunk], dtype='S1'))
+    if not ids:
+        return np.empty(0, dtype=UUIDS), np.empty(0, dtype='S1')
+    ids, statuses = np.concatenate(ids), np.concatenate(statuses)
+    order = sort_order(ids)
+    return ids[order], statuses[order]
+
+
+def reconcile(stocktake):
+    """Replace the discrepancies of the stocktake with those of its scans now. Returns their number by kind."""
+    scanned = scanned_ids(stocktake)
+    ids, statuses = branch_copies(stocktake)
+    found = isin(ids, scanned)
+    on_shelf = np.isin(statuses, [status.encode() for status in ON_SHELF])
+    discrepancies = [
+        StocktakeDiscrepancy(stocktake=stocktake, kind=StocktakeDiscrepancy.MISSING, copy_id=copy_id,
+                             status=status.decode())
+        for copy_id, status in zip(to_uuids(ids[~found & on_shelf]), statuses[~found & on_shelf].tolist())
+    ]
+    discrepancies += [
+        StocktakeDiscrepancy(stocktake=stocktake, kind=StocktakeDiscrepancy.WRONG_STATUS, copy_id=copy_id,
+                             status=status.decode())
+        for copy_id, status in zip(to_uuids(ids[found & ~on_shelf]), statuses[found & ~on_shelf].tolist())
+    ]
+    # Few, on a real stocktake: looked up by id
+    elsewhere = to_uuids(scanned[~isin(scanned, ids)])
+    for chunk in chunked(elsewhere, ID_CHUNK):
+        known = dict(BookInstance.objects.filter(pk__in=chunk).values_list('pk', 'status'))
+        discrepancies += [
+            StocktakeDiscrepancy(stocktake=stocktake, kind=StocktakeDiscrepancy.UNEXPECTED, copy_id=copy_id,
+                                 status=known.get(copy_id, ''))
+            for copy_id in chunk
+        ]
+    with transaction.atomic():
+        stocktake.discrepancies.all().delete()
+        StocktakeDiscrepancy.objects.bulk_create(discrepancies, batch_size=1000)
+        stocktake.reconciled_at = timezone.now()
+        stocktake.save(update_fields=['reconciled_at'])
+    return Counter(discrepancy.kind for discrepancy in discrepancies)
+
+
+def returned_loans(rows):
+    """Return events of the copies on loan among `rows` of (pk, book_id, status, borrower_id, due_back)."""
+    events = []
+    for pk, book_id, status, borrower_id, due_back in rows:
+        if status == 'o':
+            returned = BookInstance(pk=pk, book_id=book_id, borrower_id=borrower_id, status='a')
+            events += loan_events(returned, 'o', due_back)
+    return events
+
+
+@transaction.atomic
+def fix(stocktake, kind):
+    """Fix the open discrepancies of `kind` (see the module docstring). Returns the number of copies changed."""
+    open_rows = stocktake.discrepancies.filter(kind=kind, fixed=False).values_list('copy_id', 'status')
+    changed, copy_ids, book_ids = 0, [], set()
+    for chunk in chunked(list(open_rows), ID_CHUNK):
+        copies = BookInstance.objects.filter(pk__in=[copy_id for copy_id, _status in chunk])
+        if kind == StocktakeDiscrepancy.MISSING:
+            # Unless it changed since: checked out, or scanned at the desk
+            copies = copies.filter(status__in=ON_SHELF)
+            updates = {'status': 'l'}
+        elif kind == StocktakeDiscrepancy.WRONG_STATUS:
+            # Each copy in the status found, e.g. not checked out again after its repair
+            statuses = {}
+            for copy_id, status in chunk:
+                statuses.setdefault(status, []).append(copy_id)
+            copies = copies.filter(reduce(operator.or_, [Q(pk__in=ids, status=status)
+                                                         for status, ids in statuses.items()]))
+            updates = {'status': 'a', 'borrower': None, 'due_back': None}
+        elif stocktake.branch_id is not None:
+            updates = {'branch': stocktake.branch_id}
+        else:
+            # Unknown ids: nothing to change
+            continue
+        # Locked until the commit, as at the desk: a copy checked out or returned meanwhile
+        # waits, and the events and the update are those of the rows read here
+        rows = list(copies.select_for_update().values_list('pk', 'book_id', 'status', 'borrower_id', 'due_back'))
+        if kind == StocktakeDiscrepancy.WRONG_STATUS:
+            record_loan_events(returned_loans(rows))
+        ids = [row[0] for row in rows]
+        copy_ids += ids
+        book_ids.update(row[1] for row in rows)
+        # Status updates also recount the copies of the books
+        changed += BookInstance.objects.filter(pk__in=ids).update(**updates)
+        # Unknown ids, and copies that changed since the reconciliation, stay open
+        stocktake.discrepancies.filter(kind=kind, copy_id__in=ids).update(fixed=True)
+    book_ids.discard(None)
+    # update() sends no post_save (the pre-rendered pages follow copies_changed)
+    desk.forget_changed(copy_ids, book_ids)
+    return changed
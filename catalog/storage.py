@@ -0,0 +1,155 @@
+"""
+Static files build run by collectstatic.
+
+Bootstrap is vendored in catalog/static/vendor/bootstrap. At collectstatic time its
+selectors that the project's templates can't match are purged, and the rules needed
+by base_generic.html are written to css/critical.css to be inlined in the page head
+(see the critical_css template tag). WhiteNoise then hashes every file and writes
+the gzip and Brotli variants.
+"""
+import fnmatch
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.template.loader import get_template
+from django.template.utils import get_app_template_dirs
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+LICENSE_RE = re.compile(r'/\*!.*?\*/', re.DOTALL)
+NOT_RE = re.compile(r':not\([^)]*\)')
+CLASS_OR_ID_RE = re.compile(r'[.#](-?[_a-zA-Z][\w-]*)')
+TOKEN_RE = re.compile(r'-?[_a-zA-Z][\w-]*')
+
+# Classes that only JavaScript adds, so they never appear in a template
+SAFELIST = ['show', 'showing', 'hiding', 'collapsing', 'active', 'disabled']
+
+
+def project_template_files():
+    """Every template of the project (not of third party apps)."""
+    directories = [Path(directory) for engine in settings.TEMPLATES for directory in engine.get('DIRS', [])]
+    directories += [Path(directory) for directory in get_app_template_dirs('templates')]
+    for directory in directories:
+        if str(directory).startswith(str(settings.BASE_DIR)) and 'site-packages' not in str(directory):
+            yield from directory.rglob('*.html')
+
+
+def template_tokens(files):
+    """Every word of the given templates that could be a class name or an id."""
+    tokens = set(SAFELIST)
+    for file in files:
+        tokens.update(TOKEN_RE.findall(Path(file).read_text(encoding='utf-8')))
+    return tokens
+
+
+def split_rules(css):
+    """Yield (prelude, block) for each top-level rule; block is None for statements such as @charset."""
+    position = 0
+    while True:
+        brace = css.find('{', position)
+        semicolon = css.find(';', position)
+        if brace == -1:
+            return
+        if semicolon != -1 and semicolon < brace:
+            yield css[position:semicolon].strip(), None
+            position = semicolon + 1
+            continue
+        depth = 0
+        for end in range(brace, len(css)):
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+        yield css[position:brace].strip(), css[brace + 1:end]
+        position = end + 1
+
+
+def split_selectors(prelude):
+    """Split a selector list on the commas that are not inside parentheses."""
+    selectors, depth, start = [], 0, 0
+    for index, char in enumerate(prelude):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            selectors.append(prelude[start:index])
+            start = index + 1
+    selectors.append(prelude[start:])
+    return selectors
+
+
+def is_used(name, tokens):
+    # A token ending with '-' comes from a template building the name, as in "alert-{{ message.tags }}"
+    return name in tokens or any(token.endswith('-') and name.startswith(token) for token in tokens) \
+        or any(fnmatch.fnmatchcase(name, pattern) for pattern in SAFELIST)
+
+
+def selector_used(selector, tokens):
+    names = CLASS_OR_ID_RE.findall(NOT_RE.sub('', selector))
+    return all(is_used(name, tokens) for name in names)
+
+
+def purge_css(css, tokens):
+    """Remove the rules whose selectors need a class or id that is not in `tokens`."""
+    licenses = LICENSE_RE.findall(css)
+    rules = purge_rules(COMMENT_RE.sub('', css), tokens)
+    # @charset has to stay the very first thing of the file
+    charset = ''
+    if rules.startswith('@charset'):
+        charset, rules = rules.split(';', 1)
+        charset += ';'
+    return '\n'.join(([charset] if charset else []) + licenses + [rules])
+
+
+def purge_rules(css, tokens):
+    output = []
+    for prelude, block in split_rules(css):
+        if block is None:
+            output.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports')):
+            inner = purge_rules(block, tokens)
+            if inner:
+                output.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@'):
+            output.append(f'{prelude}{{{block}}}')
+        else:
+            selectors = [selector for selector in split_selectors(prelude) if selector_used(selector, tokens)]
+            if selectors:
+                output.append(f'{",".join(selectors)}{{{block}}}')
+    return ''.join(output)
+
+
+class PurgedCompressedManifestStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    purged_files = ['vendor/bootstrap/css/bootstrap.min.css']
+    critical_file = 'css/critical.css'
+    critical_sources = ['vendor/bootstrap/css/bootstrap.min.css', 'css/styles.css']
+    critical_template = 'base_generic.html'
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            self.build_css(paths)
+        yield from super().post_process(paths, dry_run, **options)
+
+    def build_css(self, paths):
+        tokens = template_tokens(project_template_files())
+        for name in self.purged_files:
+            self.write(paths, name, purge_css(self.read(name), tokens))
+        critical_tokens = template_tokens([get_template(self.critical_template).origin.name])
+        critical = ''.join(purge_css(self.read(name), critical_tokens) for name in self.critical_sources)
+        self.write(paths, self.critical_file, critical)
+
+    def read(self, name):
+        with self.open(name) as file:
+            return file.read().decode('utf-8')
+
+    def write(self, paths, name, content):
+        if self.exists(name):
+            self.delete(name)
+        self.save(name, ContentFile(content.encode('utf-8')))
+        # Hash and compress the file written in STATIC_ROOT, not the source found by the finders
+        paths[name] = (self, name)
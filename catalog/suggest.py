@@ -0,0 +1,202 @@
+"""
+Typeahead suggestions of book titles and author names.
+
+Names are normalised (accents folded, case folded, punctuation dropped) and each word
+start of a name becomes a key, so that "mis" finds "Les Misérables". The keys are kept
+in one sorted list: a lookup is a bisect to the first key with the prefix followed by
+a short scan. Keys are cut to KEY_LENGTH characters and at most MAX_WORDS word starts
+are indexed per name, which bounds the memory to a few entries per book and author.
+
+Each process builds its index on first use (or when warm() is called at worker start).
+Changes made by a process update its index right away and are logged in the cache
+shared by the processes (see catalog/caching.py); the other processes check the log
+at most every CHECK_SECONDS, on a lookup, and replay it, or rebuild if they missed too
+much of it. The keystrokes in between don't leave the process.
+"""
+import bisect
+import threading
+import time
+from array import array
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.urls import reverse
+
+from catalog.caching import shared_cache
+from catalog.models import Author, Book
+from catalog.text import normalize
+
+KEY_LENGTH = 40
+MAX_WORDS = 8
+# Changes kept in the shared cache for the other processes
+LOG_LENGTH = 200
+VERSION_KEY = 'catalog:suggest:version'
+# Delay before the changes of the other processes are looked for
+CHECK_SECONDS = 2
+
+KINDS = {'book': Book, 'author': Author}
+
+
+def index_keys(name):
+    """Keys of `name`: the normalised name from each of its first MAX_WORDS word starts."""
+    words = normalize(name).split()
+    return {' '.join(words[start:])[:KEY_LENGTH] for start in range(min(len(words), MAX_WORDS))}
+
+
+def labels(kind, queryset):
+    """(pk, label) of the objects of `queryset`, read with one query."""
+    if kind == 'book':
+        return queryset.values_list('pk', 'title')
+    return ((pk, f'{first_name} {last_name}')
+            for pk, first_name, last_name in queryset.values_list('pk', 'first_name', 'last_name'))
+
+
+def encode(kind, pk):
+    """One int per reference: a list of ints is far smaller than a list of tuples."""
+    return pk << 1 | (kind == 'author')
+
+
+def decode(ref):
+    return 'author' if ref & 1 else 'book', ref >> 1
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.keys = []
+        self.refs = array('q')
+        # Encoded reference: label. The keys of an object are computed again from it to remove them.
+        self.labels = {}
+
+    @classmethod
+    def build(cls):
+        index = cls()
+        entries = []
+        for kind, model in KINDS.items():
+            for pk, label in labels(kind, model.objects.order_by()):
+                ref = encode(kind, pk)
+                index.labels[ref] = label
+                entries.extend((key, ref) for key in index_keys(label))
+        entries.sort()
+        index.keys = [key for key, _ref in entries]
+        index.refs = array('q', (ref for _key, ref in entries))
+        return index
+
+    def remove(self, kind, pk):
+        ref = encode(kind, pk)
+        label = self.labels.pop(ref, None)
+        for key in index_keys(label) if label is not None else ():
+            position = bisect.bisect_left(self.keys, key)
+            while position < len(self.keys) and self.keys[position] == key:
+                if self.refs[position] == ref:
+                    del self.keys[position], self.refs[position]
+                    break
+                position += 1
+
+    def add(self, kind, pk, label):
+        self.remove(kind, pk)
+        ref = encode(kind, pk)
+        self.labels[ref] = label
+        for key in index_keys(label):
+            position = bisect.bisect_right(self.keys, key)
+            self.keys.insert(position, key)
+            self.refs.insert(position, ref)
+
+    def lookup(self, prefix, limit=10):
+        """Return [(kind, pk, label)] of the names with a word starting with `prefix`."""
+        prefix = normalize(prefix)[:KEY_LENGTH]
+        if not prefix:
+            return []
+        results, seen = [], set()
+        position = bisect.bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(results) < limit and self.keys[position].startswith(prefix):
+            ref = self.refs[position]
+            if ref not in seen:
+                seen.add(ref)
+                results.append((*decode(ref), self.labels[ref]))
+            position += 1
+        return results
+
+
+_index = None
+_version = None
+_checked_at = 0
+_lock = threading.Lock()
+
+
+def current_version():
+    # Starts from the clock: after an eviction the numbers can't meet those of the old log
+    return shared_cache.get_or_set(VERSION_KEY, time.time_ns(), None)
+
+
+def change_key(number):
+    return f'catalog:suggest:change:{number}'
+
+
+def refresh(kind, pk):
+    """Update the index for one object, as it is now in the database."""
+    label = next(iter(labels(kind, KINDS[kind].objects.filter(pk=pk))), (None, None))[1]
+    if label is None:
+        _index.remove(kind, pk)
+    else:
+        _index.add(kind, pk, label)
+
+
+def get_index():
+    """The index of this process, brought up to date with the changes of the other processes."""
+    global _index, _version, _checked_at
+    if _index is not None and time.monotonic() - _checked_at < CHECK_SECONDS:
+        return _index
+    with _lock:
+        _checked_at = time.monotonic()
+        version = current_version()
+        if _index is not None and _version != version:
+            missed = range(_version + 1, version + 1)
+            changes = shared_cache.get_many([change_key(number) for number in missed]) if len(missed) <= LOG_LENGTH else {}
+            if not missed or len(changes) < len(missed):
+                _index = None
+            else:
+                for number in missed:
+                    refresh(*changes[change_key(number)])
+                _version = version
+        if _index is None:
+            # Version read before the build: changes made during the build are replayed next time
+            _version = version
+            _index = PrefixIndex.build()
+        return _index
+
+
+def warm():
+    get_index()
+
+
+def suggestions(prefix, limit=10):
+    return [
+        {'kind': kind, 'label': label, 'url': reverse(f'{kind}-detail', args=[pk])}
+        for kind, pk, label in get_index().lookup(prefix, limit)
+    ]
+
+
+def object_changed(kind, pk):
+    global _version, _checked_at
+    try:
+        version = shared_cache.incr(VERSION_KEY)
+    except ValueError:
+        # Version evicted: start a new log, the other processes will rebuild
+        version = current_version()
+    shared_cache.set(change_key(version), (kind, pk), 60 * 60)
+    with _lock:
+        if _index is not None and _version == version - 1:
+            refresh(kind, pk)
+            _version = version
+        else:
+            # Behind the log: replayed, with this change, on the next lookup
+            _checked_at = 0
+
+
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Author)
+def name_changed(sender, instance, **kwargs):
+    kind, pk = 'book' if sender is Book else 'author', instance.pk
+    # After commit, so that the other processes read the new name when they replay the change
+    transaction.on_commit(lambda: object_changed(kind, pk))
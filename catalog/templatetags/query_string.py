@@ -0,0 +1,16 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def query_string(context, **changes):
+    """The query string of the current request with `changes`, for links keeping the other parameters.
+    A None value removes the parameter."""
+    query = context['request'].GET.copy()
+    for name, value in changes.items():
+        if value is None:
+            query.pop(name, None)
+        else:
+            query[name] = value
+    return '?' + query.urlencode()
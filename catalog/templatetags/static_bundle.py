@@ -0,0 +1,23 @@
+from functools import lru_cache
+
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+
+@lru_cache(maxsize=None)
+def read_static(name):
+    try:
+        with staticfiles_storage.open(name) as file:
+            return file.read().decode('utf-8')
+    except OSError:
+        # Not built by collectstatic (development server)
+        return ''
+
+
+@register.simple_tag
+def critical_css():
+    """Content of css/critical.css written by collectstatic, to inline in a <style> tag."""
+    return mark_safe(read_static('css/critical.css'))
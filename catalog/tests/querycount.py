@@ -0,0 +1,125 @@
+"""
+Test-time N+1 query detector.
+
+Every request made through ``QueryCountingClient`` records the SQL it ran. Queries are
+grouped by shape (the SQL with its parameters left as placeholders), so the same
+statement run with different ids counts as one shape. A shape that runs more than
+``repeated_query_threshold`` times in a single request is an N+1 and is reported with
+the template line and the Python call site that triggered it.
+"""
+import os
+import re
+import sys
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template.base import Node
+from django.test import Client
+
+# "IN (%s, %s, %s)" and "IN (%s)" are the same query shape.
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+THIS_FILE = os.path.abspath(__file__)
+PROJECT_DIR = str(settings.BASE_DIR)
+
+
+def query_shape(sql):
+    """Return the SQL with variable-length parameter lists collapsed."""
+    return IN_LIST_RE.sub('IN (...)', sql)
+
+
+def find_call_site():
+    """Describe where the current query comes from: template line and/or project code line."""
+    template_site = None
+    code_site = None
+    frame = sys._getframe(1)
+    while frame is not None and (template_site is None or code_site is None):
+        filename = os.path.abspath(frame.f_code.co_filename)
+        node = frame.f_locals.get('self')
+        # type() rather than isinstance(): the latter would evaluate lazy objects such as request.user.
+        if template_site is None and issubclass(type(node), Node) and getattr(node, 'token', None) is not None:
+            origin = node.origin
+            template_site = f'{origin.template_name or origin.name}:{node.token.lineno}'
+        elif (code_site is None and filename.startswith(PROJECT_DIR) and filename != THIS_FILE
+              and 'site-packages' not in filename):
+            code_site = f'{os.path.relpath(filename, PROJECT_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    if template_site and code_site:
+        return f'{template_site} ({code_site})'
+    return template_site or code_site or '<unknown>'
+
+
+class QueryRecorder:
+    """Execute wrapper recording the shape and call site of every query, on all connections."""
+
+    def __init__(self):
+        self.queries = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((query_shape(sql), find_call_site()))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold):
+        """Return {shape: [call sites]} for every shape run more than `threshold` times."""
+        sites = defaultdict(list)
+        for shape, site in self.queries:
+            sites[shape].append(site)
+        return {shape: found for shape, found in sites.items() if len(found) > threshold}
+
+    def report(self, threshold):
+        lines = []
+        for shape, found in self.repeated(threshold).items():
+            lines.append(f'{len(found)} x {shape}')
+            for site in sorted(set(found)):
+                lines.append(f'    from {site}')
+        return '\n'.join(lines)
+
+
+class QueryCountingClient(Client):
+    """Test client attaching a `QueryRecorder` to every response as `response.queries`."""
+
+    def request(self, **request):
+        recorder = QueryRecorder()
+        with recorder:
+            response = super().request(**request)
+        response.queries = recorder
+        return response
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin checking responses for N+1 patterns and per-URL query budgets.
+
+    `query_budgets` maps URL names (from catalog/urls.py) to the maximum number of
+    queries one request to that URL may run.
+    """
+    client_class = QueryCountingClient
+    repeated_query_threshold = 3
+    query_budgets = {}
+
+    def assertQueryBudget(self, response, budget=None):
+        url_name = response.resolver_match.url_name if response.resolver_match else None
+        if budget is None:
+            budget = self.query_budgets.get(url_name)
+        queries = response.queries
+        repeated = queries.report(self.repeated_query_threshold)
+        if repeated:
+            self.fail(f'N+1 queries on {url_name}:\n{repeated}')
+        if budget is not None and len(queries) > budget:
+            self.fail(f'{url_name} ran {len(queries)} queries, budget is {budget}:\n'
+                      + '\n'.join(f'{shape}\n    from {site}' for shape, site in queries.queries))
@@ -0,0 +1,27 @@
+import tempfile
+from pathlib import Path
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class CatalogTestRunner(DiscoverRunner):
+    """Runs the tests with the snapshot and pre-rendered pages directories in a temporary directory.
+
+    Both are enabled by their directory existing: the changes made by the tests would otherwise mark the
+    development snapshot stale and render pages into the development directory. Tests of these features
+    point the settings at a directory of their own.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.directory = tempfile.TemporaryDirectory()
+        root = Path(self.directory.name)
+        # Not created: disabled, as on a fresh checkout
+        self.directories = override_settings(SNAPSHOT_DIR=root / 'snapshot', PRERENDER_ROOT=root / 'prerendered')
+        self.directories.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.directories.disable()
+        self.directory.cleanup()
+        super().teardown_test_environment(**kwargs)
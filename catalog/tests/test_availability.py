@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from catalog.availability import STREAM_PATH, Broker, broker, stream_app
+from catalog.models import Book, BookInstance
+
+
+def state(copy_id, status, book=1):
+    return {'id': copy_id, 'book': book, 'status': status, 'status_display': '', 'due_back': None}
+
+
+class BrokerTest(SimpleTestCase):
+    def test_publishes_changes_once_to_the_book_streams(self):
+        async def scenario():
+            broker = Broker()
+            queue = broker.subscribe(1, [state('a1', 'a')])
+            other_book = broker.subscribe(2, [])
+            broker.publish(state('a1', 'a'))
+            broker.publish(state('a1', 'o'))
+            broker.publish(state('a1', 'o'))
+            broker.poller.cancel()
+            return queue.qsize(), other_book.qsize(), await queue.get()
+
+        self.assertEqual(asyncio.run(scenario()), (1, 0, state('a1', 'o')))
+
+    def test_unsubscribe_forgets_the_book(self):
+        async def scenario():
+            broker = Broker()
+            queue = broker.subscribe(1, [state('a1', 'a')])
+            broker.unsubscribe(1, queue)
+            broker.poller.cancel()
+            return broker.queues, broker.states
+
+        self.assertEqual(asyncio.run(scenario()), ({}, {}))
+
+
+class StreamAppTest(SimpleTestCase):
+    def test_snapshot_then_changes(self):
+        sent = []
+
+        async def scenario():
+            gone = asyncio.Event()
+
+            async def receive():
+                await gone.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if len(sent) == 2:
+                    broker.publish(state('a1', 'o'))
+                elif len(sent) == 3:
+                    gone.set()
+
+            scope = {'type': 'http', 'method': 'GET', 'path': reverse('book-availability', args=[1])}
+            with mock.patch.object(Broker, 'read', return_value=[state('a1', 'a')]):
+                await asyncio.wait_for(stream_app(scope, receive, send), 5)
+            broker.poller.cancel()
+
+        asyncio.run(scenario())
+        self.assertEqual(dict(sent[0]['headers'])[b'content-type'], b'text/event-stream')
+        self.assertIn(b'event: snapshot', sent[1]['body'])
+        self.assertEqual(json.loads(sent[2]['body'].decode().split('data: ')[1]), state('a1', 'o'))
+        self.assertEqual(broker.queues, {})
+
+    def test_stream_path_is_the_availability_url(self):
+        self.assertEqual(STREAM_PATH.match(reverse('book-availability', args=[42]))['pk'], '42')
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BookAvailabilityViewTest(TestCase):
+    def test_stream_opened_only_when_served(self):
+        book = Book.objects.create(title='Germinal', summary='Mine', isbn='1')
+        response = self.client.get(reverse('book-detail', args=[book.pk]), secure=True)
+        self.assertNotContains(response, 'EventSource')
+        with self.settings(AVAILABILITY_STREAM=True):
+            response = self.client.get(reverse('book-detail', args=[book.pk]), secure=True)
+        self.assertContains(response, 'new EventSource')
+
+    def test_wsgi_fallback_sends_snapshot(self):
+        book = Book.objects.create(title='Germinal', summary='Mine', isbn='1')
+        copy = BookInstance.objects.create(book=book, imprint='Imprint', status='o',
+                                           due_back=datetime.date(2026, 1, 2))
+        response = self.client.get(reverse('book-availability', args=[book.pk]), secure=True)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = response.content.decode()
+        self.assertTrue(body.startswith('retry: '))
+        self.assertEqual(json.loads(body.split('data: ')[1]), [
+            {'id': str(copy.pk), 'book': book.pk, 'status': 'o', 'status_display': 'On loan',
+             'due_back': '2026-01-02'}])
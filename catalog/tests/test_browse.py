@@ -0,0 +1,83 @@
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from catalog.browse import letter_counts
+from catalog.caching import shared_cache
+from catalog.models import Author, Book
+
+
+class BrowseKeyTest(TestCase):
+    def test_keys_are_folded(self):
+        author = Author.objects.create(first_name='Émile', last_name='Zola')
+        book = Book.objects.create(title="L'Éducation sentimentale", summary='-', isbn='1', author=author)
+        self.assertEqual(author.name_key, 'zola emile')
+        self.assertEqual(book.title_key, 'l education sentimentale')
+
+    def test_update_fields(self):
+        book = Book.objects.create(title='Germinal', summary='-', isbn='1')
+        book.title = 'Nana'
+        book.save(update_fields=['title'])
+        book.refresh_from_db()
+        self.assertEqual(book.title_key, 'nana')
+
+    def test_bulk_create(self):
+        Book.objects.bulk_create([Book(title='Été', summary='-', isbn='1'), Book(title='été', summary='-', isbn='2')])
+        self.assertEqual(set(Book.objects.values_list('title_key', flat=True)), {'ete'})
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class LetterIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for first_name, last_name in [('Émile', 'Zola'), ('Victor', 'Hugo'), ('Honoré', 'de Balzac'),
+                                      ('Jean', 'Échenoz'), ('Anton', 'Тchekhov'), ('Georges', 'éluard')]:
+            Author.objects.create(first_name=first_name, last_name=last_name)
+        for title in ['Germinal', 'Émaux et camées', 'elle', 'Eugénie Grandet', '1984', 'Zadig']:
+            Book.objects.create(title=title, summary='-', isbn=title)
+
+    def setUp(self):
+        shared_cache.clear()
+
+    def test_counts(self):
+        counts = letter_counts('book')
+        self.assertEqual(counts['E'], 3)
+        self.assertEqual(counts['G'], 1)
+        self.assertEqual(counts['#'], 1)
+        self.assertEqual(counts['A'], 0)
+        # The Cyrillic Т of Тchekhov
+        self.assertEqual(letter_counts('author')['#'], 1)
+
+    def test_counts_cached_until_change(self):
+        letter_counts('book')
+        with self.assertNumQueries(0):
+            letter_counts('book')
+        Book.objects.create(title='Emma', summary='-', isbn='x')
+        self.assertEqual(letter_counts('book')['E'], 4)
+
+    def test_names_without_letter(self):
+        # Folded to an empty key
+        Book.objects.create(title='???', summary='-', isbn='x')
+        self.assertEqual(letter_counts('book')['#'], 2)
+
+    def test_books_under_letter(self):
+        response = self.client.get(reverse('books'), {'letter': 'E'}, secure=True)
+        self.assertEqual([book.title for book in response.context['book_list']],
+                         ['elle', 'Émaux et camées', 'Eugénie Grandet'])
+        self.assertContains(response, '<strong>E</strong>', html=True)
+
+    def test_books_under_hash(self):
+        response = self.client.get(reverse('books'), {'letter': '#'}, secure=True)
+        self.assertEqual([book.title for book in response.context['book_list']], ['1984'])
+
+    def test_letter_kept_by_search(self):
+        response = self.client.get(reverse('books'), {'letter': 'E', 'title': 'gr'}, secure=True)
+        self.assertEqual([book.title for book in response.context['book_list']], ['Eugénie Grandet'])
+        self.assertContains(response, '?letter=G&amp;title=gr')
+
+    def test_authors_under_letter(self):
+        response = self.client.get(reverse('authors'), {'letter': 'e'}, secure=True)
+        self.assertEqual([author.last_name for author in response.context['author_list']], ['Échenoz', 'éluard'])
+
+    def test_unknown_letter(self):
+        response = self.client.get(reverse('authors'), {'letter': 'ab'}, secure=True)
+        self.assertEqual(len(response.context['author_list']), 6)
@@ -0,0 +1,50 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from catalog.circulation import loan_events, month_of, record_loan_events
+from catalog.models import (Author, Book, BookInstance, BookLoanStats, Genre, GenreLoanStats, LoanEvent,
+                            LoanEventArchive, MonthlyLoanStats)
+
+
+class LoanEventsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = Author.objects.create(first_name='Emile', last_name='Zola')
+        cls.book = Book.objects.create(title='Germinal', summary='Mine', isbn='1', author=author)
+        cls.genre = Genre.objects.create(name='Novel')
+        cls.book.genre.set([cls.genre])
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Folio', status='a')
+
+    def test_event_kinds(self):
+        self.copy.status = 'o'
+        self.assertEqual(loan_events(self.copy, 'a', None)[0].kind, LoanEvent.CHECKOUT)
+        self.copy.due_back = datetime.date.today()
+        self.assertEqual(loan_events(self.copy, 'o', None)[0].kind, LoanEvent.RENEW)
+        self.copy.status = 'a'
+        self.assertEqual(loan_events(self.copy, 'o', None)[0].kind, LoanEvent.RETURN)
+        self.assertEqual(loan_events(self.copy, 'm', None), [])
+
+    def test_rollups_are_incremented(self):
+        self.copy.status = 'o'
+        record_loan_events(loan_events(self.copy, 'a', None) * 2)
+        self.copy.status = 'a'
+        record_loan_events(loan_events(self.copy, 'o', None))
+        month = month_of(timezone.now())
+        self.assertEqual(LoanEvent.objects.count(), 3)
+        book_stats = BookLoanStats.objects.get(book=self.book, month=month)
+        self.assertEqual((book_stats.checkouts, book_stats.returns), (2, 1))
+        self.assertEqual(GenreLoanStats.objects.get(genre=self.genre, month=month).checkouts, 2)
+        self.assertEqual(MonthlyLoanStats.objects.get(month=month).returns, 1)
+
+    def test_archive_old_events(self):
+        self.copy.status = 'o'
+        record_loan_events(loan_events(self.copy, 'a', None) * 3)
+        LoanEvent.objects.filter(pk__in=LoanEvent.objects.values('pk')[:2]).update(
+            created_at=timezone.now() - datetime.timedelta(days=400))
+        call_command('archive_loan_events', chunk_size=1, stdout=StringIO())
+        self.assertEqual(LoanEvent.objects.count(), 1)
+        self.assertEqual(LoanEventArchive.objects.count(), 2)
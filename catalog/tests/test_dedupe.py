@@ -0,0 +1,98 @@
+import datetime
+
+from django.contrib.auth.models import Permission, User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from catalog.dedupe import find_duplicates, isbn13, merge_authors, merge_books, similar_pairs
+from catalog.models import Author, Book, BookInstance, BookLoanStats, DuplicateCandidate, Genre
+
+
+class MatchKeyTest(SimpleTestCase):
+    def test_isbn10_and_isbn13_match(self):
+        self.assertEqual(isbn13('2-07-036024-X'), '9782070360246')
+        self.assertEqual(isbn13('978-2-07-036024-6'), '9782070360246')
+
+    def test_similar_pairs(self):
+        texts = {1: 'alexandre dumas', 2: 'alexandre dumas pere', 3: 'george sand'}
+        self.assertEqual([pair[:2] for pair in similar_pairs(texts)], [(1, 2)])
+
+
+class FindDuplicatesTest(TestCase):
+    def test_authors_and_books(self):
+        emile = Author.objects.create(first_name='Émile', last_name='Zola')
+        other = Author.objects.create(first_name='emile', last_name='ZOLA')
+        Author.objects.create(first_name='George', last_name='Sand')
+        first = Book.objects.create(title='Germinal', summary='Mine', isbn='2-07-036024-X', author=emile)
+        second = Book.objects.create(title='Germinal (poche)', summary='Mine', isbn='9782070360246', author=other)
+        self.assertEqual(find_duplicates(), 2)
+        self.assertEqual(
+            list(DuplicateCandidate.objects.values_list('kind', 'first_id', 'second_id', 'reason')),
+            [('a', emile.pk, other.pk, 'same name'), ('b', first.pk, second.pk, 'same ISBN')])
+
+    def test_dismissed_pairs_stay_dismissed(self):
+        first = Author.objects.create(first_name='Émile', last_name='Zola')
+        Author.objects.create(first_name='Emile', last_name='Zola')
+        find_duplicates()
+        DuplicateCandidate.objects.update(dismissed=True)
+        self.assertEqual(find_duplicates(), 0)
+        self.assertEqual(DuplicateCandidate.objects.get().first_id, first.pk)
+
+
+class MergeTest(TestCase):
+    def setUp(self):
+        self.keep = Author.objects.create(first_name='Émile', last_name='Zola')
+        self.duplicate = Author.objects.create(first_name='Emile', last_name='Zola')
+        self.book = Book.objects.create(title='Germinal', summary='Mine', isbn='1', author=self.keep)
+        self.other = Book.objects.create(title='Germinal', summary='Mine', isbn='2', author=self.duplicate)
+
+    def test_merge_authors(self):
+        merge_authors(self.keep, [self.duplicate])
+        self.assertFalse(Author.objects.filter(pk=self.duplicate.pk).exists())
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.author, self.keep)
+
+    def test_merge_books(self):
+        genre = Genre.objects.create(name='Roman')
+        self.other.genre.add(genre)
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=self.other, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=self.other, imprint='Imprint', status='o')
+        month = datetime.date(2022, 10, 1)
+        BookLoanStats.objects.create(book=self.book, month=month, checkouts=2)
+        BookLoanStats.objects.create(book=self.other, month=month, checkouts=3)
+        merge_books(self.book, [self.other])
+        self.assertFalse(Book.objects.filter(pk=self.other.pk).exists())
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_total, self.book.copies_available), (3, 2))
+        self.assertEqual(list(self.book.genre.all()), [genre])
+        self.assertEqual(BookLoanStats.objects.get(book=self.book).checkouts, 5)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class DuplicateViewsTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        user.user_permissions.add(Permission.objects.get(codename='can_change_author'))
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        self.keep = Author.objects.create(first_name='Émile', last_name='Zola')
+        self.duplicate = Author.objects.create(first_name='Emile', last_name='Zola')
+        find_duplicates()
+        self.candidate = DuplicateCandidate.objects.get()
+
+    def test_list(self):
+        response = self.client.get(reverse('duplicates'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['object_list'][0].pair, (self.keep, self.duplicate))
+
+    def test_merge_into_first(self):
+        response = self.client.post(reverse('duplicate-resolve', args=[self.candidate.pk]),
+                                    {'action': 'keep-first'}, secure=True)
+        self.assertRedirects(response, reverse('duplicates'), fetch_redirect_response=False)
+        self.assertEqual(list(Author.objects.all()), [self.keep])
+        self.assertFalse(DuplicateCandidate.objects.exists())
+
+    def test_dismiss(self):
+        self.client.post(reverse('duplicate-resolve', args=[self.candidate.pk]), {'action': 'dismiss'}, secure=True)
+        self.assertTrue(DuplicateCandidate.objects.get().dismissed)
+        self.assertEqual(Author.objects.count(), 2)
@@ -0,0 +1,126 @@
+import datetime
+import uuid
+
+from django.contrib.auth.models import Permission, User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from catalog.caching import shared_cache
+from catalog.dedupe import merge_authors, merge_books
+from catalog.desk import isbn10, parse_scan, scan
+from catalog.labels import barcode_value
+from catalog.models import Author, Book, BookInstance, LoanEvent
+
+
+class ParseScanTest(SimpleTestCase):
+    def test_copy_ids(self):
+        copy_id = uuid.uuid4()
+        self.assertEqual(parse_scan(f'{barcode_value(copy_id)}\n'), ('copy', copy_id))
+        self.assertEqual(parse_scan(str(copy_id)), ('copy', copy_id))
+
+    def test_isbns(self):
+        self.assertEqual(parse_scan('0-306-40615-2'), ('isbn', '9780306406157'))
+        self.assertEqual(parse_scan('978-0-306-40615-7'), ('isbn', '9780306406157'))
+        self.assertEqual(isbn10('9780306406157'), '0306406152')
+        self.assertEqual(isbn10('9780804429573'), '080442957X')
+        self.assertIsNone(isbn10('9791032305690'))
+
+    def test_garbage(self):
+        self.assertIsNone(parse_scan('hello'))
+        self.assertIsNone(parse_scan('12345'))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class DeskTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = cls.create_user('librarian', '1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.patron = cls.create_user('patron', '2HJ1vRV0Z&3iD')
+        author = Author.objects.create(first_name='Victor', last_name='Hugo')
+        cls.book = Book.objects.create(title='Les Misérables', summary='-', isbn='0306406152', author=author)
+        cls.copy = BookInstance.objects.create(book=cls.book, imprint='Lacroix, 1862', status='a')
+        cls.on_loan = BookInstance.objects.create(book=cls.book, imprint='Lacroix, 1862', status='o',
+                                                  borrower=cls.patron, due_back=datetime.date.today())
+
+    @staticmethod
+    def create_user(username, password):
+        user = User.objects.create_user(username=username, password=password, email=f'{username}@example.com')
+        # Profiles are created with an empty email, which is unique
+        user.profile.email = user.email
+        user.profile.save()
+        return user
+
+    def setUp(self):
+        shared_cache.clear()
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+
+    def test_copy_one_query_then_cached(self):
+        with self.assertNumQueries(1):
+            state = scan(barcode_value(self.on_loan.pk))
+        self.assertEqual(state['status'], 'o')
+        self.assertEqual(state['borrower'], 'patron')
+        self.assertEqual(state['book']['title'], 'Les Misérables')
+        with self.assertNumQueries(0):
+            scan(str(self.on_loan.pk))
+
+    def test_book_by_either_isbn(self):
+        with self.assertNumQueries(1):
+            state = scan('978-0-306-40615-7')
+        self.assertEqual(state['kind'], 'book')
+        self.assertEqual({copy['id'] for copy in state['copies']}, {str(self.copy.pk), str(self.on_loan.pk)})
+        with self.assertNumQueries(0):
+            scan('9780306406157')
+
+    def test_merges_drop_entries(self):
+        scan(str(self.copy.pk))
+        scan('9780306406157')
+        author = Author.objects.create(first_name='Victor-Marie', last_name='Hugo')
+        kept = Book.objects.create(title='Les Misérables (1862)', summary='-', isbn='9782070409228', author=author)
+        merge_books(kept, [self.book])
+        self.assertEqual(scan(str(self.copy.pk))['book']['title'], 'Les Misérables (1862)')
+        self.assertIsNone(scan('9780306406157'))
+        merge_authors(Author.objects.create(first_name='Victor', last_name='Hugo (1802-1885)'), [author])
+        self.assertEqual(scan(str(self.copy.pk))['book']['author'], 'Hugo (1802-1885), Victor')
+
+    def test_scan_view(self):
+        response = self.client.get(reverse('desk-scan'), {'q': str(self.copy.pk)}, secure=True)
+        self.assertEqual(response.json()['status'], 'a')
+        response = self.client.get(reverse('desk-scan'), {'q': '9791032305690'}, secure=True)
+        self.assertEqual(response.status_code, 404)
+
+    def test_checkout_return_renew(self):
+        url = reverse('desk-action', args=[self.copy.pk])
+        scan(str(self.copy.pk))
+        response = self.client.post(url, {'action': 'checkout', 'borrower': 'PATRON@example.com'}, secure=True)
+        self.assertEqual(response.json()['status'], 'o')
+        self.assertEqual(response.json()['borrower'], 'patron')
+        due_back = datetime.date.today() + datetime.timedelta(days=10)
+        response = self.client.post(url, {'action': 'renew', 'renewal_date': due_back}, secure=True)
+        self.assertEqual(response.json()['due_back'], due_back.isoformat())
+        response = self.client.post(url, {'action': 'return'}, secure=True)
+        self.assertEqual(response.json()['status'], 'a')
+        self.assertIsNone(response.json()['borrower'])
+        self.assertEqual(list(LoanEvent.objects.filter(book_instance_id=self.copy.pk).order_by('pk').values_list(
+            'kind', 'borrower_id')), [(LoanEvent.CHECKOUT, self.patron.pk), (LoanEvent.RENEW, self.patron.pk),
+                                      (LoanEvent.RETURN, self.patron.pk)])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.copies_available, 1)
+
+    def test_action_conflicts(self):
+        response = self.client.post(reverse('desk-action', args=[self.on_loan.pk]),
+                                    {'action': 'checkout', 'borrower': 'patron'}, secure=True)
+        self.assertEqual(response.status_code, 409)
+        response = self.client.post(reverse('desk-action', args=[self.copy.pk]),
+                                    {'action': 'checkout', 'borrower': 'nobody'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'a')
+
+    def test_staff_only(self):
+        self.client.login(username='patron', password='2HJ1vRV0Z&3iD')
+        response = self.client.get(reverse('desk-scan'), {'q': str(self.copy.pk)}, secure=True)
+        self.assertEqual(response.status_code, 403)
+
+    def test_page(self):
+        response = self.client.get(reverse('desk'), secure=True)
+        self.assertContains(response, 'id="id_q"')
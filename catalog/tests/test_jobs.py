@@ -0,0 +1,44 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+
+from catalog import jobs
+from catalog.models import CatalogJob
+
+
+class CatalogJobTest(TestCase):
+    def queued(self):
+        return sorted(CatalogJob.objects.values_list('kind', 'object_id'))
+
+    def test_queued_once(self):
+        jobs.queue(CatalogJob.BOOK_PAGE, [1, 2, None])
+        jobs.queue(CatalogJob.BOOK_PAGE, [2, 3])
+        jobs.queue(CatalogJob.AUTHOR_PAGE, [2])
+        self.assertEqual(self.queued(), [(CatalogJob.AUTHOR_PAGE, 2), (CatalogJob.BOOK_PAGE, 1),
+                                         (CatalogJob.BOOK_PAGE, 2), (CatalogJob.BOOK_PAGE, 3)])
+
+    def test_rolled_back_changes_queue_nothing(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            jobs.queue(CatalogJob.BOOK_PAGE, [1])
+            raise ValueError
+        self.assertEqual(self.queued(), [])
+
+    def test_run_by_kind(self):
+        handler = mock.Mock()
+        jobs.queue(CatalogJob.BOOK_PAGE, [1, 2])
+        with mock.patch.dict(jobs.HANDLERS, {CatalogJob.BOOK_PAGE: handler}):
+            call_command('run_catalog_jobs', stdout=StringIO())
+        self.assertEqual(sorted(handler.call_args.args[0]), [1, 2])
+        self.assertEqual(self.queued(), [])
+
+    def test_failed_jobs_queued_again(self):
+        jobs.queue(CatalogJob.BOOK_PAGE, [1])
+        jobs.queue(CatalogJob.AUTHOR_PAGE, [2])
+        with mock.patch.dict(jobs.HANDLERS, {CatalogJob.BOOK_PAGE: mock.Mock(side_effect=OSError),
+                                             CatalogJob.AUTHOR_PAGE: mock.Mock(side_effect=OSError)}):
+            with self.assertRaises(OSError):
+                jobs.run()
+        self.assertEqual(self.queued(), [(CatalogJob.AUTHOR_PAGE, 2), (CatalogJob.BOOK_PAGE, 1)])
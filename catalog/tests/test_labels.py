@@ -0,0 +1,103 @@
+import datetime
+import threading
+import uuid
+from unittest import mock
+
+from django.contrib.auth.models import Permission, User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from catalog.labels import (BARCODE_MODULES, CODE128, barcode_value, code128c, copy_id_from_barcode, pdf_sheet,
+                            svg_sheet)
+from catalog.models import Book, BookInstance
+from catalog.uuids import uuid7_floor
+
+
+def labels(count):
+    return [{'id': uuid.UUID(int=number), 'title': f'Les Misérables ({number})', 'author': 'Hugo, Victor',
+             'branch': 'centre'} for number in range(count)]
+
+
+class LabelSheetTest(SimpleTestCase):
+    def test_code128_table(self):
+        self.assertEqual(len(set(CODE128)), 106)
+        self.assertTrue(all(sum(map(int, widths)) == 11 for widths in CODE128))
+
+    def test_barcode_round_trip(self):
+        copy_id = uuid.uuid4()
+        value = barcode_value(copy_id)
+        self.assertEqual(len(value), 40)
+        self.assertEqual(copy_id_from_barcode(f' {value}\n'), copy_id)
+        self.assertIsNone(copy_id_from_barcode(str(copy_id)))
+        start, width = code128c(value)[-1]
+        self.assertEqual(start + width, BARCODE_MODULES)
+
+    def test_pdf_cross_references(self):
+        pdf = b''.join(pdf_sheet(labels(50), workers=2))
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split()[0])
+        entries = pdf[xref:].split(b'\n')[3:]
+        # 3 pages of a content stream and a page object each, after the catalog, page tree and font
+        self.assertIn(b'/Count 3', pdf)
+        for number in range(1, 10):
+            self.assertTrue(pdf[int(entries[number - 1][:10]):].startswith(b'%d 0 obj' % number))
+
+    def test_svg_pages_in_order(self):
+        html = b''.join(svg_sheet(labels(25), workers=2)).decode()
+        self.assertEqual(html.count('<svg '), 2)
+        self.assertLess(html.index('Les Misérables (0)'), html.index('Les Misérables (24)'))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage', LABEL_WORKERS=0)
+class PrintLabelsViewTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        user.user_permissions.add(Permission.objects.get(codename='can_change_author'))
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        self.book = Book.objects.create(title='Germinal', summary='Mine', isbn='1')
+        self.other = Book.objects.create(title='Nana', summary='Paris', isbn='2')
+        self.copy = BookInstance.objects.create(book=self.book, imprint='Imprint')
+        BookInstance.objects.create(book=self.other, imprint='Imprint')
+
+    def sheet(self, **params):
+        response = self.client.get(reverse('labels'), {'format': 'svg', **params}, secure=True)
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+        return b''.join(response.streaming_content).decode()
+
+    def test_form(self):
+        response = self.client.get(reverse('labels'), secure=True)
+        self.assertTemplateUsed(response, 'catalog/label_sheet.html')
+
+    def test_copies_of_a_book(self):
+        sheet = self.sheet(book=self.book.pk)
+        self.assertIn('Germinal', sheet)
+        self.assertNotIn('Nana', sheet)
+
+    def test_sheets_at_once(self):
+        with mock.patch('catalog.views.label_sheet_slots', threading.BoundedSemaphore(1)):
+            printing = self.client.get(reverse('labels'), {'format': 'svg', 'book': self.book.pk}, secure=True)
+            response = self.client.get(reverse('labels'), {'book': self.book.pk}, secure=True)
+            self.assertEqual(response.status_code, 503)
+            self.assertContains(response, 'try again', status_code=503)
+            # The slot is freed once the sheet is sent
+            b''.join(printing.streaming_content)
+            self.assertIn('Germinal', self.sheet(book=self.book.pk))
+
+    def test_listed_copies(self):
+        self.assertIn('Germinal', self.sheet(copies=barcode_value(self.copy.pk)))
+
+    def test_creation_dates(self):
+        today = timezone.localdate()
+        self.assertIn('Nana', self.sheet(created_from=today, created_to=today))
+        response = self.client.get(reverse('labels'), {'created_to': today - datetime.timedelta(days=1)}, secure=True)
+        self.assertContains(response, 'No copy matches this selection.')
+
+    def test_uuid7_floor(self):
+        now = timezone.now()
+        self.assertLess(uuid7_floor(now), BookInstance.objects.create(book=self.book, imprint='Imprint').pk)
+
+    def test_requires_permission(self):
+        self.client.logout()
+        response = self.client.get(reverse('labels'), {'book': self.book.pk}, secure=True)
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,108 @@
+import json
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from catalog.caching import shared_cache
+from catalog.metrics import GAUGES_KEY, MeteredLocMemCache, library_gauges, sample, store
+from catalog.models import Book, BookInstance
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(METRICS_DIR=directory.name, METRICS_TOKEN='secret')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        store.reset()
+        cache.clear()
+        shared_cache.clear()
+
+
+class StoreTest(MetricsTestCase):
+    def test_histogram(self):
+        store.observe('latency', 0.02, view='books')
+        store.observe('latency', 3, view='books')
+        totals = store.collect()
+        self.assertEqual(totals[sample('latency_bucket', view='books', le=0.01)], 0)
+        self.assertEqual(totals[sample('latency_bucket', view='books', le=0.025)], 1)
+        self.assertEqual(totals[sample('latency_bucket', view='books', le='+Inf')], 2)
+        self.assertEqual(totals[sample('latency_count', view='books')], 2)
+
+    def test_processes_add_up_and_dead_ones_are_archived(self):
+        store.inc('requests', 2)
+        # Beyond the largest pid of Linux: a process that is gone
+        (self.directory / '4194305.json').write_text(json.dumps({'requests': 5}))
+        self.assertEqual(store.collect()['requests'], 7)
+        self.assertFalse((self.directory / '4194305.json').exists())
+        self.assertEqual(json.loads((self.directory / 'archive.json').read_text()), {'requests': 5})
+        store.inc('requests')
+        self.assertEqual(store.collect()['requests'], 8)
+
+    def test_cache_hits_and_misses(self):
+        metered = MeteredLocMemCache('metrics-test', {})
+        metered.set('a', 1)
+        self.assertEqual(metered.get('a'), 1)
+        self.assertEqual(metered.get('b', 'default'), 'default')
+        self.assertEqual(metered.get_many(['a', 'b']), {'a': 1})
+        totals = store.collect()
+        self.assertEqual(totals[sample('catalog_cache_lookups_total', result='hit')], 2)
+        self.assertEqual(totals[sample('catalog_cache_lookups_total', result='miss')], 2)
+
+    def test_database_cache_lookups_counted_once(self):
+        # DatabaseCache.get() calls get_many()
+        database_cache = {'BACKEND': 'catalog.metrics.MeteredDatabaseCache', 'LOCATION': 'metrics_test_cache'}
+        with self.settings(CACHES={**settings.CACHES, 'metrics-test': database_cache}):
+            call_command('createcachetable', verbosity=0)
+            metered = caches['metrics-test']
+            metered.set('a', 1)
+            self.assertEqual(metered.get('a'), 1)
+            self.assertEqual(metered.get('b', 'default'), 'default')
+            self.assertEqual(metered.get_many(['a', 'b']), {'a': 1})
+        totals = store.collect()
+        self.assertEqual(totals[sample('catalog_cache_lookups_total', result='hit')], 2)
+        self.assertEqual(totals[sample('catalog_cache_lookups_total', result='miss')], 2)
+
+    def test_gauges_shared_and_not_counted(self):
+        library_gauges()
+        with self.assertNumQueries(0):
+            library_gauges()
+        totals = store.collect()
+        self.assertNotIn(sample('catalog_cache_lookups_total', result='hit'), totals)
+        self.assertNotIn(sample('catalog_cache_lookups_total', result='miss'), totals)
+        # Where the other workers find them
+        self.assertIsNotNone(shared_cache.get(GAUGES_KEY))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class MetricsViewTest(MetricsTestCase):
+    def scrape(self, **headers):
+        return self.client.get(reverse('metrics'), secure=True, **headers)
+
+    def test_requires_token(self):
+        self.assertEqual(self.scrape().status_code, 401)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+
+    def test_requests_and_gauges(self):
+        book = Book.objects.create(title='Germinal', summary='Mine', isbn='1')
+        BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+        BookInstance.objects.create(book=book, imprint='Imprint', status='o', due_back='2000-01-01')
+        self.client.get(reverse('books'), secure=True)
+        body = self.scrape(HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('# TYPE catalog_http_request_duration_seconds histogram', body)
+        self.assertIn('catalog_http_request_duration_seconds_count{view="books",method="GET"} 1\n', body)
+        self.assertIn('catalog_http_responses_total{view="books",status="2xx"} 1\n', body)
+        self.assertRegex(body, r'catalog_db_queries_total\{view="books"\} [1-9]')
+        for gauge in ('catalog_copies 2', 'catalog_copies_available 1', 'catalog_copies_on_loan 1',
+                      'catalog_copies_overdue 1', 'catalog_duplicates_to_review 0',
+                      'catalog_jobs_queued 0'):
+            self.assertIn(f'\n{gauge}\n', body)
@@ -1,6 +1,12 @@
+import time
+import uuid
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 
-from catalog.models import Author
+from catalog.models import Author, Book, BookInstance
+from catalog.uuids import uuid7
 
 
 class AuthorModelTest(TestCase):
@@ -33,3 +39,77 @@ class AuthorModelTest(TestCase):
         author = Author.objects.get(id=1)
         # This will also fail if the urlconf is not defined.
         self.assertEqual(author.get_absolute_url(), '/catalog/author/1')
+
+
+class BookInstanceIdTest(TestCase):
+    def test_ids_are_time_ordered_uuids(self):
+        ids = [BookInstance.objects.create(imprint='Folio').id for _ in range(50)]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual({book_id.version for book_id in ids}, {7})
+
+    def test_uuid7_layout(self):
+        before = int(time.time() * 1000)
+        value = uuid7()
+        self.assertEqual(value.variant, uuid.RFC_4122)
+        self.assertGreaterEqual(value.int >> 80, before)
+        self.assertEqual(uuid.UUID(str(value)), value)
+
+
+class BookCopyCountsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Germinal', summary='Mine', isbn='1')
+        cls.other = Book.objects.create(title='Nana', summary='Paris', isbn='2')
+
+    def counts(self, book=None):
+        book = Book.objects.get(pk=(book or self.book).pk)
+        return book.copies_total, book.copies_available
+
+    def test_save_and_delete(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        self.assertEqual(self.counts(), (1, 1))
+        copy = BookInstance.objects.get(pk=copy.pk)
+        copy.status = 'o'
+        copy.save()
+        self.assertEqual(self.counts(), (1, 0))
+        copy.book = self.other
+        copy.status = 'a'
+        copy.save()
+        self.assertEqual((self.counts(), self.counts(self.other)), ((0, 0), (1, 1)))
+        copy.delete()
+        self.assertEqual(self.counts(self.other), (0, 0))
+
+    def test_saves_of_stale_instances(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        # Loaded by two requests: the second saves what the first already did
+        first, second = BookInstance.objects.get(pk=copy.pk), BookInstance.objects.get(pk=copy.pk)
+        first.status = second.status = 'o'
+        first.save()
+        second.save()
+        self.assertEqual(self.counts(), (1, 0))
+        first.status = 'a'
+        first.save()
+        second.delete()
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_bulk_paths(self):
+        BookInstance.objects.bulk_create([BookInstance(book=self.book, imprint='Imprint', status='a')
+                                          for _ in range(3)])
+        self.assertEqual(self.counts(), (3, 3))
+        BookInstance.objects.filter(book=self.book)[:1].get().delete()
+        BookInstance.objects.filter(book=self.book).update(status='o')
+        self.assertEqual(self.counts(), (2, 0))
+        copies = list(BookInstance.objects.all())
+        copies[0].book = self.other
+        BookInstance.objects.bulk_update(copies, ['book'])
+        self.assertEqual((self.counts(), self.counts(self.other)), ((1, 0), (1, 0)))
+        BookInstance.objects.all().delete()
+        self.assertEqual((self.counts(), self.counts(self.other)), ((0, 0), (0, 0)))
+
+    def test_repair_command(self):
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        Book.objects.filter(pk=self.book.pk).update(copies_total=7, copies_available=0)
+        out = StringIO()
+        call_command('repair_copy_counts', chunk_size=1, stdout=out)
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertIn('2 books checked, 1 repaired', out.getvalue())
@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+
+from catalog.caching import shared_cache
+from catalog.permissions import VERSION_KEY, cache_key, catalog_permissions
+
+
+class CachedPermissionBackendTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.mark_returned = Permission.objects.get(codename='can_mark_returned')
+        cls.change_author = Permission.objects.get(codename='can_change_author')
+        cls.librarians = Group.objects.create(name='Librarians')
+
+    def setUp(self):
+        shared_cache.clear()
+
+    def fresh_user(self):
+        # A new instance, as on the next request
+        return User.objects.get(pk=self.user.pk)
+
+    def test_permissions_read_from_cache(self):
+        self.user.user_permissions.add(self.mark_returned)
+        self.assertTrue(self.fresh_user().has_perm('catalog.can_mark_returned'))
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('catalog.can_mark_returned'))
+            self.assertFalse(user.has_perm('catalog.can_change_author'))
+
+    def test_permissions_in_shared_cache(self):
+        # Not in the memory of this process: the other workers see the invalidations too
+        self.fresh_user().has_perm('catalog.can_mark_returned')
+        self.assertEqual(shared_cache.get(cache_key(self.user.pk)), (shared_cache.get(VERSION_KEY), set()))
+        self.assertIsNone(cache.get(cache_key(self.user.pk)))
+
+    def test_one_database_cache_lookup_per_request(self):
+        self.user.user_permissions.add(self.mark_returned)
+        # The database cache of production
+        database_cache = {'BACKEND': 'catalog.metrics.MeteredDatabaseCache', 'LOCATION': 'permissions_test_cache'}
+        with self.settings(CACHES={**settings.CACHES, 'shared': database_cache}):
+            call_command('createcachetable', verbosity=0)
+            self.fresh_user().has_perm('catalog.can_mark_returned')
+            request = RequestFactory().get('/')
+            request.user = self.fresh_user()
+            with self.assertNumQueries(1):
+                self.assertTrue(request.user.has_perm('catalog.can_mark_returned'))
+                self.assertFalse(request.user.has_perm('catalog.can_change_author'))
+                catalog_permissions(request)
+
+    def test_user_permission_change_invalidates(self):
+        self.assertFalse(self.fresh_user().has_perm('catalog.can_mark_returned'))
+        self.user.user_permissions.add(self.mark_returned)
+        self.assertTrue(self.fresh_user().has_perm('catalog.can_mark_returned'))
+
+    def test_group_changes_invalidate(self):
+        self.user.groups.add(self.librarians)
+        self.assertFalse(self.fresh_user().has_perm('catalog.can_change_author'))
+        self.librarians.permissions.add(self.change_author)
+        self.assertTrue(self.fresh_user().has_perm('catalog.can_change_author'))
+        self.librarians.user_set.remove(self.user)
+        self.assertFalse(self.fresh_user().has_perm('catalog.can_change_author'))
+
+    def test_inactive_user_has_no_permission(self):
+        self.user.user_permissions.add(self.mark_returned)
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.fresh_user().has_perm('catalog.can_mark_returned'))
+
+    def test_template_flags(self):
+        self.user.user_permissions.add(self.change_author)
+        request = RequestFactory().get('/')
+        request.user = self.fresh_user()
+        self.assertEqual(catalog_permissions(request), {'can_change_author': True, 'can_mark_returned': False})
@@ -0,0 +1,34 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from catalog.models import BookInstance, Profile
+
+
+class PurgeUnactivatedUsersTest(TestCase):
+    def create_user(self, username, days_ago, **fields):
+        user = User.objects.create_user(username=username, **fields)
+        user.profile.email = f'{username}@example.com'
+        user.profile.save()
+        User.objects.filter(pk=user.pk).update(date_joined=timezone.now() - datetime.timedelta(days=days_ago))
+        return user
+
+    def test_deletes_only_expired_signups(self):
+        expired = [self.create_user(f'bot{i}', days_ago=10, is_active=False) for i in range(3)]
+        recent = self.create_user('recent', days_ago=1, is_active=False)
+        active = self.create_user('reader', days_ago=10)
+        staff = self.create_user('former_librarian', days_ago=10, is_active=False, is_staff=True)
+        BookInstance.objects.create(imprint='Imprint', borrower=expired[0])
+
+        out = StringIO()
+        call_command('purge_unactivated_users', batch_size=2, pause=0, stdout=out)
+
+        self.assertEqual(set(User.objects.values_list('username', flat=True)),
+                         {recent.username, active.username, staff.username})
+        self.assertFalse(Profile.objects.filter(user__in=[user.pk for user in expired]).exists())
+        self.assertIsNone(BookInstance.objects.get().borrower)
+        self.assertIn('3 expired sign-ups deleted', out.getvalue())
@@ -0,0 +1,66 @@
+from django.test import TestCase
+
+from catalog import jobs
+from catalog.models import Author, Book, CatalogJob, Genre, Language, SimilarBook
+from catalog.recommendations import build_similar_books, update_similar_books
+
+
+class SimilarBooksTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        french = Language.objects.create(name='French')
+        zola = Author.objects.create(first_name='Emile', last_name='Zola')
+        verne = Author.objects.create(first_name='Jules', last_name='Verne')
+        novel = Genre.objects.create(name='Novel')
+        science_fiction = Genre.objects.create(name='Science Fiction')
+        cls.germinal = Book.objects.create(title='Germinal', summary='Miners strike in the north',
+                                           isbn='1', author=zola, language=french)
+        cls.assommoir = Book.objects.create(title="L'Assommoir", summary='Paris laundress and alcohol',
+                                            isbn='2', author=zola, language=french)
+        cls.nautilus = Book.objects.create(title='Vingt mille lieues', summary='Submarine voyage under the sea',
+                                           isbn='3', author=verne, language=french)
+        cls.centre = Book.objects.create(title='Voyage au centre de la Terre', summary='Volcano descent',
+                                         isbn='4', author=verne, language=french)
+        cls.germinal.genre.set([novel])
+        cls.assommoir.genre.set([novel])
+        cls.nautilus.genre.set([science_fiction])
+        cls.centre.genre.set([science_fiction])
+        CatalogJob.objects.all().delete()
+
+    def similar_books(self):
+        return list(SimilarBook.objects.order_by('book', 'rank').values_list('book', 'similar', 'rank'))
+
+    def test_most_similar_book_first(self):
+        build_similar_books(k=2)
+        similar = list(self.germinal.similar_books.values_list('similar', flat=True))
+        self.assertEqual(similar[0], self.assommoir.pk)
+        self.assertFalse(SimilarBook.objects.filter(book=self.germinal, similar=self.germinal).exists())
+
+    def test_genre_change_queues_the_book_once(self):
+        build_similar_books(k=1)
+        # Removes then adds
+        self.nautilus.genre.set(Genre.objects.filter(name='Novel'))
+        self.assertEqual(list(CatalogJob.objects.values_list('kind', 'object_id')),
+                         [(CatalogJob.SIMILAR_BOOKS, self.nautilus.pk)])
+        self.assertEqual(jobs.run(), 1)
+        self.assertEqual(self.nautilus.similar_books.first().similar.author.last_name, 'Zola')
+
+    def test_genre_side_changes_queue_its_books(self):
+        novel = Genre.objects.get(name='Novel')
+        novel.book_set.add(self.nautilus)
+        novel.book_set.remove(self.germinal)
+        self.assertEqual(set(CatalogJob.objects.values_list('object_id', flat=True)),
+                         {self.nautilus.pk, self.germinal.pk})
+        novel.book_set.clear()
+        self.assertEqual(set(CatalogJob.objects.values_list('object_id', flat=True)),
+                         {self.nautilus.pk, self.germinal.pk, self.assommoir.pk})
+
+    def test_update_matches_full_build(self):
+        build_similar_books(k=2)
+        # Germinal joins the lists of the Verne books, and may leave those of the Zola ones
+        self.germinal.genre.set(Genre.objects.filter(name='Science Fiction'))
+        update_similar_books([self.germinal.pk], k=2)
+        updated = self.similar_books()
+        self.assertIn((self.nautilus.pk, self.germinal.pk, 1), updated)
+        build_similar_books(k=2)
+        self.assertEqual(updated, self.similar_books())
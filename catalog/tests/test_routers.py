@@ -0,0 +1,72 @@
+from django.core.cache.backends.db import DatabaseCache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from catalog.models import Book, BookInstance, Genre, Profile
+from catalog.routers import (STICKY_COOKIE, PrimaryReplicaRouter, ReplicaStickinessMiddleware, _has_written,
+                             _use_primary)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class PrimaryReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.use_primary = _use_primary.set(False)
+        self.has_written = _has_written.set(False)
+
+    def tearDown(self):
+        _use_primary.reset(self.use_primary)
+        _has_written.reset(self.has_written)
+
+    def test_catalog_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Book), 'replica1')
+        self.assertEqual(self.router.db_for_read(Genre), 'replica1')
+
+    def test_copies_are_read_from_primary(self):
+        self.assertEqual(self.router.db_for_read(BookInstance), 'default')
+
+    def test_reads_stick_to_primary_after_write(self):
+        self.assertEqual(self.router.db_for_write(Book), 'default')
+        self.assertTrue(_has_written.get())
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+
+    def test_writes_read_from_primary_dont_pin(self):
+        # The profile is saved on every login
+        self.router.db_for_write(Profile)
+        self.router.db_for_write(BookInstance)
+        self.assertFalse(_has_written.get())
+        self.assertEqual(self.router.db_for_read(Book), 'replica1')
+
+    def test_database_cache_entries_on_primary(self):
+        entry = DatabaseCache('catalog_cache', {}).cache_model_class
+        self.assertEqual(self.router.db_for_read(entry), 'default')
+        self.assertEqual(self.router.db_for_write(entry), 'default')
+        self.assertFalse(_has_written.get())
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replica_configured(self):
+        self.assertEqual(self.router.db_for_read(Book), 'default')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaStickinessMiddlewareTest(SimpleTestCase):
+    def respond(self, request, write=False):
+        def view(request):
+            if write:
+                PrimaryReplicaRouter().db_for_write(Book)
+            return HttpResponse(PrimaryReplicaRouter().db_for_read(Book))
+        return ReplicaStickinessMiddleware(view)(request)
+
+    def test_write_pins_with_cookie(self):
+        response = self.respond(RequestFactory().post('/'), write=True)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertNotIn('Vary', response)
+        request = RequestFactory().get('/')
+        request.COOKIES[STICKY_COOKIE] = response.cookies[STICKY_COOKIE].value
+        self.assertEqual(self.respond(request).content, b'default')
+
+    def test_reads_leave_no_trace(self):
+        response = self.respond(RequestFactory().get('/'))
+        self.assertEqual(response.content, b'replica1')
+        self.assertFalse(response.cookies)
+        self.assertNotIn('Vary', response)
@@ -0,0 +1,82 @@
+import tempfile
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog import snapshot
+from catalog.models import Author, Book, Genre, Language
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class SnapshotTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.zola = Author.objects.create(first_name='Émile', last_name='Zola')
+        cls.hugo = Author.objects.create(first_name='Victor', last_name='Hugo')
+        cls.french = Language.objects.create(name='Français')
+        cls.novel = Genre.objects.create(name='Roman')
+        cls.naturalism = Genre.objects.create(name='Naturalisme', parent=cls.novel)
+        cls.book = Book.objects.create(title='Germinal', summary='Mine', isbn='1', author=cls.zola, language=cls.french)
+        cls.book.genre.add(cls.naturalism)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(SNAPSHOT_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        patcher = mock.patch.object(snapshot, 'CHECK_SECONDS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled_until_built(self):
+        self.assertIsNone(snapshot.get_snapshot())
+        snapshot.build()
+        self.assertIsNotNone(snapshot.get_snapshot())
+
+    def test_lookups(self):
+        snapshot.build()
+        current = snapshot.get_snapshot()
+        self.assertEqual(current['author'].name(self.zola.pk), 'Zola, Émile')
+        self.assertIsNone(current['author'].name(0))
+        self.assertEqual(current['author'].choices(), [(self.hugo.pk, 'Hugo, Victor'), (self.zola.pk, 'Zola, Émile')])
+        self.assertEqual(current['genre'].number(self.naturalism.pk), 1)
+        self.assertEqual(current['book'].name(self.book.pk), 'Germinal')
+
+    def test_change_rebuilds_once_committed(self):
+        snapshot.build()
+        first = snapshot.get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(first_name='George', last_name='Sand')
+        # Noticed by a request, which carries on with the current version
+        with mock.patch.object(snapshot, 'rebuild_if_leader') as rebuild:
+            self.assertIs(snapshot.get_snapshot(), first)
+            snapshot._rebuilding.join()
+        rebuild.assert_called_once()
+        # The thread's work, here in the test's transaction
+        snapshot.rebuild_if_leader(snapshot.file_prefix())
+        current = snapshot.get_snapshot()
+        self.assertGreater(current.version, first.version)
+        self.assertEqual(len(current['author']), 3)
+        # The replaced file is gone, its mapping still readable
+        self.assertFalse(first.path.exists())
+        self.assertEqual(first['author'].name(self.hugo.pk), 'Hugo, Victor')
+
+    def test_book_list_reads_options_from_snapshot(self):
+        url = reverse('books')
+        # Facets and genre counts cached
+        self.client.get(url, secure=True)
+        with CaptureQueriesContext(connection) as from_database:
+            self.client.get(url, secure=True)
+        snapshot.build()
+        with CaptureQueriesContext(connection) as from_snapshot:
+            response = self.client.get(url, secure=True)
+        # Authors, languages and genres
+        self.assertEqual(len(from_snapshot), len(from_database) - 3)
+        self.assertContains(response, f'<option value="{self.zola.pk}">Zola, Émile (1)</option>', html=True)
+        self.assertContains(response, 'Naturalisme')
+        response = self.client.get(url, {'author': self.zola.pk, 'genre': self.novel.pk}, secure=True)
+        self.assertEqual(list(response.context['book_list']), [self.book])
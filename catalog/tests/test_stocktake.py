@@ -0,0 +1,121 @@
+import uuid
+
+import numpy as np
+from django.contrib.auth.models import Permission, User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from catalog.desk import scan
+from catalog.labels import barcode_value
+from catalog.models import Book, BookInstance, Branch, LoanEvent, Stocktake, StocktakeDiscrepancy
+from catalog.stocktake import add_scans, fix, isin, reconcile, to_uuids, unique, uuid_array
+from catalog.uuids import uuid7
+
+
+class UuidArrayTest(SimpleTestCase):
+    def test_set_operations(self):
+        # uuid7 ids created together share their high half
+        ids = [uuid7() for _ in range(2000)]
+        scanned = ids[500:] + ids[1500:] + [uuid.uuid4() for _ in range(100)]
+        expected = unique(uuid_array(b''.join(copy_id.bytes for copy_id in ids)))
+        scanned_array = unique(uuid_array(b''.join(copy_id.bytes for copy_id in scanned)))
+        self.assertEqual(to_uuids(scanned_array), sorted(set(scanned)))
+        found = isin(expected, scanned_array)
+        self.assertEqual(set(to_uuids(expected[~found])), set(ids[:500]))
+        self.assertEqual(set(to_uuids(scanned_array[~isin(scanned_array, expected)])), set(scanned) - set(ids))
+
+    def test_empty(self):
+        empty = uuid_array(b'')
+        self.assertEqual(len(unique(empty)), 0)
+        self.assertEqual(isin(empty, uuid_array(uuid.uuid4().bytes)).tolist(), [])
+        self.assertEqual(isin(uuid_array(uuid.uuid4().bytes), empty).dtype, np.bool_)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class StocktakeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.centre = Branch.objects.create(name='Centre', code='centre')
+        cls.north = Branch.objects.create(name='North', code='north')
+        cls.book = Book.objects.create(title='Germinal', summary='-', isbn='1')
+
+        def copy(status, branch=cls.centre, **kwargs):
+            return BookInstance.objects.create(book=cls.book, imprint='Imprint', status=status, branch=branch,
+                                               **kwargs)
+
+        cls.on_shelf = copy('a')
+        cls.missing = copy('a')
+        cls.returned = copy('o', borrower=cls.librarian)
+        cls.repaired = copy('m')
+        cls.elsewhere = copy('a', branch=cls.north)
+        cls.unknown = uuid.uuid4()
+
+    def setUp(self):
+        self.stocktake = Stocktake.objects.create(branch=self.centre)
+        add_scans(self.stocktake, [self.on_shelf.pk, self.returned.pk])
+        add_scans(self.stocktake, [self.on_shelf.pk, self.elsewhere.pk, self.unknown])
+
+    def discrepancies(self, **kwargs):
+        return set(self.stocktake.discrepancies.filter(**kwargs).values_list('kind', 'copy_id', 'status'))
+
+    def test_reconcile(self):
+        counts = reconcile(self.stocktake)
+        self.assertEqual(counts, {'m': 1, 's': 1, 'u': 2})
+        self.assertEqual(self.discrepancies(), {
+            ('m', self.missing.pk, 'a'),
+            ('s', self.returned.pk, 'o'),
+            ('u', self.elsewhere.pk, 'a'),
+            ('u', self.unknown, ''),
+        })
+        self.stocktake.refresh_from_db()
+        self.assertEqual(self.stocktake.scans, 5)
+
+    def test_whole_library(self):
+        stocktake = Stocktake.objects.create()
+        add_scans(stocktake, [self.on_shelf.pk, self.elsewhere.pk])
+        self.assertEqual(reconcile(stocktake), {'m': 1})
+
+    def test_fixes(self):
+        reconcile(self.stocktake)
+        self.assertEqual(scan(str(self.returned.pk))['status'], 'o')
+        self.assertEqual(fix(self.stocktake, StocktakeDiscrepancy.MISSING), 1)
+        self.assertEqual(fix(self.stocktake, StocktakeDiscrepancy.WRONG_STATUS), 1)
+        self.assertEqual(fix(self.stocktake, StocktakeDiscrepancy.UNEXPECTED), 1)
+        statuses = dict(BookInstance.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[self.missing.pk], 'l')
+        self.assertEqual(statuses[self.returned.pk], 'a')
+        self.assertEqual(BookInstance.objects.get(pk=self.elsewhere.pk).branch, self.centre)
+        self.assertEqual(LoanEvent.objects.get(book_instance_id=self.returned.pk).kind, LoanEvent.RETURN)
+        # The desk sees the fixes
+        self.assertEqual(scan(str(self.returned.pk))['status'], 'a')
+        # The counters follow the bulk updates
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.copies_total, self.book.copies_available), (5, 3))
+        # The unknown id can't be fixed
+        self.assertEqual(self.discrepancies(fixed=False), {('u', self.unknown, '')})
+
+    def test_copies_changed_since_stay(self):
+        add_scans(self.stocktake, [self.repaired.pk])
+        reconcile(self.stocktake)
+        # Back from maintenance and checked out before the fix
+        BookInstance.objects.filter(pk=self.repaired.pk).update(status='o', borrower=self.librarian)
+        self.assertEqual(fix(self.stocktake, StocktakeDiscrepancy.WRONG_STATUS), 1)
+        self.assertEqual(BookInstance.objects.get(pk=self.repaired.pk).status, 'o')
+        self.assertFalse(LoanEvent.objects.filter(book_instance_id=self.repaired.pk).exists())
+        self.assertEqual(self.discrepancies(kind='s', fixed=False), {('s', self.repaired.pk, 'm')})
+
+    def test_views(self):
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        response = self.client.post(reverse('stocktake-scans', args=[self.stocktake.pk]),
+                                    {'codes': f'{barcode_value(self.missing.pk)}\nnot-a-copy'}, secure=True)
+        self.assertEqual(response.json(), {'scans': 6, 'invalid': ['not-a-copy']})
+        url = reverse('stocktake-detail', args=[self.stocktake.pk])
+        self.client.post(url, {'action': 'reconcile'}, secure=True)
+        response = self.client.get(url, secure=True)
+        self.assertContains(response, 'Missing (0)')
+        self.assertContains(response, 'Unknown copy')
+        self.client.post(url, {'action': 'close'}, secure=True)
+        response = self.client.post(reverse('stocktake-scans', args=[self.stocktake.pk]), {'codes': ''}, secure=True)
+        self.assertEqual(response.status_code, 404)
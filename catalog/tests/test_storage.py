@@ -0,0 +1,28 @@
+from django.test import SimpleTestCase
+
+from catalog.storage import purge_css
+
+
+class PurgeCssTest(SimpleTestCase):
+    css = ('@charset "UTF-8";/*! License */:root{--x:1}/* comment */body{margin:0}.btn,.table{color:red}'
+           '.alert-info{color:blue}#menu .nav-link{color:green}.btn:not(.active){color:gray}'
+           '@media (min-width:576px){.col-sm-2{width:16%}.col-sm-3{width:25%}}@keyframes spin{to{opacity:0}}')
+
+    def test_unused_selectors_are_removed(self):
+        purged = purge_css(self.css, {'table', 'col-sm-2', 'btn'})
+        self.assertIn('.table{color:red}', purged)
+        self.assertIn('.btn:not(.active){color:gray}', purged)
+        self.assertIn('@media (min-width:576px){.col-sm-2{width:16%}}', purged)
+        self.assertNotIn('.col-sm-3', purged)
+        self.assertNotIn('#menu', purged)
+        self.assertNotIn('comment', purged)
+
+    def test_element_rules_and_at_rules_are_kept(self):
+        purged = purge_css(self.css, set())
+        self.assertTrue(purged.startswith('@charset "UTF-8";\n/*! License */'))
+        self.assertIn(':root{--x:1}', purged)
+        self.assertIn('body{margin:0}', purged)
+        self.assertIn('@keyframes spin{to{opacity:0}}', purged)
+
+    def test_template_built_class_names_are_kept(self):
+        self.assertIn('.alert-info{color:blue}', purge_css(self.css, {'alert-'}))
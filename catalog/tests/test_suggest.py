@@ -0,0 +1,81 @@
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from catalog import suggest
+from catalog.caching import shared_cache
+from catalog.models import Author, Book
+from catalog.suggest import PrefixIndex, index_keys, normalize
+
+
+class PrefixIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.add('book', 1, 'Les Misérables')
+        self.index.add('book', 2, 'Le Rouge et le Noir')
+        self.index.add('author', 1, 'Victor Hugo')
+
+    def test_normalize(self):
+        self.assertEqual(normalize("  L'Éducation   sentimentale!"), 'l education sentimentale')
+
+    def test_keys_are_word_starts(self):
+        self.assertEqual(index_keys('Les Misérables'), {'les miserables', 'miserables'})
+
+    def test_lookup_any_word_start_without_accents(self):
+        self.assertEqual(self.index.lookup('MISE'), [('book', 1, 'Les Misérables')])
+        self.assertEqual(self.index.lookup('hug'), [('author', 1, 'Victor Hugo')])
+        self.assertEqual({pk for _kind, pk, _label in self.index.lookup('le')}, {1, 2})
+
+    def test_update_and_remove(self):
+        self.index.add('book', 1, 'Notre-Dame de Paris')
+        self.assertEqual(self.index.lookup('mis'), [])
+        self.assertEqual(self.index.lookup('paris'), [('book', 1, 'Notre-Dame de Paris')])
+        self.index.remove('book', 1)
+        self.assertEqual(self.index.lookup('notre'), [])
+        self.assertEqual(len(self.index.keys), len(self.index.refs))
+
+
+class SuggestViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Émile', last_name='Zola')
+        cls.book = Book.objects.create(title='Germinal', summary='Mine', isbn='1', author=cls.author)
+
+    def setUp(self):
+        shared_cache.clear()
+        patcher = mock.patch.multiple(suggest, _index=None, _version=None, _checked_at=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_suggestions(self):
+        response = self.client.get(reverse('suggest'), {'q': 'emi'}, secure=True)
+        self.assertEqual(response.json()['results'], [
+            {'kind': 'author', 'label': 'Émile Zola', 'url': reverse('author-detail', args=[self.author.pk])}])
+
+    def test_changes_reach_other_processes(self):
+        self.assertEqual(suggest.get_index().lookup('assommoir'), [])
+        # Changed by another process: only the log in the shared cache tells this one
+        with mock.patch.multiple(suggest, _index=None, _checked_at=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                book = Book.objects.create(title="L'Assommoir", summary='Paris', isbn='2')
+        self.assertEqual(suggest.get_index().lookup('assommoir'), [])
+        with mock.patch.object(suggest, '_checked_at', 0), self.assertNumQueries(1):
+            self.assertEqual(suggest.get_index().lookup('assommoir'), [('book', book.pk, "L'Assommoir")])
+
+    def test_shared_cache_checked_every_few_seconds(self):
+        suggest.get_index()
+        with mock.patch.object(shared_cache, 'get_or_set', wraps=shared_cache.get_or_set) as get_or_set:
+            for _ in range(3):
+                suggest.get_index()
+            get_or_set.assert_not_called()
+            with mock.patch('time.monotonic', return_value=time.monotonic() + suggest.CHECK_SECONDS):
+                suggest.get_index()
+            get_or_set.assert_called_once()
+
+    def test_own_changes_found_right_away(self):
+        suggest.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(title="L'Assommoir", summary='Paris', isbn='2')
+        self.assertEqual(suggest.get_index().lookup('assommoir'), [('book', book.pk, "L'Assommoir")])
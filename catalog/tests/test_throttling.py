@@ -0,0 +1,98 @@
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from catalog.caching import shared_cache
+from catalog.throttling import TokenBucket, parse_rate
+from catalog.tokens.tokens import account_activation_token
+
+
+class TokenBucketTest(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('5/m'), (5, 60))
+        self.assertEqual(parse_rate('10/hour'), (10, 3600))
+
+    def test_bucket_empties_then_refills(self):
+        bucket = TokenBucket('test', '2/m', cache)
+        self.assertTrue(bucket.consume(now=1000))
+        self.assertTrue(bucket.consume(now=1000))
+        self.assertFalse(bucket.consume(now=1000))
+        self.assertEqual(bucket.retry_after, 30)
+        # One token back after half a minute
+        self.assertTrue(bucket.consume(now=1030))
+        self.assertFalse(bucket.consume(now=1030))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage', THROTTLES={
+    'login': {'rates': {'ip': '3/m', 'username': '2/m'}},
+    'activate': {'rates': {'ip': '1/m'}, 'methods': ('GET',)},
+})
+class ThrottleMiddlewareTest(TestCase):
+    def setUp(self):
+        shared_cache.clear()
+
+    def login(self, username, address='10.0.0.1'):
+        return self.client.post(reverse('login'), {'username': username, 'password': 'wrong'},
+                                REMOTE_ADDR=address, secure=True)
+
+    def test_account_limit_across_addresses(self):
+        self.assertEqual(self.login('zola', '10.0.0.1').status_code, 200)
+        self.assertEqual(self.login('Zola', '10.0.0.2').status_code, 200)
+        response = self.login('zola', '10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_refused_before_password_check(self):
+        User.objects.create_user(username='zola', password='1X<ISRUkw+tuK')
+        self.login('zola')
+        self.login('zola')
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.verify') as verify:
+            self.assertEqual(self.login('zola').status_code, 429)
+        verify.assert_not_called()
+
+    def test_ip_limit_and_headers(self):
+        response = self.login('a')
+        self.assertEqual(response['X-RateLimit-Remaining'], '1')
+        self.login('b')
+        self.login('c')
+        self.assertEqual(self.login('d').status_code, 429)
+        self.assertEqual(self.login('d', '10.0.0.2').status_code, 200)
+
+    def test_workers_share_buckets(self):
+        # The database cache of production: each worker process has its own instance of the backend
+        database_cache = {'BACKEND': 'catalog.metrics.MeteredDatabaseCache', 'LOCATION': 'throttle_test_cache'}
+        with self.settings(CACHES={**settings.CACHES, 'shared': database_cache}):
+            call_command('createcachetable', verbosity=0)
+            for _worker in range(2):
+                del caches['shared']
+                self.assertEqual(self.login('zola').status_code, 200)
+            del caches['shared']
+            self.assertEqual(self.login('zola').status_code, 429)
+        with connection.cursor() as cursor:
+            # The address and account buckets, where any process finds them
+            cursor.execute('SELECT COUNT(*) FROM throttle_test_cache')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+    def test_other_methods_and_views_not_throttled(self):
+        for _ in range(5):
+            response = self.client.get(reverse('login'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-RateLimit-Limit', response)
+
+    def test_activation_link_throttled(self):
+        user = User.objects.create_user(username='zola', email='zola@example.com', is_active=False)
+        url = reverse('activate', args=[urlsafe_base64_encode(force_bytes(user.pk)),
+                                        account_activation_token.make_token(user)])
+        self.assertEqual(self.client.get(url, secure=True).status_code, 302)
+        self.assertEqual(self.client.get(url, secure=True).status_code, 429)
@@ -1,13 +1,21 @@
 import datetime
+import tempfile
 
 from django.contrib.auth.models import User
+from django.db import connection
 from django.utils import timezone
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 import uuid
 from django.contrib.auth.models import Permission # Required to grant the permission needed to set a book as returned.
 
-from catalog.models import Author, BookInstance, Genre, Language, Book
+from catalog import jobs, prerender
+from catalog.caching import shared_cache
+from catalog.facets import VERSION_KEY as FACETS_VERSION_KEY, compute_facets
+from catalog.genres import CACHE_KEY as GENRE_COUNTS_CACHE_KEY, genre_book_counts
+from catalog.models import Author, BookInstance, Branch, CatalogJob, Genre, Language, Book
+from catalog.tests.querycount import QueryBudgetMixin, QueryRecorder
 
 
 class AuthorListViewTest(TestCase):
@@ -289,3 +297,265 @@ class RenewBookInstancesViewTest(TestCase):
 
 
 
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    query_budgets = {
+        'books': 12,  # facets and A-Z counts with a cold cache: the books with their genres, the genre tree, the initials
+        'author-detail': 6,
+        'book-detail': 12,  # the staff member's branch, and the availability per branch
+        'all-borrowed': 9,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'),
+                                           Permission.objects.get(codename='can_change_author'))
+        cls.author = Author.objects.create(first_name='Emile', last_name='Zola')
+        language = Language.objects.create(name='French')
+        genres = [Genre.objects.create(name=f'Genre {i}') for i in range(3)]
+        for book_id in range(8):
+            book = Book.objects.create(
+                title=f'Book {book_id}',
+                summary='My book summary',
+                isbn=f'ISBN{book_id}',
+                author=cls.author,
+                language=language,
+            )
+            book.genre.set(genres)
+            for copy in range(3):
+                BookInstance.objects.create(
+                    book=book,
+                    imprint='Unlikely Imprint, 2016',
+                    due_back=datetime.date.today() + datetime.timedelta(days=copy),
+                    borrower=cls.librarian,
+                    status='o' if copy else 'a',
+                )
+        cls.book = book
+
+    def test_book_list(self):
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('books'), secure=True)
+        self.assertQueryBudget(response)
+
+    def test_author_detail(self):
+        response = self.client.get(reverse('author-detail', args=[self.author.pk]), secure=True)
+        self.assertQueryBudget(response)
+
+    def test_book_detail(self):
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('book-detail', args=[self.book.pk]), secure=True)
+        self.assertQueryBudget(response)
+
+    def test_books_on_loan(self):
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('all-borrowed'), secure=True)
+        self.assertQueryBudget(response)
+
+    def test_detector_reports_repeated_query_call_site(self):
+        with QueryRecorder() as queries:
+            for book in Book.objects.all():
+                str(book.author)
+        report = queries.report(self.repeated_query_threshold)
+        self.assertIn('catalog_author', report)
+        self.assertIn('test_views.py', report)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PrerenderedPagesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = Author.objects.create(first_name='Emile', last_name='Zola')
+        cls.book = Book.objects.create(title='Germinal', summary='Mine', isbn='9782070360420', author=cls.author)
+        BookInstance.objects.create(book=cls.book, imprint='Folio', status='a')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(PRERENDER_ROOT=directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_page_is_written_without_user_parts(self):
+        prerender.write_page('book-detail', self.book.pk)
+        content = prerender.page_path('book-detail', self.book.pk).read_text()
+        self.assertIn('Germinal', content)
+        self.assertIn('id="sidebar-user"', content)
+        self.assertIn('data-perm="catalog.can_change_author"', content)
+        self.assertNotIn('Logout', content)
+
+    def test_middleware_serves_prerendered_page(self):
+        prerender.write_page('author-detail', self.author.pk)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('author-detail', args=[self.author.pk]), secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Germinal', b''.join(response.streaming_content))
+
+    def test_pending_messages_skip_prerendered_page(self):
+        prerender.write_page('author-detail', self.author.pk)
+        librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        librarian.user_permissions.add(Permission.objects.get(codename='can_change_author'))
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        response = self.client.post(reverse('author-update', args=[self.author.pk]),
+                                    {'first_name': 'Emile', 'last_name': 'Zola'}, secure=True, follow=True)
+        self.assertContains(response, 'a été modifié')
+
+    def queued_pages(self):
+        return set(CatalogJob.objects.exclude(kind=CatalogJob.SIMILAR_BOOKS).values_list('kind', 'object_id'))
+
+    def test_page_rendered_again_on_change(self):
+        prerender.write_page('book-detail', self.book.pk)
+        self.book.title = 'Nana'
+        self.book.save()
+        # By the worker, not the request
+        self.assertNotIn('Nana', prerender.page_path('book-detail', self.book.pk).read_text())
+        self.assertEqual(self.queued_pages(), {(CatalogJob.BOOK_PAGE, self.book.pk),
+                                               (CatalogJob.AUTHOR_PAGE, self.author.pk)})
+        jobs.run()
+        self.assertIn('Nana', prerender.page_path('book-detail', self.book.pk).read_text())
+        self.assertIn('Nana', prerender.page_path('author-detail', self.author.pk).read_text())
+
+    def test_bulk_copy_changes_queue_pages(self):
+        BookInstance.objects.filter(book=self.book).update(status='m')
+        self.assertEqual(self.queued_pages(), {(CatalogJob.BOOK_PAGE, self.book.pk)})
+        CatalogJob.objects.all().delete()
+        BookInstance.objects.filter(book=self.book).update(branch=Branch.objects.create(name='North', code='north'))
+        self.assertEqual(self.queued_pages(), {(CatalogJob.BOOK_PAGE, self.book.pk)})
+        CatalogJob.objects.all().delete()
+        BookInstance.objects.bulk_create([BookInstance(book=self.book, imprint='Folio', status='a')])
+        self.assertEqual(self.queued_pages(), {(CatalogJob.BOOK_PAGE, self.book.pk)})
+
+    def test_deleted_book_page_removed(self):
+        prerender.write_page('book-detail', self.book.pk)
+        book_pk = self.book.pk
+        BookInstance.objects.filter(book=self.book).delete()
+        self.book.delete()
+        jobs.run()
+        self.assertFalse(prerender.page_path('book-detail', book_pk).exists())
+        self.assertNotIn('Germinal', prerender.page_path('author-detail', self.author.pk).read_text())
+
+    def test_user_fragment(self):
+        response = self.client.get(reverse('user-fragment') + '?next=/book/1', secure=True)
+        self.assertEqual(response.json()['perms'], [])
+        self.assertIn('?next=/book/1', response.json()['sidebar'])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BranchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.centre = Branch.objects.create(name='Centre', code='centre')
+        cls.north = Branch.objects.create(name='North', code='north')
+        cls.librarian = User.objects.create_user(username='librarian', password='1X<ISRUkw+tuK')
+        cls.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        cls.librarian.profile.branch = cls.centre
+        cls.librarian.profile.email = 'librarian@example.com'
+        cls.librarian.profile.save()
+        cls.book = Book.objects.create(title='Germinal', summary='Mine', isbn='1')
+        for branch, status in [(cls.centre, 'o'), (cls.centre, 'a'), (cls.north, 'o'), (cls.north, 'm')]:
+            BookInstance.objects.create(book=cls.book, imprint=branch.name, branch=branch, status=status,
+                                        borrower=cls.librarian, due_back=datetime.date.today())
+
+    def test_availability_per_branch(self):
+        with self.assertNumQueries(1):
+            availability = list(BookInstance.objects.filter(book=self.book).availability())
+        self.assertEqual([(row['branch__name'], row['available'], row['copies']) for row in availability],
+                         [('Centre', 1, 2), ('North', 0, 2)])
+
+    def test_books_on_loan_lists_own_branch(self):
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('all-borrowed'), secure=True)
+        self.assertEqual([copy.imprint for copy in response.context['bookinstance_list']], ['Centre'])
+
+    def test_book_detail_lists_own_branch_copies(self):
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('book-detail', args=[self.book.pk]), secure=True)
+        self.assertEqual({copy.branch for copy in response.context['copies']}, {self.centre})
+        self.assertContains(response, 'North:</strong> 0 of 2 available')
+
+    def test_reader_sees_every_branch(self):
+        response = self.client.get(reverse('book-detail', args=[self.book.pk]), secure=True)
+        self.assertEqual(len(response.context['copies']), 4)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class BookListGenreTreeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.science_fiction = Genre.objects.create(name='Science Fiction')
+        cls.space_opera = Genre.objects.create(name='Space Opera', parent=cls.science_fiction)
+        cls.cyberpunk = Genre.objects.create(name='Cyberpunk', parent=cls.science_fiction)
+        cls.fantasy = Genre.objects.create(name='Fantasy')
+        english = Language.objects.create(name='English')
+        dune = Book.objects.create(title='Dune', summary='Desert', isbn='1', language=english)
+        dune.genre.set([cls.space_opera, cls.cyberpunk])
+        neuromancer = Book.objects.create(title='Neuromancer', summary='Matrix', isbn='2', language=english)
+        neuromancer.genre.set([cls.cyberpunk])
+        hobbit = Book.objects.create(title='The Hobbit', summary='Dragon', isbn='3')
+        hobbit.genre.set([cls.fantasy])
+
+    def setUp(self):
+        shared_cache.delete(GENRE_COUNTS_CACHE_KEY)
+        shared_cache.delete(FACETS_VERSION_KEY)
+
+    def test_genre_filter_includes_sub_genres_once(self):
+        response = self.client.get(reverse('books'), {'genre': [self.science_fiction.pk]}, secure=True)
+        self.assertEqual([book.title for book in response.context['book_list']], ['Dune', 'Neuromancer'])
+
+    def test_sub_genre_filter(self):
+        response = self.client.get(reverse('books'), {'genre': [self.space_opera.pk]}, secure=True)
+        self.assertEqual([book.title for book in response.context['book_list']], ['Dune'])
+
+    def test_genre_counts_follow_book_genre_changes(self):
+        counts = genre_book_counts()
+        self.assertEqual((counts[self.science_fiction.pk], counts[self.cyberpunk.pk]), (2, 2))
+        Book.objects.get(title='The Hobbit').genre.add(self.space_opera)
+        self.assertEqual(genre_book_counts()[self.science_fiction.pk], 3)
+
+    def test_genres_rendered_as_tree(self):
+        response = self.client.get(reverse('books'), {'genre': [self.space_opera.pk]}, secure=True)
+        self.assertContains(response, '<details open>')
+        # Counts of the books matching the filter
+        self.assertRegex(response.content.decode(), r'Science Fiction</label>\s*\(1\)')
+
+    def test_facet_counts(self):
+        response = self.client.get(reverse('books'), {'genre': [self.science_fiction.pk]}, secure=True)
+        facets = response.context['form'].fields['genre'].widget.counts
+        self.assertEqual(facets, {self.science_fiction.pk: 2, self.space_opera.pk: 1, self.cyberpunk.pk: 2})
+        self.assertContains(response, 'English (2)')
+
+    def test_facet_counts_in_sql(self):
+        with CaptureQueriesContext(connection) as queries:
+            facets = compute_facets(Book.objects.filter(title__in=['Dune', 'The Hobbit']).select_related('author'))
+        self.assertEqual(len(queries), 2)  # authors and languages, genres
+        self.assertEqual(sum(facets['language'].values()), 2)
+        self.assertEqual(facets['author'], {None: 2})
+        # Dune is in two sub-genres of Science Fiction
+        self.assertEqual(facets['genre'][self.cyberpunk.pk], 1)
+        self.assertEqual(facets['genre'][self.fantasy.pk], 1)
+        self.assertEqual(facets['genre'][self.science_fiction.pk], 1)
+
+    def test_available_facets_follow_loans(self):
+        copy = BookInstance.objects.create(book=Book.objects.get(title='The Hobbit'), imprint='Imprint', status='a')
+        response = self.client.get(reverse('books'), {'available': 'on'}, secure=True)
+        self.assertEqual(response.context['form'].fields['genre'].widget.counts, {self.fantasy.pk: 1})
+        copy.status = 'o'
+        copy.save()
+        response = self.client.get(reverse('books'), {'available': 'on'}, secure=True)
+        self.assertEqual(response.context['form'].fields['genre'].widget.counts, {})
+
+    def test_available_filter_and_order(self):
+        dune, hobbit = Book.objects.get(title='Dune'), Book.objects.get(title='The Hobbit')
+        BookInstance.objects.bulk_create([BookInstance(book=hobbit, imprint='Imprint', status='a') for _ in range(2)]
+                                         + [BookInstance(book=dune, imprint='Imprint', status='a')])
+        response = self.client.get(reverse('books'), {'available': 'on', 'order': 'available'}, secure=True)
+        self.assertEqual([book.title for book in response.context['book_list']], ['The Hobbit', 'Dune'])
+
+    def test_filters_combine(self):
+        author = Author.objects.create(first_name='Frank', last_name='Herbert')
+        Book.objects.filter(title='Dune').update(author=author)
+        response = self.client.get(reverse('books'), {'genre': [self.cyberpunk.pk], 'author': author.pk}, secure=True)
+        self.assertEqual([book.title for book in response.context['book_list']], ['Dune'])
+
@@ -0,0 +1,40 @@
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import cache
+from django.template import engines
+from django.test import TestCase, override_settings
+
+from catalog.models import Book
+from locallibrary import gunicorn_conf
+from locallibrary.warmup import compile_templates, prime_caches, resolve_urls
+
+
+class WarmUpTest(TestCase):
+    def test_resolvers_of_included_urlconfs(self):
+        # Catalog, admin and accounts URL names
+        self.assertGreater(resolve_urls(), 50)
+
+    def test_templates_compiled(self):
+        self.assertGreater(compile_templates(), 20)
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertIn('catalog/book_list.html', {key.split('-')[0] for key in loader.get_template_cache})
+
+    def test_caches_and_snapshot(self):
+        Book.objects.create(title='Germinal', summary='Mine', isbn='1')
+        with tempfile.TemporaryDirectory() as directory, override_settings(SNAPSHOT_DIR=directory):
+            self.assertEqual(prime_caches(), 1)
+            self.assertTrue(any(Path(directory).glob('*.current')))
+
+    def test_gunicorn_profile(self):
+        self.assertTrue(gunicorn_conf.preload_app)
+        self.assertGreaterEqual(gunicorn_conf.workers, 1)
+        self.assertEqual(gunicorn_conf.max_requests_jitter, gunicorn_conf.max_requests // 10)
+
+    def test_workers_start_with_empty_cache(self):
+        cache.set('catalog:test', 1)
+        with mock.patch('django.db.connections.close_all') as close_all:
+            gunicorn_conf.post_fork(server=None, worker=None)
+        close_all.assert_called_once_with()
+        self.assertIsNone(cache.get('catalog:test'))
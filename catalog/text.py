@@ -0,0 +1,16 @@
+"""
+Folding of names for matching and sorting: accents and case folded, punctuation dropped.
+
+"L'Éducation sentimentale" and "l education sentimentale" fold to the same text, which
+is plain ASCII for Latin scripts: it sorts the same way under any database collation.
+"""
+import re
+import unicodedata
+
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return NON_WORD_RE.sub(' ', text.casefold()).strip()
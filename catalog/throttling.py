@@ -0,0 +1,124 @@
+"""
+Rate limiting of the account endpoints.
+
+settings.THROTTLES maps a URL name to its limits: {scope: rate}. The scope 'ip' is
+the client address; any other scope is a POST field or URL argument identifying the
+account (username, email, uidb64). A rate 'N/period' (period s, m, h or d) is a token
+bucket of N tokens refilled over the period. Buckets live in the cache named by
+settings.THROTTLE_CACHE, shared by the workers (see catalog/caching.py), one entry per
+bucket, so a check costs one cache read and one write whatever the traffic.
+
+ThrottleMiddleware checks the buckets in process_view, before the view validates the
+form or hashes a password, and answers 429 when one of them is empty.
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+DEFAULT_METHODS = ('POST',)
+
+
+def parse_rate(rate):
+    """'5/m' or '5/min' -> (5 tokens, 60 seconds)."""
+    number, period = rate.split('/')
+    return int(number), PERIODS[period[0].lower()]
+
+
+class TokenBucket:
+    def __init__(self, key, rate, cache):
+        self.key = key
+        self.capacity, self.period = parse_rate(rate)
+        self.cache = cache
+        self.remaining = self.capacity
+        self.retry_after = 0
+
+    def consume(self, now=None):
+        """Take one token. Return False, and set retry_after, if the bucket is empty."""
+        now = time.time() if now is None else now
+        tokens, updated = self.cache.get(self.key, (self.capacity, now))
+        # Refill for the time elapsed since the last request
+        tokens = min(self.capacity, tokens + (now - updated) * self.capacity / self.period)
+        if tokens < 1:
+            self.remaining = 0
+            self.retry_after = math.ceil((1 - tokens) * self.period / self.capacity)
+            return False
+        tokens -= 1
+        self.remaining = int(tokens)
+        # After a full period without requests the bucket is full again: the entry can go
+        self.cache.set(self.key, (tokens, now), self.period)
+        return True
+
+
+def client_ip(request):
+    """Address of the client, behind settings.THROTTLE_TRUSTED_PROXIES reverse proxies."""
+    proxies = getattr(settings, 'THROTTLE_TRUSTED_PROXIES', 0)
+    forwarded = [address.strip() for address in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if address]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def scope_value(request, scope, view_kwargs):
+    if scope == 'ip':
+        return client_ip(request)
+    value = view_kwargs.get(scope) or request.POST.get(scope)
+    return str(value).strip().lower() if value else None
+
+
+def buckets_for(request, url_name, view_kwargs):
+    config = getattr(settings, 'THROTTLES', {}).get(url_name)
+    if not config or request.method not in config.get('methods', DEFAULT_METHODS):
+        return []
+    cache = caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+    buckets = []
+    for scope, rate in config['rates'].items():
+        value = scope_value(request, scope, view_kwargs)
+        if value is None:
+            continue
+        digest = hashlib.sha256(value.encode('utf-8')).hexdigest()[:32]
+        buckets.append(TokenBucket(f'throttle:{url_name}:{scope}:{digest}', rate, cache))
+    return buckets
+
+
+def add_headers(response, buckets):
+    # The bucket closest to empty is the one that matters to the client
+    tightest = min(buckets, key=lambda bucket: bucket.remaining)
+    response['X-RateLimit-Limit'] = f'{tightest.capacity};w={tightest.period}'
+    response['X-RateLimit-Remaining'] = str(tightest.remaining)
+    return response
+
+
+class ThrottleMiddleware:
+    """Apply settings.THROTTLES to the views of the listed URL names."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        buckets = getattr(request, 'throttle_buckets', None)
+        if buckets:
+            add_headers(response, buckets)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        buckets = buckets_for(request, match.url_name if match else None, view_kwargs)
+        if not buckets:
+            return None
+        request.throttle_buckets = buckets
+        now = time.time()
+        # Every bucket is charged, so that one account can't be tried from many addresses for free
+        refused = [bucket for bucket in buckets if not bucket.consume(now)]
+        if refused:
+            response = HttpResponse('Too many requests, please try again later.', status=429,
+                                    content_type='text/plain; charset=utf-8')
+            response['Retry-After'] = str(max(bucket.retry_after for bucket in refused))
+            return response
+        return None
@@ -6,6 +6,8 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('books/', views.BookListView.as_view(), name='books'),
     path('book/<int:pk>', views.BookDetailView.as_view(), name='book-detail'),
+    # Served by catalog.availability.stream_app under ASGI
+    path('book/<int:pk>/availability/', views.book_availability, name='book-availability'),
     path('authors/', views.AuthorListView.as_view(), name='authors'),
     path('author/<int:pk>', views.AuthorDetailView.as_view(), name='author-detail'),
     path('mybooks/', views.LoanedBooksByUserListView.as_view(), name='my-borrowed'),
@@ -25,4 +27,17 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('sent/', views.activation_sent_view, name="activation_sent"),
     path('activate/<slug:uidb64>/<slug:token>/', views.activate, name='activate'),
+    path('fragments/user/', views.user_fragment, name='user-fragment'),
+    path('labels/', views.print_labels, name='labels'),
+    path('desk/', views.circulation_desk, name='desk'),
+    path('desk/scan/', views.desk_scan, name='desk-scan'),
+    path('desk/<uuid:pk>/', views.desk_action, name='desk-action'),
+    path('stocktakes/', views.StocktakeListView.as_view(), name='stocktakes'),
+    path('stocktake/create/', views.StocktakeCreate.as_view(), name='stocktake-create'),
+    path('stocktake/<int:pk>/', views.stocktake_detail, name='stocktake-detail'),
+    path('stocktake/<int:pk>/scans/', views.stocktake_scans, name='stocktake-scans'),
+    path('duplicates/', views.DuplicateListView.as_view(), name='duplicates'),
+    path('duplicates/<int:pk>/', views.resolve_duplicate, name='duplicate-resolve'),
+    path('metrics', views.metrics, name='metrics'),
+    path('suggest/', views.title_suggestions, name='suggest'),
 ]
\ No newline at end of file
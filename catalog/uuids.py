@@ -0,0 +1,46 @@
+"""
+Time-ordered UUIDs (version 7, RFC 9562) for primary keys.
+
+The first 48 bits are the Unix time in milliseconds, so new keys are appended at the
+end of the primary key index instead of landing on random pages of it. They are
+ordinary UUIDs: stored in the same UUIDField and matched by the same <uuid:pk> URLs as
+the existing uuid4 keys.
+"""
+import os
+import threading
+import time
+import uuid
+
+_lock = threading.Lock()
+_last_timestamp = 0
+_counter = 0
+
+
+def uuid7():
+    """Return a new version 7 UUID, greater than every one returned before by this process."""
+    global _last_timestamp, _counter
+    with _lock:
+        timestamp = time.time_ns() // 1_000_000
+        if timestamp <= _last_timestamp:
+            # Same millisecond (or clock went back): keep ordering with the 12 bit counter
+            timestamp = _last_timestamp
+            _counter += 1
+            if _counter > 0xFFF:
+                timestamp += 1
+                _counter = 0
+        else:
+            _counter = int.from_bytes(os.urandom(2), 'big') & 0x7FF
+        _last_timestamp = timestamp
+        counter = _counter
+    random_bits = int.from_bytes(os.urandom(8), 'big') & 0x3FFFFFFFFFFFFFFF
+    value = (timestamp & 0xFFFFFFFFFFFF) << 80 | 0x7 << 76 | counter << 64 | 0b10 << 62 | random_bits
+    return uuid.UUID(int=value)
+
+
+def uuid7_floor(moment):
+    """The smallest version 7 UUID of the millisecond of `moment` (an aware datetime).
+
+    Keys generated from `moment` on are greater: a range of creation dates is a range
+    of primary keys. uuid4 keys (created before) carry no date and fall anywhere.
+    """
+    return uuid.UUID(int=(int(moment.timestamp() * 1000) & 0xFFFFFFFFFFFF) << 80)
@@ -1,26 +1,56 @@
 import datetime
+import hmac
+import threading
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import logout, authenticate, login
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.models import User
 from django.contrib.sites.shortcuts import get_current_site
-from django.http import HttpRequest, HttpResponseRedirect
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.http import (Http404, HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import render, redirect, get_object_or_404
 from django.template.loader import render_to_string
 from django.urls import reverse_lazy, reverse
+from django.utils import timezone
 from django.utils.encoding import force_bytes, force_str
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.views import generic
+from django.views.decorators.cache import never_cache
 from django.views.decorators.http import require_http_methods
 from django.views.generic import DeleteView, UpdateView, CreateView
 
-from catalog.forms import BookFilterForm, BookInstanceUpdateForm, RenewBookForm, SignUpForm, BookCreateForm
-from catalog.models import Author, Book, BookInstance, Genre
+from catalog.availability import RETRY_MS, read_copies, sse_event
+from catalog.browse import LETTERS, letter_filter, letter_index
+from catalog.circulation import loan_events, month_of, most_borrowed_books, record_loan_events
+from catalog.dedupe import merge_authors, merge_books
+from catalog.desk import DeskError, act, scan
+from catalog.facets import book_facets
+from catalog.forms import (BookFilterForm, BookInstanceUpdateForm, DeskActionForm, LabelSheetForm, RenewBookForm,
+                           SignUpForm, BookCreateForm)
+from catalog.labels import SHEETS, parse_copy_id
+from catalog.metrics import exposition
+from catalog.models import (Author, Book, BookInstance, Branch, DuplicateCandidate, Genre, Stocktake,
+                            StocktakeDiscrepancy)
+from catalog.snapshot import get_snapshot
+from catalog.stocktake import add_scans, fix, reconcile
+from catalog.suggest import suggestions
 from catalog.tokens.tokens import account_activation_token
 
 
+def current_branch(request):
+    """Branch of the signed-in staff member, or None to show every branch."""
+    if not request.user.is_authenticated:
+        return None
+    if not hasattr(request, '_branch'):
+        request._branch = Branch.objects.filter(staff__user=request.user).first()
+    return request._branch
+
+
 def index(request):
     """View function for home page of site."""
 
@@ -38,6 +68,9 @@ def index(request):
     # The 'all()' is implied by default.
     num_authors = Author.objects.count()
 
+    # Most borrowed books of the month, from the loan statistics
+    most_borrowed = most_borrowed_books(month_of(timezone.now()))
+
     # Number of visits to this view, as counted in the session variable.
     num_visits = request.session.get('num_visits', 0)
     request.session['num_visits'] = num_visits + 1
@@ -50,6 +83,7 @@ def index(request):
         'num_genres': num_genres,
         'num_books_contains': num_books_contains,
         'num_visits': num_visits,
+        'most_borrowed': most_borrowed,
     }
     # Render the HTML template index.html with the data in the context variable
     return render(request, 'index.html', context=context)
@@ -65,14 +99,70 @@ def do_logout(request):
     return redirect('index')
 
 
+@never_cache
+def user_fragment(request):
+    """Per-user parts of the pre-rendered pages (see catalog/prerender.py), fetched by base_generic.html."""
+    sidebar = render_to_string('catalog/sidebar_user.html', {'sidebar_next': request.GET.get('next', '/')},
+                               request=request)
+    branch = current_branch(request)
+    return JsonResponse({'sidebar': sidebar, 'perms': sorted(request.user.get_all_permissions()),
+                         'branch': branch.code if branch else None})
+
+
+def book_availability(request, pk):
+    """Under WSGI, stands for the availability stream of catalog/availability.py: the current state
+    of the copies, and a reconnection of the browser's EventSource after RETRY_MS."""
+    body = f'retry: {RETRY_MS}\n\n'.encode() + sse_event(read_copies([pk]), 'snapshot')
+    response = HttpResponse(body, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def title_suggestions(request):
+    """Typeahead suggestions of the search box, from the in-memory index of catalog/suggest.py."""
+    return JsonResponse({'results': suggestions(request.GET.get('q', ''))})
+
+
+@never_cache
+def metrics(request):
+    """Prometheus scrape target, for the bearer of settings.METRICS_TOKEN (see catalog/metrics.py)."""
+    if not settings.METRICS_TOKEN:
+        raise Http404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponse(status=401, headers={'WWW-Authenticate': 'Bearer'})
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class AuthorListView(generic.ListView):
     model = Author
     paginate_by = 10
 
+    def get_queryset(self):
+        query = super().get_queryset()
+        self.letter = self.request.GET.get('letter', '').upper()
+        if len(self.letter) == 1 and self.letter in LETTERS:
+            # Range of the folded names, read in the order of their index
+            query = query.filter(letter_filter('name_key', self.letter)).order_by('name_key', 'pk')
+        else:
+            self.letter = None
+        return query
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['letter'] = self.letter
+        context['letters'] = letter_index('author', self.letter)
+        return context
+
 
 class AuthorDetailView(generic.DetailView):
     model = Author
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # One query for the books (copy counts are columns of Book), one for their genres
+        context['books'] = self.object.book_set.select_related('language').prefetch_related('genre')
+        return context
+
 
 class AuthorCreate(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     model = Author
@@ -106,30 +196,66 @@ class AuthorDelete(LoginRequiredMixin, PermissionRequiredMixin, DeleteView):
 class BookListView(generic.ListView):
     model = Book
     paginate_by = 30
+    queryset = Book.objects.select_related('author')
 
     def __init__(self):
         super().__init__()
-        self.object_list = Book.objects.all()
+        self.object_list = self.get_queryset()
 
     def get(self, request, *args, **kwargs):
         form = BookFilterForm(self.request.GET or None)
+        query, filters = self.get_queryset(), {}
         if form.is_valid():
-            query = Book.objects.all()
-            if form["genre"].value().__len__() != 0 and not None:
-                query = query.filter(genre__in=form.cleaned_data['genre'])
+            if form.cleaned_data['genre']:
+                # One range condition per selected genre covers all its sub-genres. EXISTS rather than
+                # a join, so that a book in several of the selected genres is listed once, without DISTINCT.
+                subtrees = Q()
+                for genre in form.cleaned_data['genre']:
+                    subtrees |= genre.subtree_filter()
+                query = query.filter(Exists(Book.genre.through.objects.filter(subtrees, book=OuterRef('pk'))))
+                filters['genre'] = sorted(genre.pk for genre in form.cleaned_data['genre'])
             if form.cleaned_data['author'] is not None:
-                query = Book.objects.filter(author=form.cleaned_data['author'])
-            if form.cleaned_data['title'] is not None:
+                query = query.filter(author=form.cleaned_data['author'])
+                filters['author'] = form.cleaned_data['author'].pk
+            if form.cleaned_data['title']:
                 query = query.filter(title__icontains=form.cleaned_data['title'])
+                filters['title'] = form.cleaned_data['title']
             if form.cleaned_data['language'] is not None:
                 query = query.filter(language=form.cleaned_data['language'])
-            self.object_list = query
-        return self.render_to_response(self.get_context_data(form=form))
+                filters['language'] = form.cleaned_data['language'].pk
+            # Counters of Book, no join with the copies
+            if form.cleaned_data['available']:
+                query = query.filter(copies_available__gt=0)
+                filters['available'] = True
+            if form.cleaned_data['letter']:
+                query = query.filter(letter_filter('title_key', form.cleaned_data['letter']))
+                filters['letter'] = form.cleaned_data['letter']
+            if form.cleaned_data['order'] == 'available':
+                query = query.order_by('-copies_available', 'title')
+            elif form.cleaned_data['letter']:
+                query = query.order_by('title_key', 'pk')
+        self.object_list = query
+        form.set_facets(book_facets(query, filters))
+        letter = form.cleaned_data['letter'] if form.is_valid() else None
+        return self.render_to_response(self.get_context_data(
+            form=form, letter=letter, letters=letter_index('book', letter)))
 
 
 class BookDetailView(generic.DetailView):
     model = Book
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Precomputed by catalog/recommendations.py
+        context['similar_books'] = self.object.similar_books.select_related('similar')
+        # Pre-rendered pages list every copy; base_generic.html hides the other branches' copies
+        branch = None if getattr(self.request, 'prerendering', False) else current_branch(self.request)
+        copies = self.object.bookinstance_set.all()
+        context['copies'] = copies.for_branch(branch).select_related('branch')
+        context['availability'] = copies.availability()
+        context['availability_stream'] = settings.AVAILABILITY_STREAM
+        return context
+
 
 @login_required
 @permission_required('catalog.can_change_author', raise_exception=True)
@@ -164,7 +290,8 @@ class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+        return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').select_related(
+            'book').order_by('due_back')
 
 
 class BooksOnLoan(LoginRequiredMixin, PermissionRequiredMixin, generic.ListView):
@@ -174,7 +301,8 @@ class BooksOnLoan(LoginRequiredMixin, PermissionRequiredMixin, generic.ListView)
     permission_required = 'catalog.can_mark_returned'
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+        return BookInstance.objects.for_branch(current_branch(self.request)).filter(status__exact='o').select_related(
+            'book', 'borrower').order_by('due_back')
 
 
 @login_required
@@ -192,8 +320,11 @@ def renew_book_librarian(request, pk):
         # Check if the form is valid:
         if form.is_valid():
             # process the data in form.cleaned_data as required (here we just write it to the model due_back field)
+            previous_due_back = book_instance.due_back
             book_instance.due_back = form.cleaned_data['renewal_date']
-            book_instance.save()
+            with transaction.atomic():
+                book_instance.save()
+                record_loan_events(loan_events(book_instance, book_instance.status, previous_due_back))
 
             # redirect to a new URL:
             return HttpResponseRedirect(reverse('all-borrowed'))
@@ -211,12 +342,236 @@ def renew_book_librarian(request, pk):
     return render(request, 'catalog/book_renew_librarian.html', context)
 
 
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def circulation_desk(request):
+    """Scan page of the desk: the page asks desk_scan what was scanned and posts the actions to desk_action."""
+    return render(request, 'catalog/circulation_desk.html', {'form': DeskActionForm()})
+
+
+@never_cache
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def desk_scan(request):
+    """The copy or book of a scanned code (see catalog/desk.py)."""
+    state = scan(request.GET.get('q', ''))
+    if state is None:
+        return JsonResponse({'error': 'No copy or book matches this code.'}, status=404)
+    return JsonResponse(state)
+
+
+@require_http_methods(["POST"])
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def desk_action(request, pk):
+    """Check out, return or renew a copy, and answer with its new state."""
+    form = DeskActionForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({'error': ' '.join(error for errors in form.errors.values() for error in errors)},
+                            status=400)
+    try:
+        act(pk, form.cleaned_data['action'], form.cleaned_data['borrower'], form.cleaned_data['renewal_date'])
+    except DeskError as error:
+        return JsonResponse({'error': str(error)}, status=409)
+    return JsonResponse(scan(str(pk)))
+
+
+def copy_labels(copies):
+    rows = copies.order_by('pk').values_list('pk', 'book__title', 'book__author__last_name', 'book__author__first_name',
+                                             'branch__code')
+    for pk, title, last_name, first_name, branch in rows.iterator(chunk_size=2000):
+        yield {'id': pk, 'title': title or '', 'author': ', '.join(filter(None, [last_name, first_name])),
+               'branch': branch or ''}
+
+
+# Label sheets rendered at once by this process: the others are turned away rather than queued in the pool
+label_sheet_slots = threading.BoundedSemaphore(settings.LABEL_SHEETS)
+
+
+class LabelSheetStream:
+    """The chunks of a label sheet, holding a slot until the response is closed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.released = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.chunks.close()
+        if not self.released:
+            self.released = True
+            label_sheet_slots.release()
+
+
+@login_required
+@permission_required('catalog.can_change_author', raise_exception=True)
+def print_labels(request):
+    """Label sheet of a selection of copies, sent while its pages are rendered (see catalog/labels.py)."""
+    form = LabelSheetForm(request.GET or None)
+    if form.is_valid():
+        copies = form.copies_queryset()
+        if copies.exists():
+            if not label_sheet_slots.acquire(blocking=False):
+                form.add_error(None, 'Other label sheets are being printed, try again in a minute.')
+                response = render(request, 'catalog/label_sheet.html', {'form': form}, status=503)
+                response['Retry-After'] = '60'
+                return response
+            sheet, content_type, extension = SHEETS[form.cleaned_data['format'] or 'pdf']
+            response = StreamingHttpResponse(LabelSheetStream(sheet(copy_labels(copies), settings.LABEL_WORKERS)),
+                                             content_type=content_type)
+            response['Content-Disposition'] = f'inline; filename="labels.{extension}"'
+            return response
+        form.add_error(None, 'No copy matches this selection.')
+    return render(request, 'catalog/label_sheet.html', {'form': form})
+
+
+class DuplicateListView(LoginRequiredMixin, PermissionRequiredMixin, generic.ListView):
+    """Pending duplicate authors and books, found by 'manage.py find_duplicates'."""
+    model = DuplicateCandidate
+    paginate_by = 20
+    permission_required = 'catalog.can_change_author'
+
+    def get_queryset(self):
+        return DuplicateCandidate.objects.filter(dismissed=False)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        candidates = context['object_list']
+        # Both sides of the pairs of the page, with one query per kind
+        ids = {DuplicateCandidate.AUTHOR: set(), DuplicateCandidate.BOOK: set()}
+        for candidate in candidates:
+            ids[candidate.kind].update((candidate.first_id, candidate.second_id))
+        objects = {
+            DuplicateCandidate.AUTHOR: Author.objects.in_bulk(ids[DuplicateCandidate.AUTHOR]),
+            DuplicateCandidate.BOOK: Book.objects.select_related('author').in_bulk(ids[DuplicateCandidate.BOOK]),
+        }
+        for candidate in candidates:
+            candidate.first = objects[candidate.kind].get(candidate.first_id)
+            candidate.second = objects[candidate.kind].get(candidate.second_id)
+            candidate.pair = (candidate.first, candidate.second)
+        return context
+
+
+@require_http_methods(["POST"])
+@login_required
+@permission_required('catalog.can_change_author', raise_exception=True)
+def resolve_duplicate(request, pk):
+    """Merge the pair into its first or second side, or keep both apart."""
+    candidate = get_object_or_404(DuplicateCandidate, pk=pk, dismissed=False)
+    action = request.POST.get('action')
+    if action == 'dismiss':
+        candidate.dismissed = True
+        candidate.save(update_fields=['dismissed'])
+    elif action in ('keep-first', 'keep-second'):
+        model, merge = (Author, merge_authors) if candidate.kind == DuplicateCandidate.AUTHOR else (Book, merge_books)
+        first = get_object_or_404(model, pk=candidate.first_id)
+        second = get_object_or_404(model, pk=candidate.second_id)
+        keep, duplicate = (first, second) if action == 'keep-first' else (second, first)
+        merge(keep, [duplicate])
+        messages.success(request, f'"{duplicate}" merged into "{keep}".')
+    return redirect('duplicates')
+
+
+class StocktakeListView(LoginRequiredMixin, PermissionRequiredMixin, generic.ListView):
+    model = Stocktake
+    paginate_by = 20
+    permission_required = 'catalog.can_mark_returned'
+    queryset = Stocktake.objects.select_related('branch', 'started_by')
+
+
+class StocktakeCreate(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
+    model = Stocktake
+    fields = ['branch']
+    permission_required = 'catalog.can_mark_returned'
+
+    def form_valid(self, form):
+        form.instance.started_by = self.request.user
+        return super().form_valid(form)
+
+
+# Discrepancies listed per kind on the stocktake page
+STOCKTAKE_ROWS = 100
+
+
+def scanned_copy_ids(codes):
+    """Copy ids of the scanned `codes` (one per line), and the codes that aren't one."""
+    copy_ids, invalid = [], []
+    for code in codes.split():
+        copy_id = parse_copy_id(code)
+        if copy_id is None:
+            invalid.append(code)
+        else:
+            copy_ids.append(copy_id)
+    return copy_ids, invalid
+
+
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def stocktake_detail(request, pk):
+    """Scans, reconciliation and fixes of a stocktake (see catalog/stocktake.py)."""
+    stocktake = get_object_or_404(Stocktake.objects.select_related('branch'), pk=pk)
+    if request.method == 'POST':
+        action = request.POST.get('action')
+        if stocktake.closed_at is not None:
+            messages.error(request, 'This stocktake is closed.')
+        elif action == 'scan':
+            copy_ids, invalid = scanned_copy_ids(request.POST.get('codes', ''))
+            add_scans(stocktake, copy_ids)
+            messages.info(request, f'{len(copy_ids)} copies scanned.')
+            if invalid:
+                messages.warning(request, f'Not copy ids: {" ".join(invalid[:20])}')
+        elif action == 'reconcile':
+            counts = reconcile(stocktake)
+            messages.info(request, ', '.join(f'{counts[kind]} {label.lower()}'
+                                             for kind, label in StocktakeDiscrepancy.KINDS))
+        elif action in dict(StocktakeDiscrepancy.KINDS):
+            messages.info(request, f'{fix(stocktake, action)} copies changed.')
+        elif action == 'close':
+            stocktake.closed_at = timezone.now()
+            stocktake.save(update_fields=['closed_at'])
+        return redirect(stocktake)
+    discrepancies = []
+    for kind, label in StocktakeDiscrepancy.KINDS:
+        rows = stocktake.discrepancies.filter(kind=kind, fixed=False)
+        count = rows.count()
+        rows = list(rows[:STOCKTAKE_ROWS])
+        discrepancies.append({'kind': kind, 'label': label, 'count': count, 'rows': rows, 'more': count - len(rows)})
+    # The copies of the rows shown, with their books, in one query
+    copies = BookInstance.objects.select_related('book', 'branch').in_bulk(
+        [row.copy_id for group in discrepancies for row in group['rows']])
+    for group in discrepancies:
+        for row in group['rows']:
+            row.copy = copies.get(row.copy_id)
+    return render(request, 'catalog/stocktake_detail.html', {'stocktake': stocktake, 'discrepancies': discrepancies})
+
+
+@require_http_methods(["POST"])
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def stocktake_scans(request, pk):
+    """Append a batch of scans sent by the stocktake page, and answer with the number of scans so far."""
+    stocktake = get_object_or_404(Stocktake, pk=pk, closed_at__isnull=True)
+    copy_ids, invalid = scanned_copy_ids(request.POST.get('codes', ''))
+    add_scans(stocktake, copy_ids)
+    stocktake.refresh_from_db(fields=['scans'])
+    return JsonResponse({'scans': stocktake.scans, 'invalid': invalid})
+
+
 class BookInstanceUpdate(LoginRequiredMixin, PermissionRequiredMixin, UpdateView):
     model = BookInstance
     permission_required = 'catalog.can_change_author'
     form_class = BookInstanceUpdateForm
     success_url = reverse_lazy('books')
 
+    @transaction.atomic
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        # form.initial holds the copy as it was before the update
+        record_loan_events(loan_events(self.object, form.initial['status'], form.initial['due_back']))
+        return response
+
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
         context = super().get_context_data(**kwargs)
@@ -232,19 +587,34 @@ class BookInstanceDelete(LoginRequiredMixin, PermissionRequiredMixin, DeleteView
 
 class BookInstanceCreate(LoginRequiredMixin, PermissionRequiredMixin, CreateView):
     model = BookInstance
-    fields = ['book', 'imprint', 'due_back', 'borrower', 'status']
+    fields = ['book', 'imprint', 'branch', 'due_back', 'borrower', 'status']
     permission_required = 'catalog.can_change_author'
     success_url = reverse_lazy('book-detail')
 
+    @transaction.atomic
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        record_loan_events(loan_events(self.object, None, None))
+        return response
+
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
         context = super().get_context_data(**kwargs)
         context['title'] = 'add'
         return context
 
+    def get_form(self, form_class=None):
+        form = super().get_form(form_class)
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            # Every title of the catalog: read from the snapshot shared by the workers
+            form.fields['book'].choices = [('', form.fields['book'].empty_label), *snapshot['book'].choices()]
+        return form
+
     def get_initial(self):
         initial = super().get_initial()
         initial['book'] = Book.objects.get(pk=self.kwargs['id']) if self.kwargs.__len__() != 0 else ''
+        initial['branch'] = current_branch(self.request)
         return initial.copy()
 
     def get_success_url(self):
@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up
+from catalog.availability import STREAM_PATH, stream_app  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Availability streams are long lived: served outside of Django's request cycle (see catalog/availability.py)
+    if scope['type'] == 'http' and scope['method'] == 'GET' and STREAM_PATH.match(scope['path']):
+        return await stream_app(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -0,0 +1,55 @@
+"""
+Production profile of gunicorn, used by the Procfile:
+
+    gunicorn -c python:locallibrary.gunicorn_conf locallibrary.wsgi
+
+The master loads the application (preload_app) and warms it up (locallibrary/warmup.py)
+before forking the workers: they start with the URL resolvers built, the templates
+compiled and the catalog caches filled, in memory shared with the master until written
+to. Each worker starts with an empty per-process cache: the master's copy of it would
+never hear of the changes made after the fork. Workers are recycled after max_requests,
+with jitter so they don't all restart at once.
+
+Sizing follows the cores the process may run on: 2 x cores + 1 workers of 2 threads.
+WEB_CONCURRENCY (set by Heroku from the dyno size) and GUNICORN_THREADS override it.
+"""
+import os
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # Not on Linux
+        return os.cpu_count() or 1
+
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * available_cores() + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 2))
+worker_class = 'gthread'
+preload_app = True
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+timeout = 30
+keepalive = 5
+# Worker heartbeats in memory rather than on a possibly slow disk
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+errorlog = '-'
+
+
+def when_ready(server):
+    # In the master, once the application is loaded, before the first fork
+    from locallibrary.warmup import warm_up
+
+    warm_up(server.log.info)
+
+
+def post_fork(server, worker):
+    from django.core.cache import caches
+    from django.db import connections
+
+    # Opened by the master after the warm-up (e.g. by a signal receiver): not to be shared
+    connections.close_all()
+    # Filled by the master, e.g. while loading the application: its invalidations would only reach the master
+    caches['default'].clear()
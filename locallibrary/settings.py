@@ -12,7 +12,8 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 
 from pathlib import Path
 import os  # needed by code below
-from dotenv import load_dotenv, find_dotenv  # for secret key security
+import tempfile
+from dotenv import load_dotenv  # for secret key security
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -23,7 +24,12 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 # SECURITY WARNING: keep the secret key used in production secret!
 # SECRET_KEY = 'django-insecure-qiv(2j7&&f)jf8o32astls*_-_dt2m3^(*)dn$8$u3u2*5eb3#'
-load_dotenv(find_dotenv())
+# The .env of the project, next to the settings or at the root, where find_dotenv() would have found it
+# first, without its walk up the directories from the caller's frame
+for dotenv_path in (Path(__file__).resolve().parent / '.env', BASE_DIR / '.env'):
+    if dotenv_path.is_file():
+        load_dotenv(dotenv_path)
+        break
 
 SECRET_KEY = os.environ['SECRET_KEY']
 
@@ -54,14 +60,19 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'catalog.apps.CatalogConfig',
+    'mptt',
     'django_cleanup.apps.CleanupConfig',
 ]
 
 MIDDLEWARE = [
+    'catalog.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'catalog.prerender.PrerenderedPageMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'catalog.routers.ReplicaStickinessMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'catalog.throttling.ThrottleMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -81,6 +92,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'catalog.permissions.catalog_permissions',
             ],
         },
     },
@@ -99,6 +111,9 @@ DATABASES = {
     }
 }
 
+# Permission sets of the users are kept in the cache (see catalog/permissions.py)
+AUTHENTICATION_BACKENDS = ['catalog.permissions.CachedPermissionBackend']
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -136,6 +151,16 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 STATIC_URL = '/static/'
 
+# Pre-rendered book and author pages, written by 'manage.py prerender_catalog'.
+# A front proxy can serve them directly, e.g. nginx: try_files /prerendered/book-detail/$pk.html @django
+PRERENDER_ROOT = BASE_DIR / 'prerendered'
+
+# Memory-mapped names of the catalog shared by the workers, created by 'manage.py build_snapshot'
+SNAPSHOT_DIR = BASE_DIR / 'snapshot'
+
+# Tests don't touch the two directories above (see catalog/tests/runner.py)
+TEST_RUNNER = 'catalog.tests.runner.CatalogTestRunner'
+
 # config/settings.py
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -154,6 +179,74 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
+# Read replicas for the catalog, as space separated database URLs.
+# Local test with two SQLite files: cp db.sqlite3 replica.sqlite3
+# and export DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3
+DATABASE_REPLICAS = []
+for replica_number, replica_url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(), start=1):
+    DATABASES[f'replica{replica_number}'] = dj_database_url.parse(replica_url, conn_max_age=500)
+    DATABASES[f'replica{replica_number}']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(f'replica{replica_number}')
+
+# SQLite databases use the tuned backend of locallibrary/sqlite3 (WAL, pragmas, BEGIN IMMEDIATE)
+for database in DATABASES.values():
+    if database['ENGINE'] == 'django.db.backends.sqlite3':
+        database['ENGINE'] = 'locallibrary.sqlite3'
+        database.setdefault('OPTIONS', {})['transaction_mode'] = 'IMMEDIATE'
+
+DATABASE_ROUTERS = ['catalog.routers.PrimaryReplicaRouter']
+
+# Seconds a session keeps reading from the primary after it wrote to the catalog
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 15))
+
+# Token bucket limits of the account endpoints, by URL name (see catalog/throttling.py).
+# Scopes: 'ip', or the POST field / URL argument naming the account.
+THROTTLES = {
+    'login': {'rates': {'ip': '30/m', 'username': '10/h'}},
+    'register': {'rates': {'ip': '10/h', 'email': '3/h'}},
+    'activate': {'rates': {'ip': '30/h', 'uidb64': '10/h'}, 'methods': ('GET', 'POST')},
+}
+# Shared by the workers: with a cache per process, each one would allow the whole rate
+THROTTLE_CACHE = 'shared'
+# Reverse proxies in front of the application adding to X-Forwarded-For: Heroku's router when deployed,
+# none while debugging. Too few and every client shares the bucket of the proxy's address.
+THROTTLE_TRUSTED_PROXIES = int(os.environ.get('THROTTLE_TRUSTED_PROXIES', 0 if DEBUG else 1))
+
+# Book pages follow the availability of their copies live (see catalog/availability.py) only when
+# the ASGI application serves the streams, e.g. with uvicorn installed:
+# web: gunicorn locallibrary.asgi -k uvicorn.workers.UvicornWorker
+AVAILABILITY_STREAM = os.environ.get('AVAILABILITY_STREAM', '') == 'True'
+
+# Processes of each web worker rendering the pages of label sheets (see catalog/labels.py); 0 renders in the
+# request's process
+LABEL_WORKERS = int(os.environ.get('LABEL_WORKERS', 2))
+# Label sheets rendered at once by a web worker, sharing its processes; more are answered 503
+LABEL_SHEETS = int(os.environ.get('LABEL_SHEETS', 2))
+
+# Counters of the gunicorn workers, one file each, added up by the `metrics` view (see catalog/metrics.py)
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'locallibrary-metrics'))
+# Bearer token of the scraper; /metrics answers 404 while it is empty
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# 'shared' holds what every worker must see the same (see catalog/caching.py): Redis when
+# REDIS_URL is set, else the table of 'manage.py createcachetable' (run by the release phase
+# of the Procfile); the process's memory while debugging, with a single process.
+if os.environ.get('REDIS_URL'):
+    SHARED_CACHE = {'BACKEND': 'catalog.metrics.MeteredRedisCache', 'LOCATION': os.environ['REDIS_URL']}
+elif DEBUG:
+    SHARED_CACHE = {'BACKEND': 'catalog.metrics.MeteredLocMemCache', 'LOCATION': 'shared'}
+else:
+    SHARED_CACHE = {'BACKEND': 'catalog.metrics.MeteredDatabaseCache', 'LOCATION': 'catalog_cache'}
+
+CACHES = {
+    'default': {
+        # LocMemCache counting its hits and misses: each process has its own
+        'BACKEND': 'catalog.metrics.MeteredLocMemCache',
+    },
+    'shared': SHARED_CACHE,
+}
+
 # Simplified static file serving.
 # https://pypi.org/project/whitenoise/
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+# Purges the vendored Bootstrap and writes css/critical.css before hashing and compressing (gzip, Brotli)
+STATICFILES_STORAGE = 'catalog.storage.PurgedCompressedManifestStaticFilesStorage'
@@ -0,0 +1,43 @@
+"""
+SQLite backend tuned for serving the site from several gunicorn workers.
+
+Same as django.db.backends.sqlite3 with two extra OPTIONS:
+
+* 'pragmas': dict of PRAGMA name -> value run on every new connection
+  (WAL journal so that readers don't wait for writers, busy_timeout, cache sizes...).
+* 'transaction_mode': 'IMMEDIATE' starts atomic() blocks with BEGIN IMMEDIATE. The
+  write lock is taken up front, so concurrent checkouts wait for busy_timeout instead
+  of failing with "database is locked" when a read lock can't be upgraded.
+"""
+from django.db.backends.sqlite3 import base
+
+# Used when OPTIONS has no 'pragmas'
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,  # ms
+    'cache_size': -20000,  # negative = KiB, so 20 MB
+    'mmap_size': 134217728,  # 128 MB
+    'temp_store': 'MEMORY',
+}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # Our options are not sqlite3.connect() arguments
+        self.pragmas = kwargs.pop('pragmas', DEFAULT_PRAGMAS)
+        self.transaction_mode = kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {pragma} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode:
+            self.cursor().execute(f'BEGIN {self.transaction_mode}')
+        else:
+            super()._start_transaction_under_autocommit()
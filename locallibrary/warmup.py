@@ -0,0 +1,85 @@
+"""
+Work done once by the gunicorn master before it forks the workers (see gunicorn_conf.py).
+
+Without it, each worker pays on its first requests for the URL resolvers, the template
+compilation, the static files manifest and the catalog caches. Done before forking, it
+is paid once, and the memory it fills is shared by the workers until they write to it.
+
+Only caches the workers can tell are stale are primed: the counts go to the shared cache
+(see catalog/caching.py), the suggestion index checks the shared version on every use.
+The workers clear the per-process cache when they start (see post_fork in gunicorn_conf.py).
+"""
+import time
+from pathlib import Path
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db import DatabaseError, connections
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.urls import URLResolver, get_resolver
+
+
+def resolve_urls(resolver=None):
+    """Build the lookups of every URLconf, included ones (admin, accounts) too."""
+    resolver = resolver or get_resolver()
+    count = len(resolver.reverse_dict)
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            count += resolve_urls(pattern)
+    return count
+
+
+def compile_templates():
+    """Load every template of the project and apps into the cached template loader."""
+    engine = engines['django']
+    names = {path.relative_to(directory).as_posix()
+             for directory in engine.template_dirs for path in Path(directory).rglob('*.html')}
+    compiled = 0
+    for name in sorted(names):
+        try:
+            engine.get_template(name)
+            compiled += 1
+        except (TemplateDoesNotExist, TemplateSyntaxError):
+            # Templates of the contrib apps needing what this project doesn't install
+            pass
+    return compiled
+
+
+def load_static_manifest():
+    # The manifest is read when the storage is created
+    return len(getattr(staticfiles_storage, 'hashed_files', {}))
+
+
+def prime_caches():
+    from catalog import browse, genres, snapshot, suggest
+
+    # Checked against the version of the shared cache: catches up with the changes made since
+    suggest.warm()
+    # In the shared cache, for the workers of every dyno
+    genres.genre_book_counts()
+    for kind in browse.BROWSE:
+        browse.letter_counts(kind)
+    # The master is the first leader of the snapshot: the workers map what it wrote
+    snapshot.build()
+    return len(snapshot.get_snapshot()['book'])
+
+
+STEPS = [
+    ('URL patterns', resolve_urls),
+    ('templates', compile_templates),
+    ('static files', load_static_manifest),
+    ('catalog caches', prime_caches),
+]
+
+
+def warm_up(log=print):
+    for label, step in STEPS:
+        start = time.perf_counter()
+        try:
+            count = step()
+        except DatabaseError as error:
+            # Not migrated yet, or unreachable: the workers will fill their caches themselves
+            log(f'Warm-up: {label} skipped ({error})')
+            continue
+        log(f'Warm-up: {count} {label} in {(time.perf_counter() - start) * 1000:.0f} ms')
+    # Forked workers must not share the master's database connections
+    connections.close_all()